@@ -0,0 +1,81 @@
+"""Measures the overhead of a cache hit in ``cogs.utils.cache``.
+
+Compares the old ``repr`` joined string keys against the tuple keys
+along with the cost of ``invalidate_containing`` on a full cache.
+
+Run from the repository root: ``python -m benchmarks.cache_hit_path``
+"""
+
+import asyncio
+import timeit
+
+from cogs.utils import cache
+
+class FakeCog:
+    def __repr__(self):
+        return '<cogs.Fake>'
+
+    @cache.cache(maxsize=1024)
+    def get_guild_config(self, guild_id):
+        return guild_id
+
+    @cache.cache(maxsize=1024)
+    async def get_guild_config_async(self, guild_id):
+        return guild_id
+
+    @cache.cache(maxsize=1024, ignore_kwargs=True)
+    def is_plonked(self, guild_id, member_id, *, connection=None):
+        return False
+
+def _old_make_key(func, args, kwargs):
+    # the previous key implementation, kept here for comparison
+    def _true_repr(o):
+        if o.__class__.__repr__ is object.__repr__:
+            return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
+        return repr(o)
+
+    key = [ f'{func.__module__}.{func.__name__}' ]
+    key.extend(_true_repr(o) for o in args)
+    for k, v in kwargs.items():
+        if k == 'connection':
+            continue
+        key.append(_true_repr(k))
+        key.append(_true_repr(v))
+    return ':'.join(key)
+
+def report(name, seconds, number):
+    print(f'{name:<40} {seconds / number * 1e9:>8.0f} ns/op')
+
+def main():
+    number = 200_000
+    cog = FakeCog()
+    guild_id = 336642139381301249
+    cog.get_guild_config(guild_id)
+
+    report('old string key', timeit.timeit(lambda: _old_make_key(FakeCog.get_guild_config, (cog, guild_id), {}), number=number), number)
+    report('tuple key', timeit.timeit(lambda: FakeCog.get_guild_config.get_key(cog, guild_id), number=number), number)
+    report('sync hit', timeit.timeit(lambda: cog.get_guild_config(guild_id), number=number), number)
+
+    async def async_hits():
+        await cog.get_guild_config_async(guild_id)
+        start = timeit.default_timer()
+        for _ in range(number):
+            await cog.get_guild_config_async(guild_id)
+        return timeit.default_timer() - start
+
+    report('async hit', asyncio.run(async_hits()), number)
+
+    # 1000 guilds with a single member each, then invalidate one guild
+    def fill():
+        for i in range(1000):
+            cog.is_plonked(i, i + 1_000_000)
+
+    fill()
+    def invalidate():
+        FakeCog.is_plonked.invalidate_containing(500)
+        cog.is_plonked(500, 1_000_500)
+
+    report('invalidate_containing (1000 entries)', timeit.timeit(invalidate, number=10_000), 10_000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measures the cost of encoding and decoding ``jsonb`` values.
+
+Compares the old text codec (stdlib ``json`` with default separators)
+against :class:`cogs.utils.db.JSONCodec` using the binary format, with
+orjson if it is installed.
+
+The payloads mirror what we actually store: a reminder's ``extra``
+column, the per-guild muted member arrays from the mod batch and the
+emoji usage batch.
+
+Run from the repository root: ``python -m benchmarks.jsonb_codec``
+"""
+
+import datetime
+import json
+import random
+import timeit
+
+from cogs.utils import db
+
+def reminder_extra():
+    now = datetime.datetime.utcnow()
+    return {
+        'args': [str(random.getrandbits(63)), str(random.getrandbits(63)), 'take the bread out of the oven ' * 4],
+        'kwargs': {'created': now.isoformat(), 'message_id': random.getrandbits(63)},
+    }
+
+def mute_batch(guilds=50, members=40):
+    return [
+        {'guild_id': random.getrandbits(63), 'result_array': [random.getrandbits(63) for _ in range(members)]}
+        for _ in range(guilds)
+    ]
+
+def emoji_batch(rows=500):
+    return [
+        {'guild': random.getrandbits(63), 'emoji': random.getrandbits(63), 'added': random.randint(1, 50)}
+        for _ in range(rows)
+    ]
+
+def old_encode(value):
+    return json.dumps(value)
+
+def old_decode(value):
+    return json.loads(value)
+
+def report(name, seconds, number):
+    print(f'{name:<40} {seconds / number * 1e6:>10.2f} us/op')
+
+def main():
+    random.seed(0)
+    payloads = {
+        'reminder extra': (reminder_extra(), 100_000),
+        'mute batch': (mute_batch(), 1_000),
+        'emoji batch': (emoji_batch(), 1_000),
+    }
+
+    codecs = [db.JSONCodec.stdlib()]
+    if db.orjson is not None:
+        codecs.append(db.JSONCodec.orjson())
+    else:
+        print('orjson is not installed, only comparing against the stdlib.\n')
+
+    for label, (payload, number) in payloads.items():
+        encoded = old_encode(payload)
+        print(f'{label} ({len(encoded)} bytes)')
+        report('  text json encode', timeit.timeit(lambda: old_encode(payload), number=number), number)
+        report('  text json decode', timeit.timeit(lambda: old_decode(encoded), number=number), number)
+
+        for codec in codecs:
+            data = codec.encode(payload)
+            assert codec.decode(data) == payload
+            report(f'  binary {codec.name} encode', timeit.timeit(lambda: codec.encode(payload), number=number), number)
+            report(f'  binary {codec.name} decode', timeit.timeit(lambda: codec.decode(data), number=number), number)
+
+        print()
+
+if __name__ == '__main__':
+    main()
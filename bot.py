@@ -1,6 +1,6 @@
 from discord.ext import commands
 import discord
-from cogs.utils import checks, context, db
+from cogs.utils import checks, context, db, cache, querystats
 from cogs.utils.config import Config
 import datetime, re
 import json, asyncio
@@ -70,6 +70,7 @@ class RoBoPug(commands.AutoShardedBot):
         self.vote_skip = config.vote_skip
         self.vote_skip_ratio = config.vote_skip_ratio
         self.challonge_api_key = config.challonge_api_key
+        querystats.recorder.slow_threshold = getattr(config, 'slow_query_threshold', 0.5)
         self.session = aiohttp.ClientSession(loop=self.loop)
         
 
@@ -81,12 +82,12 @@ class RoBoPug(commands.AutoShardedBot):
         self.identifies = defaultdict(list)
 
         # guild_id: list
-        self.prefixes = Config('prefixes.json')
+        self.prefixes = Config('prefixes.json', journal=True)
 
         # guild_id and user_id mapped to True
         # these are users and guilds globally blacklisted
         # from using the bot
-        self.blacklist = Config('blacklist.json')
+        self.blacklist = Config('blacklist.json', journal=True)
 
         # in case of even further spam, add a cooldown mapping
         # for people who excessively spam commands
@@ -279,9 +280,32 @@ class RoBoPug(commands.AutoShardedBot):
                 for member in members:
                     yield member
 
+    async def warm_caches(self, *, chunk_size=500):
+        """Primes every cache with a bulk loader for all visible guilds.
+
+        This is done one chunk and one cache at a time so that it never holds
+        more than a single connection from the pool.
+        """
+        guild_ids = [g.id for g in self.guilds]
+        for cog in list(self.cogs.values()):
+            for attr in vars(type(cog)).values():
+                prime = getattr(attr, 'prime', None)
+                if prime is None or not attr.has_bulk_loader():
+                    continue
+
+                primed = 0
+                for index in range(0, len(guild_ids), chunk_size):
+                    try:
+                        primed += await prime(cog, guild_ids[index:index + chunk_size])
+                    except Exception:
+                        log.exception('Failed to warm up %s', attr.__qualname__)
+                        break
+                log.info('Warmed up %s entries for %s', primed, attr.__qualname__)
+
     async def on_ready(self):
         if not hasattr(self, 'uptime'):
             self.uptime = datetime.datetime.utcnow()
+            self.loop.create_task(self.warm_caches())
 
         print(f'Ready: {self.user} (ID: {self.user.id})')
 
@@ -339,6 +363,7 @@ class RoBoPug(commands.AutoShardedBot):
         else:
             self._auto_spam_count.pop(author_id, None)
 
+        querystats.origin.set(f'{ctx.command.cog_name or "no cog"}:{ctx.command.qualified_name}')
         try:
             await self.invoke(ctx)
         finally:
@@ -354,8 +379,20 @@ class RoBoPug(commands.AutoShardedBot):
         if guild.id in self.blacklist:
             await guild.leave()
 
+    async def on_guild_remove(self, guild):
+        cache.guild_state.purge_guild(guild.id)
+
+    async def on_guild_channel_delete(self, channel):
+        cache.guild_state.purge_channel(channel.id)
+
     async def close(self):
         await super().close()
+        if hasattr(self, 'invalidation'):
+            await self.invalidation.close()
+        if hasattr(self, 'pool_manager'):
+            self.pool_manager.stop()
+        if getattr(self, 'read_pool', None) is not None:
+            await self.read_pool.close()
         await self.session.close()
 
     def run(self):
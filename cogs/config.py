@@ -1,20 +1,21 @@
 from discord.ext import commands, menus
 from .utils import db, checks, cache
-from .utils.paginator import RoboPages
+from .utils.paginator import RoboPages, LazyPageSource
 
 from collections import defaultdict
 from typing import Optional
 import discord
 
 async def plonk_iterator(bot, guild, records):
-    for record in records:
+    async for record in records:
         entity_id = record[0]
         resolved = guild.get_channel(entity_id) or await bot.get_or_fetch_member(guild, entity_id)
         if resolved is None:
             yield f'<Not Found: {entity_id}>'
-        yield str(resolved)
+        else:
+            yield str(resolved)
 
-class PlonkedPageSource(menus.AsyncIteratorPageSource):
+class PlonkedPageSource(LazyPageSource):
     def __init__(self, bot, guild, records):
         super().__init__(plonk_iterator(bot, guild, records), per_page=20)
 
@@ -172,7 +173,17 @@ class Config(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    @cache.cache(strategy=cache.Strategy.lru, maxsize=1024, ignore_kwargs=True)
+        # these run for every command invocation
+        query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id=$2;"
+        db.prepared.register('config.is_plonked', query)
+        query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id IN ($2, $3);"
+        db.prepared.register('config.is_plonked_channel', query)
+
+    def cog_unload(self):
+        db.prepared.unregister('config.is_plonked')
+        db.prepared.unregister('config.is_plonked_channel')
+
+    @cache.cache(strategy=cache.Strategy.lru, maxsize=1024, ignore_kwargs=True, name='config.plonks')
     async def is_plonked(self, guild_id, member_id, channel_id=None, *, connection=None, check_bypass=True):
         if member_id in self.bot.blacklist or guild_id in self.bot.blacklist:
             return True
@@ -187,11 +198,9 @@ class Config(commands.Cog):
         connection = connection or self.bot.pool
 
         if channel_id is None:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id=$2;"
-            row = await connection.fetchrow(query, guild_id, member_id)
+            row = await db.prepared.fetchrow(connection, 'config.is_plonked', guild_id, member_id)
         else:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id IN ($2, $3);"
-            row = await connection.fetchrow(query, guild_id, member_id, channel_id)
+            row = await db.prepared.fetchrow(connection, 'config.is_plonked_channel', guild_id, member_id, channel_id)
 
         return row is not None
 
@@ -215,7 +224,7 @@ class Config(commands.Cog):
 
         return not is_plonked
 
-    @cache.cache()
+    @cache.cache(maxsize=1024, strategy=cache.Strategy.stale, name='config.command_permissions')
     async def get_command_permissions(self, guild_id, *, connection=None):
         connection = connection or self.bot.pool
         query = "SELECT name, channel_id, whitelist FROM command_config WHERE guild_id=$1;"
@@ -223,6 +232,20 @@ class Config(commands.Cog):
         records = await connection.fetch(query, guild_id)
         return ResolvedCommandPermissions(guild_id, records)
 
+    @get_command_permissions.bulk_loader
+    async def get_all_command_permissions(self, guild_ids):
+        query = "SELECT guild_id, name, channel_id, whitelist FROM command_config WHERE guild_id = ANY($1::bigint[]);"
+        records = await self.bot.pool.fetch(query, guild_ids)
+
+        grouped = defaultdict(list)
+        for guild_id, name, channel_id, whitelist in records:
+            grouped[guild_id].append((name, channel_id, whitelist))
+
+        return {
+            guild_id: ResolvedCommandPermissions(guild_id, grouped[guild_id])
+            for guild_id in guild_ids
+        }
+
     async def bot_check(self, ctx):
         if ctx.guild is None:
             return True
@@ -248,8 +271,8 @@ class Config(commands.Cog):
                 # do a bulk COPY
                 await ctx.db.copy_records_to_table('plonks', columns=('guild_id', 'entity_id'), records=to_insert)
 
-                # invalidate the cache for this guild
-                self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        # invalidate the cache for this guild once the rows are visible to everyone
+        self.is_plonked.invalidate_containing(ctx.guild.id)
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -280,7 +303,7 @@ class Config(commands.Cog):
             await ctx.db.execute(query, ctx.guild.id, ctx.channel.id)
 
             # invalidate the cache for this guild
-            self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+            self.is_plonked.invalidate_containing(ctx.guild.id)
         else:
             await self._bulk_ignore_entries(ctx, entities)
 
@@ -295,17 +318,15 @@ class Config(commands.Cog):
         To use this command you must have Manage Server permissions.
         """
 
-        query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
+        query = "SELECT entity_id FROM plonks WHERE guild_id=$1"
 
         guild = ctx.guild
-        records = await ctx.db.fetch(query, guild.id)
-
-        if len(records) == 0:
-            return await ctx.send('I am not ignoring anything here.')
-
         await ctx.release()
-
+        records = db.KeysetPaginator(ctx.pool, query, guild.id, key=('entity_id',))
         source = PlonkedPageSource(self.bot, guild, records)
+        if await source.is_empty():
+            return await ctx.send('I am not ignoring anything here.')
+
         try:
             await RoboPages(source).start(ctx)
         except menus.MenuError as e:
@@ -335,7 +356,7 @@ class Config(commands.Cog):
 
         query = "DELETE FROM plonks WHERE guild_id=$1;"
         await ctx.db.execute(query, ctx.guild.id)
-        self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self.is_plonked.invalidate_containing(ctx.guild.id)
         await ctx.send('Successfully cleared all ignores.')
 
     @config.group(pass_context=True, invoke_without_command=True, aliases=['unplonk'])
@@ -356,7 +377,7 @@ class Config(commands.Cog):
             entities = [c.id for c in entities]
             await ctx.db.execute(query, ctx.guild.id, entities)
 
-        self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self.is_plonked.invalidate_containing(ctx.guild.id)
         await ctx.send(ctx.tick(True))
 
     @unignore.command(name='all')
@@ -378,9 +399,6 @@ class Config(commands.Cog):
         pass
 
     async def command_toggle(self, connection, guild_id, channel_id, name, *, whitelist=True):
-        # clear the cache
-        self.get_command_permissions.invalidate(self, guild_id)
-
         if channel_id is None:
             subcheck = 'channel_id IS NULL'
             args = (guild_id, name)
@@ -403,6 +421,9 @@ class Config(commands.Cog):
                 msg = 'This command is already disabled.' if not whitelist else 'This command is already explicitly enabled.'
                 raise RuntimeError(msg)
 
+        # clear the cache now that the change is committed
+        self.get_command_permissions.invalidate(self, guild_id)
+
     @channel.command(name='disable')
     async def channel_disable(self, ctx, *, command: CommandName):
         """Disables a command for this channel."""
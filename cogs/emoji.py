@@ -1,5 +1,6 @@
 from discord.ext import commands, tasks
 from .utils import db, checks
+from .utils.batch import BatchWriter, Overflow
 
 from collections import Counter, defaultdict
 
@@ -107,35 +108,27 @@ class Emoji(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self._batch_of_data = defaultdict(Counter)
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
-        self.bulk_insert.add_exception_type(asyncpg.PostgresConnectionError)
-        self.bulk_insert.start()
+        self._batch_writer = BatchWriter(self.bulk_insert, factory=lambda: defaultdict(Counter),
+                                         add=lambda batch, item: batch[item[0]].update(item[1]),
+                                         interval=60.0, max_pending=100000, overflow=Overflow.drop,
+                                         name='emoji.stats', loop=bot.loop)
+        self._batch_writer.start()
 
     def cog_unload(self):
-        self.bulk_insert.stop()
+        self._batch_writer.stop()
 
     async def cog_command_error(self, ctx, error):
        if isinstance(error, commands.BadArgument):
             await ctx.send(error)
 
-    @tasks.loop(seconds=60.0)
-    async def bulk_insert(self):
-        query = """INSERT INTO emoji_stats (guild_id, emoji_id, total)
-                   SELECT x.guild, x.emoji, x.added
-                   FROM jsonb_to_recordset($1::jsonb) AS x(guild BIGINT, emoji BIGINT, added INT)
-                   ON CONFLICT (guild_id, emoji_id) DO UPDATE
-                   SET total = emoji_stats.total + excluded.total;
-                """
-
-        async with self._batch_lock:
-            transformed = [
-                {'guild': guild_id, 'emoji': emoji_id, 'added': count}
-                for guild_id, data in self._batch_of_data.items()
-                for emoji_id, count in data.items()
-            ]
-            self._batch_of_data.clear()
-            await self.bot.pool.execute(query, transformed)
+    async def bulk_insert(self, batch):
+        transformed = [
+            {'guild_id': guild_id, 'emoji_id': emoji_id, 'total': count}
+            for guild_id, data in batch.items()
+            for emoji_id, count in data.items()
+        ]
+        await EmojiStats.insert_many(transformed, conflict=('guild_id', 'emoji_id'),
+                                     update={'total': 'emoji_stats.total + excluded.total'})
 
     async def do_redirect(self, message):
         if len(message.attachments) == 0:
@@ -169,8 +162,7 @@ class Emoji(commands.Cog):
         if not matches:
             return
 
-        async with self._batch_lock:
-            self._batch_of_data[message.guild.id].update(map(int, matches))
+        await self._batch_writer.put((message.guild.id, map(int, matches)))
 
     @commands.Cog.listener()
     async def on_guild_emojis_update(self, guild, before, after):
@@ -1,5 +1,6 @@
 from discord.ext import commands, tasks
 from .utils import checks, db, time, cache
+from .utils.batch import BatchWriter, Overflow
 from .utils.formats import plural
 from collections import Counter, defaultdict
 from inspect import cleandoc
@@ -131,6 +132,16 @@ class ActionReason(commands.Converter):
             raise commands.BadArgument(f'Reason is too long ({len(argument)}/{reason_max})')
         return ret
 
+def format_failures(failures, *, limit=10):
+    """Formats (target, HTTPException) pairs as a list of what failed and why."""
+    lines = [
+        f'- {discord.utils.escape_mentions(str(target))}: {error.text or error.__class__.__name__}'
+        for target, error in failures[:limit]
+    ]
+    if len(failures) > limit:
+        lines.append(f'- and {len(failures) - limit} more')
+    return '\n'.join(lines)
+
 def safe_reason_append(base, to_append):
     appended = base + f'({to_append})'
     if len(appended) > 512:
@@ -247,11 +258,12 @@ class Mod(commands.Cog):
         # guild_id: List[(member_id, insertion)]
         # A batch of data for bulk inserting mute role changes
         # True - insert, False - remove
-        self._data_batch = defaultdict(list)
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
+        self._mute_writer = BatchWriter(self.bulk_insert, factory=lambda: defaultdict(list),
+                                        add=lambda batch, item: batch[item[0]].append(item[1:]),
+                                        interval=15.0, max_pending=10000, overflow=Overflow.block,
+                                        name='mod.muted_members', loop=bot.loop)
+        self._mute_writer.start()
         self._disable_lock = asyncio.Lock(loop=bot.loop)
-        self.batch_updates.add_exception_type(asyncpg.PostgresConnectionError)
-        self.batch_updates.start()
 
         # (guild_id, channel_id): List[str]
         # A batch list of message content for message
@@ -259,12 +271,23 @@ class Mod(commands.Cog):
         self._batch_message_lock = asyncio.Lock(loop=bot.loop)
         self.bulk_send_messages.start()
 
+        cache.guild_state.register('mod.spam_check', self._spam_check)
+        cache.guild_state.register('mod.message_batches', self.message_batches,
+                                   purge_guild=lambda guild_id: self._purge_message_batches(0, guild_id),
+                                   purge_channel=lambda channel_id: self._purge_message_batches(1, channel_id))
+
     def __repr__(self):
         return '<cogs.Mod>'
 
     def cog_unload(self):
-        self.batch_updates.stop()
+        self._mute_writer.stop()
         self.bulk_send_messages.stop()
+        cache.guild_state.unregister('mod.spam_check')
+        cache.guild_state.unregister('mod.message_batches')
+
+    def _purge_message_batches(self, index, snowflake):
+        for key in [k for k in self.message_batches if k[index] == snowflake]:
+            del self.message_batches[key]
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -280,7 +303,7 @@ class Mod(commands.Cog):
         elif isinstance(error, NoMuteRole):
             await ctx.send(error)
 
-    async def bulk_insert(self):
+    async def bulk_insert(self, batch):
         query = """UPDATE guild_mod_config
                    SET muted_members = x.result_array
                    FROM jsonb_to_recordset($1::jsonb) AS
@@ -288,11 +311,8 @@ class Mod(commands.Cog):
                    WHERE guild_mod_config.id = x.guild_id;
                 """
 
-        if not self._data_batch:
-            return
-
         final_data = []
-        for guild_id, data in self._data_batch.items():
+        for guild_id, data in batch.items():
             # If it's touched this function then chances are that this has hit cache before
             # so it's not actually doing a query, hopefully.
             config = await self.get_guild_config(guild_id)
@@ -305,15 +325,10 @@ class Mod(commands.Cog):
                 'guild_id': guild_id,
                 'result_array': list(as_set)
             })
-            self.get_guild_config.invalidate(self, guild_id)
 
         await self.bot.pool.execute(query, final_data)
-        self._data_batch.clear()
-
-    @tasks.loop(seconds=15.0)
-    async def batch_updates(self):
-        async with self._batch_lock:
-            await self.bulk_insert()
+        for guild_id in batch:
+            self.get_guild_config.invalidate(self, guild_id)
 
     @tasks.loop(seconds=10.0)
     async def bulk_send_messages(self):
@@ -336,7 +351,7 @@ class Mod(commands.Cog):
 
             self.message_batches.clear()
 
-    @cache.cache()
+    @cache.cache(maxsize=1024, strategy=cache.Strategy.stale, name='mod.guild_config')
     async def get_guild_config(self, guild_id):
         query = """SELECT * FROM guild_mod_config WHERE id=$1;"""
         async with self.bot.pool.acquire(timeout=300.0) as con:
@@ -345,6 +360,17 @@ class Mod(commands.Cog):
                 return await ModConfig.from_record(record, self.bot)
             return None
 
+    @get_guild_config.bulk_loader
+    async def get_guild_configs(self, guild_ids):
+        query = """SELECT * FROM guild_mod_config WHERE id = ANY($1::bigint[]);"""
+        async with self.bot.pool.acquire(timeout=300.0) as con:
+            records = await con.fetch(query, guild_ids)
+
+        result = dict.fromkeys(guild_ids)
+        for record in records:
+            result[record['id']] = await ModConfig.from_record(record, self.bot)
+        return result
+
     async def check_raid(self, config, guild_id, member, message):
         if config.raid_mode != RaidMode.strict.value:
             return
@@ -482,10 +508,9 @@ class Mod(commands.Cog):
         if before_has == after_has:
             return
 
-        async with self._batch_lock:
-            # If `after_has` is true, then it's an insertion operation
-            # if it's false, then the role for removed
-            self._data_batch[guild_id].append((after.id, after_has))
+        # If `after_has` is true, then it's an insertion operation
+        # if it's false, then the role for removed
+        await self._mute_writer.put((guild_id, after.id, after_has))
 
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role):
@@ -1013,8 +1038,8 @@ class Mod(commands.Cog):
     @commands.command()
     @commands.guild_only()
     @checks.has_permissions(ban_members=True)
-    async def tempban(self, ctx, duration: time.FutureTime, member: MemberID, *, reason: ActionReason = None):
-        """Temporarily bans a member for the specified duration.
+    async def tempban(self, ctx, duration: time.FutureTime, member: MemberID, members: commands.Greedy[MemberID], *, reason: ActionReason = None):
+        """Temporarily bans members for the specified duration.
 
         The duration can be a a short time form, e.g. 30d or a more human
         duration such as "until thursday at 3PM" or a more concrete time
@@ -1033,27 +1058,48 @@ class Mod(commands.Cog):
         if reason is None:
             reason = f'Action done by {ctx.author} (ID: {ctx.author.id})'
 
+        # the first member is separate so that a bad one is reported instead of becoming the reason
+        members = [member, *members]
+        total = len(members)
+
         reminder = self.bot.get_cog('Reminder')
         if reminder is None:
             return await ctx.send('Sorry, this functionality is currently unavailable. Try again later?')
 
         until = f'until {duration.dt:%Y-%m-%dT%H:%M UTC}'
         heads_up_message = f'You have been banned from {ctx.guild.name} {until}. Reason: {reason}'
+        reason = safe_reason_append(reason, until)
 
-        try:
-            await member.send(heads_up_message)
-        except (AttributeError, discord.HTTPException):
-            # best attempt, oh well.
-            pass
+        banned = []
+        failures = []
+        for member in members:
+            try:
+                await member.send(heads_up_message)
+            except (AttributeError, discord.HTTPException):
+                # best attempt, oh well.
+                pass
 
-        reason = safe_reason_append(reason, until)
-        await ctx.guild.ban(member, reason=reason)
-        timer = await reminder.create_timer(duration.dt, 'tempban', ctx.guild.id,
-                                                                    ctx.author.id,
-                                                                    member.id,
-                                                                    connection=ctx.db,
-                                                                    created=ctx.message.created_at)
-        await ctx.send(f'Banned {member} for {time.human_timedelta(duration.dt, source=timer.created_at)}.')
+            try:
+                await ctx.guild.ban(member, reason=reason)
+            except discord.HTTPException as e:
+                if total == 1:
+                    raise
+                failures.append((member, e))
+            else:
+                banned.append(member)
+
+        arguments = [(ctx.guild.id, ctx.author.id, member.id) for member in banned]
+        timers = await reminder.create_timers(duration.dt, 'tempban', arguments,
+                                              connection=ctx.db,
+                                              created=ctx.message.created_at)
+
+        delta = time.human_timedelta(duration.dt, source=ctx.message.created_at)
+        if total == 1:
+            await ctx.send(f'Banned {banned[0]} for {delta}.')
+        elif not failures:
+            await ctx.send(f'Banned {len(timers)}/{total} members for {delta}.')
+        else:
+            await ctx.send(f'Banned {len(timers)}/{total} members for {delta}. Failed:\n{format_failures(failures)}')
 
     @commands.Cog.listener()
     async def on_tempban_timer_complete(self, timer):
@@ -1525,8 +1571,8 @@ class Mod(commands.Cog):
 
     @commands.command()
     @can_mute()
-    async def tempmute(self, ctx, duration: time.FutureTime, member: discord.Member, *, reason: ActionReason = None):
-        """Temporarily mutes a member for the specified duration.
+    async def tempmute(self, ctx, duration: time.FutureTime, member: discord.Member, members: commands.Greedy[discord.Member], *, reason: ActionReason = None):
+        """Temporarily mutes members for the specified duration.
 
         The duration can be a a short time form, e.g. 30d or a more human
         duration such as "until thursday at 3PM" or a more concrete time
@@ -1540,19 +1586,38 @@ class Mod(commands.Cog):
         if reason is None:
             reason = f'Action done by {ctx.author} (ID: {ctx.author.id})'
 
+        # the first member is separate so that a bad one is reported instead of becoming the reason
+        members = [member, *members]
+        total = len(members)
+
         reminder = self.bot.get_cog('Reminder')
         if reminder is None:
             return await ctx.send('Sorry, this functionality is currently unavailable. Try again later?')
 
         role_id = ctx.guild_config.mute_role_id
-        await member.add_roles(discord.Object(id=role_id), reason=reason)
-        timer = await reminder.create_timer(duration.dt, 'tempmute', ctx.guild.id,
-                                                                     ctx.author.id,
-                                                                     member.id,
-                                                                     role_id,
-                                                                     created=ctx.message.created_at)
-        delta = time.human_timedelta(duration.dt, source=timer.created_at)
-        await ctx.send(f'Muted {discord.utils.escape_mentions(str(member))} for {delta}.')
+        role = discord.Object(id=role_id)
+        muted = []
+        failures = []
+        for member in members:
+            try:
+                await member.add_roles(role, reason=reason)
+            except discord.HTTPException as e:
+                if total == 1:
+                    raise
+                failures.append((member, e))
+            else:
+                muted.append(member)
+
+        arguments = [(ctx.guild.id, ctx.author.id, member.id, role_id) for member in muted]
+        timers = await reminder.create_timers(duration.dt, 'tempmute', arguments, created=ctx.message.created_at)
+
+        delta = time.human_timedelta(duration.dt, source=ctx.message.created_at)
+        if total == 1:
+            await ctx.send(f'Muted {discord.utils.escape_mentions(str(muted[0]))} for {delta}.')
+        elif not failures:
+            await ctx.send(f'Muted [{len(timers)}/{total}] for {delta}.')
+        else:
+            await ctx.send(f'Muted [{len(timers)}/{total}] for {delta}. Failed:\n{format_failures(failures)}')
 
     @commands.Cog.listener()
     async def on_tempmute_timer_complete(self, timer):
@@ -1568,8 +1633,7 @@ class Mod(commands.Cog):
         if member is None or not member._roles.has(role_id):
             # They left or don't have the role any more so it has to be manually changed in the SQL
             # if applicable, of course
-            async with self._batch_lock:
-                self._data_batch[guild_id].append((member_id, False))
+            await self._mute_writer.put((guild_id, member_id, False))
             return
 
         if mod_id != member_id:
@@ -1593,8 +1657,7 @@ class Mod(commands.Cog):
             await member.remove_roles(discord.Object(id=role_id), reason=reason)
         except discord.HTTPException:
             # if the request failed then just do it manually
-            async with self._batch_lock:
-                self._data_batch[guild_id].append((member_id, False))
+            await self._mute_writer.put((guild_id, member_id, False))
 
     @_mute.group(name='role', invoke_without_command=True)
     @checks.has_guild_permissions(manage_guild=True, manage_roles=True)
@@ -17,7 +17,8 @@ from async_timeout import timeout
 
 from cogs.utils import db
 
-from .utils import checks
+from .utils import checks, cache
+from .utils.batch import BatchWriter, Overflow
 from .videos import Videos
 import itertools
 
@@ -95,13 +96,14 @@ class Music(commands.Cog):
         self.states = {}
         self.bot.add_listener(self.on_reaction_add, "on_reaction_add")
         # database mutex access
-        self._batch_of_data = []
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
-        self.bulk_insert.add_exception_type(asyncpg.PostgresConnectionError)
-        self.bulk_insert.start()
+        self._batch_writer = BatchWriter(self.bulk_insert, interval=60.0, max_pending=10000, overflow=Overflow.block,
+                                         name='music.playlists', loop=bot.loop)
+        self._batch_writer.start()
+        cache.guild_state.register('music.states', self.states, purge_guild=self.purge_guild)
 
     def cog_unload(self):
-        self.bulk_insert.stop()
+        self._batch_writer.stop()
+        cache.guild_state.unregister('music.states')
 
     async def cog_command_error(self, ctx, error):
        if isinstance(error, commands.BadArgument):
@@ -128,18 +130,17 @@ class Music(commands.Cog):
         except KeyError:
             pass
 
-    @tasks.loop(seconds=60.0)
-    async def bulk_insert(self):
-        query = """INSERT INTO playlists (name, author_id, url, title, uploader)
-                   SELECT x.name, x.author, x.url, x.title, x.uploader
-                   FROM jsonb_to_recordset($1::jsonb) AS x(name TEXT, author BIGINT, url TEXT, title TEXT, uploader TEXT)
-                """
-        async with self._batch_lock:
-            try:
-                await self.bot.pool.execute(query, self._batch_of_data)
-            except Exception as e:
-                print(e)
-            self._batch_of_data.clear()
+    def purge_guild(self, guild_id):
+        """Stops the player of a guild and disconnects from voice."""
+        state = self.states.pop(guild_id, None)
+        if state is not None:
+            state.queue.clear()
+            # it could be waiting on a song that never finishes
+            state._task.cancel()
+            state.destroy(state._guild)
+
+    async def bulk_insert(self, batch):
+        await MusicTable.insert_many(batch)
 
     async def on_reaction_add(self, reaction, user):
         """Responds to reactions added to the bot's messages, allowing reactions to control playback."""
@@ -209,14 +210,13 @@ class Music(commands.Cog):
             return
 
         state = self.get_player(ctx)
-        async with self._batch_lock:
-            self._batch_of_data.append({
-                'name': playlist_name,
-                'author': ctx.author.id,
-                'url': state.now_playing["webpage_url"],
-                'title': state.now_playing['title'],
-                'uploader': state.now_playing['uploader'],
-            })
+        await self._batch_writer.put({
+            'name': playlist_name,
+            'author_id': ctx.author.id,
+            'url': state.now_playing["webpage_url"],
+            'title': state.now_playing['title'],
+            'uploader': state.now_playing['uploader'],
+        })
 
     def get_state(self, ctx):
         """Gets the state for `guild`, creating it if it does not exist."""
@@ -594,7 +594,7 @@ class GuildState:
         self.volume = .5
         self.now_playing = None
 
-        ctx.bot.loop.create_task(self.player_loop())
+        self._task = ctx.bot.loop.create_task(self.player_loop())
 
     async def player_loop(self):
         """Our main player loop."""
@@ -615,9 +615,11 @@ class GuildState:
             
             self.player = await self._channel.send(embed=Videos.get_embed(self.now_playing))
             await self._add_reaction_controls(self.player)
-            await self.event.wait()
-            # Make sure the FFmpeg process is cleaned up.
-            play_source.cleanup()
+            try:
+                await self.event.wait()
+            finally:
+                # Make sure the FFmpeg process is cleaned up, even if we're cancelled.
+                play_source.cleanup()
             self.now_playing = None
             try:
                 # We are no longer playing this song...
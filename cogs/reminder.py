@@ -1,10 +1,12 @@
 from .utils import checks, db, time, formats
-from discord.ext import commands
+from .utils.paginator import RoboPages, LazyPageSource
+from discord.ext import commands, menus
 import discord
 import asyncio
 import asyncpg
 import datetime
 import textwrap
+import heapq
 
 class Reminders(db.Table):
     id = db.PrimaryKeyColumn()
@@ -14,6 +16,23 @@ class Reminders(db.Table):
     event = db.Column(db.String)
     extra = db.Column(db.JSON, default="'{}'::jsonb")
 
+class ReminderPageSource(LazyPageSource):
+    def __init__(self, records):
+        super().__init__(records, per_page=10)
+
+    async def format_page(self, menu, records):
+        e = discord.Embed(colour=discord.Colour.blurple(), title='Reminders')
+        for _id, expires, message in records:
+            shorten = textwrap.shorten(message, width=512)
+            e.add_field(name=f'{_id}: In {time.human_timedelta(expires)}', value=shorten, inline=False)
+
+        if self.exhausted:
+            total = len(self.entries)
+            e.set_footer(text=f'{total} reminder{"s" if total > 1 else ""}')
+        else:
+            e.set_footer(text=f'Page {menu.current_page + 1}')
+        return e
+
 class Timer:
     __slots__ = ('args', 'kwargs', 'event', 'id', 'created_at', 'expires')
 
@@ -60,11 +79,22 @@ class Reminder(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self._have_data = asyncio.Event(loop=bot.loop)
-        self._current_timer = None
+
+        # every timer that expires before the window, as (expires, id, timer)
+        self._timers = []
+        self._window = None
+        # the earliest deferred timer created while the window was being refilled
+        self._cut = None
+        self._window_size = datetime.timedelta(seconds=getattr(bot.config, 'timer_window', 3600.0))
+        self._preload = getattr(bot.config, 'timer_preload', 1000)
         self._task = bot.loop.create_task(self.dispatch_timers())
 
+        query = "SELECT * FROM reminders WHERE expires < $1 ORDER BY expires, id LIMIT $2;"
+        db.prepared.register('reminder.timer_window', query)
+
     def cog_unload(self):
         self._task.cancel()
+        db.prepared.unregister('reminder.timer_window')
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -72,48 +102,133 @@ class Reminder(commands.Cog):
         if isinstance(error, commands.TooManyArguments):
             await ctx.send(f'You called the {ctx.command.name} command with too many arguments.')
 
-    async def get_active_timer(self, *, connection=None, days=7):
-        query = "SELECT * FROM reminders WHERE expires < (CURRENT_DATE + $1::interval) ORDER BY expires LIMIT 1;"
+    async def refill_timers(self, *, connection=None):
+        """Loads every timer expiring within the window into memory.
+
+        Only called once every loaded timer has been dispatched, so
+        whatever is left in the table has yet to run.
+        """
         con = connection or self.bot.pool
+        until = datetime.datetime.utcnow() + self._window_size
 
-        record = await con.fetchrow(query, datetime.timedelta(days=days))
-        return Timer(record=record) if record else None
+        # timers created while this runs are kept regardless of the window
+        self._window = None
+        records = await db.prepared.fetch(con, 'reminder.timer_window', until, self._preload)
 
-    async def wait_for_active_timers(self, *, connection=None, days=7):
-        async with db.MaybeAcquire(connection=connection, pool=self.bot.pool) as con:
-            timer = await self.get_active_timer(connection=con, days=days)
-            if timer is not None:
-                self._have_data.set()
-                return timer
+        if len(records) < self._preload:
+            window = (until, 0)
+        else:
+            # more are due before the window than we're willing to hold,
+            # so it ends right after the last timer that was loaded
+            last = records[-1]
+            window = (last['expires'], last['id'] + 1)
+
+        if self._cut is not None:
+            window = min(window, self._cut)
+            self._cut = None
+
+        timers = {r['id']: (r['expires'], r['id'], Timer(record=r)) for r in records}
+        for entry in self._timers:
+            # the query might not have seen these
+            if entry[1] not in timers and entry[:2] < window:
+                timers[entry[1]] = entry
+
+        self._timers = list(timers.values())
+        heapq.heapify(self._timers)
+        self._window = window
+
+    def schedule_timers(self, timers):
+        earliest = self._timers[0][0] if self._timers else None
+        for timer in timers:
+            # timers past the window are loaded by the next refill
+            if self._window is None or (timer.expires, timer.id) < self._window:
+                heapq.heappush(self._timers, (timer.expires, timer.id, timer))
+
+        if self._timers and self._timers[0][0] != earliest:
+            # wake the dispatcher up once so it can sleep for less
+            self._have_data.set()
 
-            self._have_data.clear()
-            self._current_timer = None
-            await self._have_data.wait()
-            return await self.get_active_timer(connection=con, days=days)
+    def defer_timers(self, timers):
+        """Makes the dispatcher read timers back from the database once they're due.
 
-    async def call_timer(self, timer):
-        # delete the timer
-        query = "DELETE FROM reminders WHERE id=$1;"
-        await self.bot.pool.execute(query, timer.id)
+        This is for timers inserted in a transaction that isn't committed
+        yet. Scheduling those directly would fire them even if it rolls back.
+        """
+        first = min((timer.expires, timer.id) for timer in timers)
+        if self._window is None:
+            # the refill that is running might not see them
+            self._cut = first if self._cut is None else min(self._cut, first)
+        elif first < self._window:
+            # the window now ends before them, so a refill runs once they're due
+            self._window = first
+            self._have_data.set()
 
-        # dispatch the event
-        event_name = f'{timer.event}_timer_complete'
-        self.bot.dispatch(event_name, timer)
+    def _schedule_created(self, connection, timers):
+        if not isinstance(connection, asyncpg.pool.Pool) and connection.is_in_transaction():
+            self.defer_timers(timers)
+        else:
+            self.schedule_timers(timers)
+
+    def unschedule_timers(self, predicate):
+        timers = [entry for entry in self._timers if not predicate(entry[2])]
+        if len(timers) != len(self._timers):
+            heapq.heapify(timers)
+            self._timers = timers
+            self._have_data.set()
+
+    async def wait_for_timers(self, timeout):
+        self._have_data.clear()
+        try:
+            await asyncio.wait_for(self._have_data.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def call_timers(self, timers):
+        # delete the timers
+        query = "DELETE FROM reminders WHERE id = ANY($1::int[]);"
+        try:
+            await self.bot.pool.execute(query, [timer.id for timer in timers])
+        except Exception:
+            # they'll be retried once the dispatcher restarts
+            for timer in timers:
+                heapq.heappush(self._timers, (timer.expires, timer.id, timer))
+            raise
+
+        # dispatch the events
+        for timer in timers:
+            event_name = f'{timer.event}_timer_complete'
+            self.bot.dispatch(event_name, timer)
+
+    def _window_reached(self, now):
+        # timers past the window might not be loaded yet, so refill once it ends
+        if self._window is None:
+            return True
+        return self._window[0] <= now and (not self._timers or self._timers[0][:2] >= self._window)
 
     async def dispatch_timers(self):
         try:
             while not self.bot.is_closed():
-                # can only asyncio.sleep for up to ~48 days reliably
-                # so we're gonna cap it off at 40 days
-                # see: http://bugs.python.org/issue20493
-                timer = self._current_timer = await self.wait_for_active_timers(days=40)
                 now = datetime.datetime.utcnow()
-
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                await self.call_timer(timer)
+                if self._window_reached(now):
+                    await self.refill_timers()
+                    now = datetime.datetime.utcnow()
+
+                if not self._timers or self._timers[0][:2] >= self._window:
+                    # nothing in memory is due before the window ends
+                    await self.wait_for_timers(max((self._window[0] - now).total_seconds(), 0))
+                    continue
+
+                expires = self._timers[0][0]
+                if expires > now:
+                    # woken up early if an earlier timer is created or the earliest is deleted
+                    await self.wait_for_timers((expires - now).total_seconds())
+                    continue
+
+                due = []
+                while self._timers and self._timers[0][0] <= now and self._timers[0][:2] < self._window:
+                    due.append(heapq.heappop(self._timers)[2])
+
+                await self.call_timers(due)
         except asyncio.CancelledError:
             raise
         except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
@@ -180,18 +295,74 @@ class Reminder(commands.Cog):
 
         row = await connection.fetchrow(query, event, { 'args': args, 'kwargs': kwargs }, when, now)
         timer.id = row[0]
+        self._schedule_created(connection, [timer])
+        return timer
 
-        # only set the data check if it can be waited on
-        if delta <= (86400 * 40): # 40 days
-            self._have_data.set()
+    async def create_timers(self, when, event, arguments, *, connection=None, created=None, **kwargs):
+        """Creates many timers that fire at the same time in one query.
 
-        # check if this timer is earlier than our currently run timer
-        if self._current_timer and when < self._current_timer.expires:
-            # cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        Parameters
+        -----------
+        when: datetime.datetime
+            When the timers should fire.
+        event: str
+            The name of the event to trigger.
+            Will transform to 'on_{event}_timer_complete'.
+        arguments: Iterable[Sequence]
+            The arguments to pass to the event, one sequence per timer.
+        connection: asyncpg.Connection
+            The connection to use for the DB request.
+        created: datetime.datetime
+            The creation time of the timers.
+        \*\*kwargs
+            Keyword arguments to pass to every event.
 
-        return timer
+        Note
+        ------
+        Arguments and keyword arguments must be JSON serialisable.
+
+        Returns
+        --------
+        List[:class:`Timer`]
+            The timers in the same order as ``arguments``.
+        """
+        connection = connection or self.bot.pool
+        now = created or datetime.datetime.utcnow()
+
+        timers = [
+            Timer.temporary(event=event, args=list(args), kwargs=kwargs, expires=when, created=now)
+            for args in arguments
+        ]
+
+        if not timers:
+            return timers
+
+        delta = (when - now).total_seconds()
+        if delta <= 60:
+            # a shortcut for small timers
+            for timer in timers:
+                self.bot.loop.create_task(self.short_timer_optimisation(delta, timer))
+            return timers
+
+        # RETURNING makes no promise about the order of the rows, so the ids
+        # are taken from the sequence up front and returned in argument order
+        query = """WITH x AS (
+                       SELECT nextval(pg_get_serial_sequence('reminders', 'id')) AS id, extra, n
+                       FROM unnest($2::jsonb[]) WITH ORDINALITY AS u(extra, n)
+                   ), inserted AS (
+                       INSERT INTO reminders (id, event, extra, expires, created)
+                       SELECT x.id, $1, x.extra, $3, $4 FROM x
+                   )
+                   SELECT id FROM x ORDER BY n;
+                """
+
+        extras = [{ 'args': timer.args, 'kwargs': kwargs } for timer in timers]
+        records = await connection.fetch(query, event, extras, when, now)
+        for timer, record in zip(timers, records):
+            timer.id = record[0]
+
+        self._schedule_created(connection, timers)
+        return timers
 
     @commands.group(aliases=['timer', 'remind'], usage='<when>', invoke_without_command=True)
     async def reminder(self, ctx, *, when: time.UserFriendlyTime(commands.clean_content, default='\u2026')):
@@ -219,32 +390,23 @@ class Reminder(commands.Cog):
 
     @reminder.command(name='list', ignore_extra=False)
     async def reminder_list(self, ctx):
-        """Shows the 10 latest currently running reminders."""
-        query = """SELECT id, expires, extra #>> '{args,2}'
+        """Shows your currently running reminders, soonest first."""
+        query = """SELECT id, expires, extra #>> '{args,2}' AS "message"
                    FROM reminders
                    WHERE event = 'reminder'
                    AND extra #>> '{args,0}' = $1
-                   ORDER BY expires
-                   LIMIT 10;
                 """
 
-        records = await ctx.db.fetch(query, str(ctx.author.id))
-
-        if len(records) == 0:
+        await ctx.release()
+        records = db.KeysetPaginator(ctx.pool, query, str(ctx.author.id), key=('expires', 'id'), per_page=50)
+        source = ReminderPageSource(records)
+        if await source.is_empty():
             return await ctx.send('No currently running reminders.')
 
-        e = discord.Embed(colour=discord.Colour.blurple(), title='Reminders')
-
-        if len(records) == 10:
-            e.set_footer(text='Only showing up to 10 reminders.')
-        else:
-            e.set_footer(text=f'{len(records)} reminder{"s" if len(records) > 1 else ""}')
-
-        for _id, expires, message in records:
-            shorten = textwrap.shorten(message, width=512)
-            e.add_field(name=f'{_id}: In {time.human_timedelta(expires)}', value=shorten, inline=False)
-
-        await ctx.send(embed=e)
+        try:
+            await RoboPages(source).start(ctx)
+        except menus.MenuError as e:
+            await ctx.send(e)
 
     @reminder.command(name='delete', aliases=['remove', 'cancel'], ignore_extra=False)
     async def reminder_delete(self, ctx, *, id: int):
@@ -265,11 +427,7 @@ class Reminder(commands.Cog):
         if status == 'DELETE 0':
             return await ctx.send('Could not delete any reminders with that ID.')
 
-        # if the current timer is being deleted
-        if self._current_timer and self._current_timer.id == id:
-            # cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        self.unschedule_timers(lambda timer: timer.id == id)
 
         await ctx.send('Successfully deleted reminder.')
 
@@ -297,6 +455,7 @@ class Reminder(commands.Cog):
 
         query = """DELETE FROM reminders WHERE event = 'reminder' AND extra #>> '{args,0}' = $1;"""
         await ctx.db.execute(query, author_id)
+        self.unschedule_timers(lambda timer: timer.event == 'reminder' and str(timer.args[0]) == author_id)
         await ctx.send(f'Successfully deleted {formats.plural(total):reminder}.')
 
     @commands.Cog.listener()
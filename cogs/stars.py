@@ -2,6 +2,8 @@ from discord.ext import commands, tasks, menus
 from .utils import checks, db, cache
 from .utils.formats import plural, human_join
 from .utils.paginator import SimplePages
+from .utils.context import replica_safe
+from .utils.sampler import RandomSampler
 from collections import Counter, defaultdict
 
 import discord
@@ -116,25 +118,66 @@ class Stars(commands.Cog):
 
         self._locks = weakref.WeakValueDictionary()
         self.spoilers = re.compile(r'\|\|(.+?)\|\|')
+        cache.guild_state.register('stars.locks', self._locks)
+
+        # guild_id: IdArray of entry IDs that have a starboard message
+        self._random_stars = RandomSampler(self.load_star_ids)
+        cache.guild_state.register('stars.random', self._random_stars.arrays, purge_guild=self._random_stars.invalidate)
+
+        query = """WITH to_insert AS (
+                       INSERT INTO starboard_entries AS entries (message_id, channel_id, guild_id, author_id)
+                       VALUES ($1, $2, $3, $4)
+                       ON CONFLICT (message_id) DO NOTHING
+                       RETURNING entries.id
+                   )
+                   INSERT INTO starrers (author_id, entry_id)
+                   SELECT $5, entry.id
+                   FROM (
+                       SELECT id FROM to_insert
+                       UNION ALL
+                       SELECT id FROM starboard_entries WHERE message_id=$1
+                       LIMIT 1
+                   ) AS entry
+                   RETURNING entry_id;
+                """
+        db.prepared.register('stars.star_message', query)
 
     def cog_unload(self):
         self.clean_message_cache.cancel()
+        cache.guild_state.unregister('stars.locks')
+        cache.guild_state.unregister('stars.random')
+        db.prepared.unregister('stars.star_message')
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, StarError):
             await ctx.send(error)
 
+    async def load_star_ids(self, guild_id):
+        query = "SELECT id FROM starboard_entries WHERE guild_id=$1 AND bot_message_id IS NOT NULL;"
+        records = await self.bot.pool.fetch(query, guild_id)
+        return [record[0] for record in records]
+
     @tasks.loop(hours=1.0)
     async def clean_message_cache(self):
         self._message_cache.clear()
 
-    @cache.cache()
+    @cache.cache(maxsize=1024, strategy=cache.Strategy.stale, name='stars.starboard')
     async def get_starboard(self, guild_id, *, connection=None):
         connection = connection or self.bot.pool
         query = "SELECT * FROM starboard WHERE id=$1;"
         record = await connection.fetchrow(query, guild_id)
         return StarboardConfig(guild_id=guild_id, bot=self.bot, record=record)
 
+    @get_starboard.bulk_loader
+    async def get_starboards(self, guild_ids):
+        query = "SELECT * FROM starboard WHERE id = ANY($1::bigint[]);"
+        records = await self.bot.pool.fetch(query, guild_ids)
+        records = {r['id']: r for r in records}
+        return {
+            guild_id: StarboardConfig(guild_id=guild_id, bot=self.bot, record=records.get(guild_id))
+            for guild_id in guild_ids
+        }
+
     def star_emoji(self, stars):
         if 5 > stars >= 0:
             return '\N{WHITE MEDIUM STAR}'
@@ -404,25 +447,9 @@ class Stars(commands.Cog):
         # originally this was a single query but it seems
         # WHERE ... = (SELECT ... in some_cte) is bugged
         # so I'm going to do two queries instead
-        query = """WITH to_insert AS (
-                       INSERT INTO starboard_entries AS entries (message_id, channel_id, guild_id, author_id)
-                       VALUES ($1, $2, $3, $4)
-                       ON CONFLICT (message_id) DO NOTHING
-                       RETURNING entries.id
-                   )
-                   INSERT INTO starrers (author_id, entry_id)
-                   SELECT $5, entry.id
-                   FROM (
-                       SELECT id FROM to_insert
-                       UNION ALL
-                       SELECT id FROM starboard_entries WHERE message_id=$1
-                       LIMIT 1
-                   ) AS entry
-                   RETURNING entry_id;
-                """
-
+        # the first one is prepared in __init__ since it runs on every star
         try:
-            record = await connection.fetchrow(query, message_id, channel.id, guild_id, msg.author.id, starrer_id)
+            record = await db.prepared.fetchrow(connection, 'stars.star_message', message_id, channel.id, guild_id, msg.author.id, starrer_id)
         except asyncpg.UniqueViolationError:
             raise StarError('\N{NO ENTRY SIGN} You already starred this message.')
 
@@ -446,8 +473,9 @@ class Stars(commands.Cog):
 
         if bot_message_id is None:
             new_msg = await starboard_channel.send(content, embed=embed)
-            query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE message_id=$2;"
-            await connection.execute(query, new_msg.id, message_id)
+            query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE message_id=$2 RETURNING id;"
+            entry_id = await connection.fetchval(query, new_msg.id, message_id)
+            self._random_stars.add(guild_id, entry_id)
         else:
             new_msg = await self.get_message(starboard_channel, bot_message_id)
             if new_msg is None:
@@ -921,7 +949,7 @@ class Stars(commands.Cog):
         # messages starred
         query = "SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1;"
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
+        record = await ctx.read_db.fetchrow(query, ctx.guild.id)
         total_messages = record[0]
 
         # total stars given
@@ -932,7 +960,7 @@ class Stars(commands.Cog):
                    WHERE entry.guild_id=$1;
                 """
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
+        record = await ctx.read_db.fetchrow(query, ctx.guild.id)
         total_stars = record[0]
 
         e.description = f'{plural(total_messages):message} starred with a total of {total_stars} stars.'
@@ -980,7 +1008,7 @@ class Stars(commands.Cog):
                    );
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
         starred_posts = [r for r in records if r['Type'] == 3]
         e.add_field(name='Top Starred Posts', value=self.records_to_value(starred_posts), inline=False)
 
@@ -1036,14 +1064,14 @@ class Stars(commands.Cog):
                    )
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id, member.id)
         received = records[0]['Stars']
         given = records[1]['Stars']
         top_three = records[2:]
 
         # this query calculates how many of our messages were starred
         query = """SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1 AND author_id=$2;"""
-        record = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
+        record = await ctx.read_db.fetchrow(query, ctx.guild.id, member.id)
         messages_starred = record[0]
 
         e.add_field(name='Messages Starred', value=messages_starred)
@@ -1056,6 +1084,7 @@ class Stars(commands.Cog):
 
     @star.command(name='stats')
     @requires_starboard()
+    @replica_safe()
     async def star_stats(self, ctx, *, member: discord.Member = None):
         """Shows statistics on the starboard usage of the server or a member."""
 
@@ -1069,28 +1098,33 @@ class Stars(commands.Cog):
     async def star_random(self, ctx):
         """Shows a random starred message."""
 
-        query = """SELECT bot_message_id
-                   FROM starboard_entries
-                   WHERE guild_id=$1
-                   AND bot_message_id IS NOT NULL
-                   OFFSET FLOOR(RANDOM() * (
-                       SELECT COUNT(*)
-                       FROM starboard_entries
-                       WHERE guild_id=$1
-                       AND bot_message_id IS NOT NULL
-                   ))
-                   LIMIT 1
-                """
+        query = "SELECT bot_message_id FROM starboard_entries WHERE id=$1 AND bot_message_id IS NOT NULL;"
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
+        async def fetch(entry_id):
+            # entries that were unstarred or deleted since are skipped
+            record = await ctx.db.fetchrow(query, entry_id)
+            if record is None:
+                return None
 
-        if record is None:
-            return await ctx.send('Could not find anything.')
+            # so are the ones whose starboard message is gone
+            return await self.get_message(ctx.starboard.channel, record[0])
+
+        async def fallback():
+            query = """SELECT bot_message_id
+                       FROM starboard_entries
+                       WHERE guild_id=$1 AND bot_message_id IS NOT NULL
+                       ORDER BY random()
+                       LIMIT 1;
+                    """
+            message_id = await ctx.db.fetchval(query, ctx.guild.id)
+            if message_id is None:
+                return None
+            return await self.get_message(ctx.starboard.channel, message_id)
+
+        message = await self._random_stars.sample(ctx.guild.id, fetch, fallback)
 
-        message_id = record[0]
-        message = await self.get_message(ctx.starboard.channel, message_id)
         if message is None:
-            return await ctx.send(f'Message {message_id} has been deleted somehow.')
+            return await ctx.send('Could not find anything.')
 
         if message.embeds:
             await ctx.send(message.content, embed=message.embeds[0])
@@ -1,7 +1,10 @@
 from discord.ext import commands, tasks, menus
 from collections import Counter, defaultdict
 
-from .utils import checks, db, time, formats
+from .utils import checks, db, time, formats, cache, querystats
+from .utils.batch import BatchWriter, Overflow
+from .utils.context import replica_safe
+from .utils.paginator import RoboPages, LazyPageSource
 
 import pkg_resources
 import logging
@@ -31,12 +34,21 @@ class GatewayHandler(logging.Handler):
         super().__init__(logging.INFO)
 
     def filter(self, record):
+        if record.name == 'cogs.utils.pool':
+            return record.levelno >= logging.WARNING
         return record.name == 'discord.gateway' or 'Shard ID' in record.msg or 'Websocket closed ' in record.msg
 
     def emit(self, record):
         self.cog.add_record(record)
 
-class Commands(db.Table):
+# Old partitions are summarised per month before being dropped
+_ARCHIVE_COMMANDS = """INSERT INTO commands_archive (month, guild_id, author_id, command, failed, total)
+                       SELECT date_trunc('month', used)::date, guild_id, author_id, command, failed, COUNT(*)
+                       FROM {partition}
+                       GROUP BY 1, 2, 3, 4, 5;
+                    """
+
+class Commands(db.Table, partition=db.RangePartition('used', archive=_ARCHIVE_COMMANDS)):
     id = db.PrimaryKeyColumn()
 
     guild_id = db.Column(db.Integer(big=True), index=True)
@@ -47,8 +59,116 @@ class Commands(db.Table):
     command = db.Column(db.String, index=True)
     failed = db.Column(db.Boolean, index=True)
 
+class CommandsArchive(db.Table, table_name='commands_archive'):
+    id = db.PrimaryKeyColumn()
+
+    month = db.Column(db.Date, index=True)
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    author_id = db.Column(db.Integer(big=True), index=True)
+    command = db.Column(db.String, index=True)
+    failed = db.Column(db.Boolean)
+    total = db.Column(db.Integer, default=0)
+
+# The rollups can't use a plain unique constraint since NULLs never conflict
+_ROLLUP_CONFLICT = ('bucket', 'author_id', 'command', '(COALESCE(guild_id, 0))', '(COALESCE(failed::int, -1))')
+
+class CommandUsageRollup:
+    """Shared behaviour of the command usage rollup tables.
+
+    Every row counts the commands used in a ``bucket`` of time that share
+    the same guild, author, command and failure state.
+    """
+
+    # how to truncate a timestamp to the bucket
+    precision = None
+
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        statement = super().create_table(exists_ok=exists_ok)
+        sql = f"CREATE UNIQUE INDEX IF NOT EXISTS {cls.__tablename__}_uniq_idx ON {cls.__tablename__} " \
+              f"({', '.join(_ROLLUP_CONFLICT)});"
+        return statement + '\n' + sql
+
+    @classmethod
+    def bucket_for(cls, dt):
+        if cls.precision == 'hour':
+            return dt.replace(minute=0, second=0, microsecond=0)
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @classmethod
+    async def add(cls, batch, *, connection):
+        """Adds a batch of commands rows to the rollup."""
+        rows = {}
+        for record in batch:
+            used = record['used']
+            key = (cls.bucket_for(used), record['guild_id'], record['author_id'], record['command'], record['failed'])
+            try:
+                row = rows[key]
+            except KeyError:
+                bucket, guild_id, author_id, command, failed = key
+                rows[key] = {
+                    'bucket': bucket,
+                    'guild_id': guild_id,
+                    'author_id': author_id,
+                    'command': command,
+                    'failed': failed,
+                    'total': 1,
+                    'first_used': used,
+                }
+            else:
+                row['total'] += 1
+                row['first_used'] = min(row['first_used'], used)
+
+        table = cls.__tablename__
+        update = {
+            'total': f'{table}.total + excluded.total',
+            'first_used': f'LEAST({table}.first_used, excluded.first_used)',
+        }
+        return await cls.insert_many(list(rows.values()), connection=connection, conflict=_ROLLUP_CONFLICT, update=update)
+
+class CommandUsageHourly(CommandUsageRollup, db.Table, table_name='command_usage_hourly'):
+    id = db.PrimaryKeyColumn()
+
+    bucket = db.Column(db.Datetime, index=True)
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    author_id = db.Column(db.Integer(big=True), index=True)
+    command = db.Column(db.String)
+    failed = db.Column(db.Boolean)
+    total = db.Column(db.Integer(big=True), default=0)
+    first_used = db.Column(db.Datetime)
+
+    precision = 'hour'
+
+class CommandUsageDaily(CommandUsageRollup, db.Table, table_name='command_usage_daily'):
+    id = db.PrimaryKeyColumn()
+
+    bucket = db.Column(db.Datetime, index=True)
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    author_id = db.Column(db.Integer(big=True), index=True)
+    command = db.Column(db.String)
+    failed = db.Column(db.Boolean)
+    total = db.Column(db.Integer(big=True), default=0)
+    first_used = db.Column(db.Datetime)
+
+    precision = 'day'
+
 _INVITE_REGEX = re.compile(r'(?:https?:\/\/)?discord(?:\.gg|\.com|app\.com\/invite)?\/[A-Za-z0-9]+')
 
+class TabularPageSource(LazyPageSource):
+    def __init__(self, records, *, per_page=15, hidden=()):
+        super().__init__(records, per_page=per_page)
+        self.hidden = hidden
+
+    async def format_page(self, menu, records):
+        headers = [key for key in records[0].keys() if key not in self.hidden]
+        table = formats.TabularData()
+        table.set_columns(headers)
+        table.add_rows([r[key] for key in headers] for r in records)
+
+        maximum = self.get_max_pages()
+        page = f'Page {menu.current_page + 1}' if maximum is None else f'Page {menu.current_page + 1}/{maximum}'
+        return f'```\n{table.render()}\n```\n{page}'
+
 def censor_invite(obj, *, _regex=_INVITE_REGEX):
     return _regex.sub('[censored-invite]', str(obj))
 
@@ -64,38 +184,73 @@ def object_at(addr):
 class Stats(commands.Cog):
     """Bot usage statistics."""
 
+    # the most commands to hold on to while the rollups can't be updated
+    MAX_PENDING_ROLLUPS = 50000
+
     def __init__(self, bot):
         self.bot = bot
         self.process = psutil.Process()
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
-        self._data_batch = []
-        self.bulk_insert_loop.add_exception_type(asyncpg.PostgresConnectionError)
-        self.bulk_insert_loop.start()
+        # commands that made it into the raw table but not the rollups yet
+        self._pending_rollups = []
+        self._batch_writer = BatchWriter(self.bulk_insert, interval=10.0, max_pending=50000, overflow=Overflow.drop,
+                                         name='stats.commands', loop=bot.loop)
+        self._batch_writer.start()
         self._gateway_queue = asyncio.Queue(loop=bot.loop)
         self.gateway_worker.start()
+        self.partition_maintenance.start()
 
-    async def bulk_insert(self):
-        query = """INSERT INTO commands (guild_id, channel_id, author_id, used, prefix, command, failed)
-                   SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(guild BIGINT, channel BIGINT, author BIGINT, used TIMESTAMP, prefix TEXT, command TEXT, failed BOOLEAN)
-                """
+    async def bulk_insert(self, batch):
+        # the raw rows are committed on their own so a broken rollup can't lose them
+        total = await Commands.insert_many(batch)
+        if total > 1:
+            log.info('Registered %s commands to the database.', total)
 
-        if self._data_batch:
-            await self.bot.pool.execute(query, self._data_batch)
-            total = len(self._data_batch)
-            if total > 1:
-                log.info('Registered %s commands to the database.', total)
-            self._data_batch.clear()
+        rows = self._pending_rollups + batch
+        try:
+            async with db.MaybeAcquire(None, pool=Commands._pool) as con:
+                async with con.transaction():
+                    await CommandUsageHourly.add(rows, connection=con)
+                    await CommandUsageDaily.add(rows, connection=con)
+        except Exception:
+            # retried with the next batch, past the limit `stats backfill` has to fix them up
+            self._pending_rollups = rows[-self.MAX_PENDING_ROLLUPS:]
+            dropped = len(rows) - len(self._pending_rollups)
+            log.exception('Could not update the command usage rollups, %s commands pending and %s dropped.',
+                          len(self._pending_rollups), dropped)
+        else:
+            self._pending_rollups = []
 
     def cog_unload(self):
-        self.bulk_insert_loop.stop()
+        self._batch_writer.stop()
         self.gateway_worker.cancel()
+        self.partition_maintenance.cancel()
+
+    @tasks.loop(hours=12.0)
+    async def partition_maintenance(self):
+        # only the last day is read from the hourly rollup
+        query = "DELETE FROM command_usage_hourly WHERE bucket < (CURRENT_TIMESTAMP - INTERVAL '7 days');"
+        try:
+            await self.bot.pool.execute(query)
+        except asyncpg.UndefinedTableError:
+            pass
+
+        try:
+            await Commands.create_partitions()
+            months = getattr(self.bot.config, 'command_retention_months', None)
+            archived = await Commands.apply_retention(months=months)
+        except asyncpg.UndefinedTableError:
+            # the tables haven't been created yet
+            return
+        except asyncpg.WrongObjectTypeError:
+            log.warning('The commands table is not partitioned, run `launcher.py db partition stats`.')
+            return
 
-    @tasks.loop(seconds=10.0)
-    async def bulk_insert_loop(self):
-        async with self._batch_lock:
-            await self.bulk_insert()
+        if archived:
+            log.info('Archived command partitions: %s', ', '.join(archived))
+
+    @partition_maintenance.before_loop
+    async def before_partition_maintenance(self):
+        await self.bot.wait_until_ready()
 
     @tasks.loop(seconds=0.0)
     async def gateway_worker(self):
@@ -118,16 +273,15 @@ class Stats(commands.Cog):
             guild_id = ctx.guild.id
 
         log.info(f'{message.created_at}: {message.author} in {destination}: {message.content}')
-        async with self._batch_lock:
-            self._data_batch.append({
-                'guild': guild_id,
-                'channel': ctx.channel.id,
-                'author': ctx.author.id,
-                'used': message.created_at.isoformat(),
-                'prefix': ctx.prefix,
-                'command': command,
-                'failed': ctx.command_failed,
-            })
+        await self._batch_writer.put({
+            'guild_id': guild_id,
+            'channel_id': ctx.channel.id,
+            'author_id': ctx.author.id,
+            'used': message.created_at,
+            'prefix': ctx.prefix,
+            'command': command,
+            'failed': ctx.command_failed,
+        })
 
     @commands.Cog.listener()
     async def on_command_completion(self, ctx):
@@ -279,22 +433,22 @@ class Stats(commands.Cog):
         embed = discord.Embed(title='Server Command Stats', colour=discord.Colour.blurple())
 
         # total command uses
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1;"
-        count = await ctx.db.fetchrow(query, ctx.guild.id)
+        query = "SELECT COALESCE(SUM(total), 0), MIN(first_used) FROM command_usage_daily WHERE guild_id=$1;"
+        count = await ctx.read_db.fetchrow(query, ctx.guild.id)
 
         embed.description = f'{count[0]} commands used.'
         embed.set_footer(text='Tracking command usage since').timestamp = count[1] or datetime.datetime.utcnow()
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(total) as "uses"
+                   FROM command_usage_daily
                    WHERE guild_id=$1
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)'
                           for (index, (command, uses)) in enumerate(records)) or 'No Commands'
@@ -302,16 +456,16 @@ class Stats(commands.Cog):
         embed.add_field(name='Top Commands', value=value, inline=True)
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(total) as "uses"
+                   FROM command_usage_hourly
                    WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)'
                           for (index, (command, uses)) in enumerate(records)) or 'No Commands.'
@@ -319,8 +473,8 @@ class Stats(commands.Cog):
         embed.add_field(name='\u200b', value='\u200b', inline=True)
 
         query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
+                          SUM(total) AS "uses"
+                   FROM command_usage_daily
                    WHERE guild_id=$1
                    GROUP BY author_id
                    ORDER BY "uses" DESC
@@ -328,7 +482,7 @@ class Stats(commands.Cog):
                 """
 
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot uses)'
                           for (index, (author_id, uses)) in enumerate(records)) or 'No bot users.'
@@ -336,17 +490,17 @@ class Stats(commands.Cog):
         embed.add_field(name='Top Command Users', value=value, inline=True)
 
         query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
+                          SUM(total) AS "uses"
+                   FROM command_usage_hourly
                    WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot uses)'
                           for (index, (author_id, uses)) in enumerate(records)) or 'No command users.'
@@ -367,22 +521,22 @@ class Stats(commands.Cog):
         embed.set_author(name=str(member), icon_url=member.avatar_url)
 
         # total command uses
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1 AND author_id=$2;"
-        count = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
+        query = "SELECT COALESCE(SUM(total), 0), MIN(first_used) FROM command_usage_daily WHERE guild_id=$1 AND author_id=$2;"
+        count = await ctx.read_db.fetchrow(query, ctx.guild.id, member.id)
 
         embed.description = f'{count[0]} commands used.'
         embed.set_footer(text='First command used').timestamp = count[1] or datetime.datetime.utcnow()
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(total) as "uses"
+                   FROM command_usage_daily
                    WHERE guild_id=$1 AND author_id=$2
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id, member.id)
 
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)'
                           for (index, (command, uses)) in enumerate(records)) or 'No Commands'
@@ -390,17 +544,17 @@ class Stats(commands.Cog):
         embed.add_field(name='Most Used Commands', value=value, inline=False)
 
         query = """SELECT command,
-                          COUNT(*) as "uses"
-                   FROM commands
+                          SUM(total) as "uses"
+                   FROM command_usage_hourly
                    WHERE guild_id=$1
                    AND author_id=$2
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                   AND bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id, member.id)
 
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)'
                           for (index, (command, uses)) in enumerate(records)) or 'No Commands'
@@ -411,6 +565,7 @@ class Stats(commands.Cog):
     @commands.group(invoke_without_command=True)
     @commands.guild_only()
     @commands.cooldown(1, 30.0, type=commands.BucketType.member)
+    @replica_safe()
     async def stats(self, ctx, *, member: discord.Member = None):
         """Tells you command usage stats for the server or a member."""
         async with ctx.typing():
@@ -421,11 +576,12 @@ class Stats(commands.Cog):
 
     @stats.command(name='global')
     @commands.is_owner()
+    @replica_safe()
     async def stats_global(self, ctx):
         """Global all time command statistics."""
 
-        query = "SELECT COUNT(*) FROM commands;"
-        total = await ctx.db.fetchrow(query)
+        query = "SELECT COALESCE(SUM(total), 0) FROM command_usage_daily;"
+        total = await ctx.read_db.fetchrow(query)
 
         e = discord.Embed(title='Command Stats', colour=discord.Colour.blurple())
         e.description = f'{total[0]} commands used.'
@@ -438,25 +594,25 @@ class Stats(commands.Cog):
             '\N{SPORTS MEDAL}'
         )
 
-        query = """SELECT command, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT command, SUM(total) AS "uses"
+                   FROM command_usage_daily
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)' for (index, (command, uses)) in enumerate(records))
         e.add_field(name='Top Commands', value=value, inline=False)
 
-        query = """SELECT guild_id, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT guild_id, SUM(total) AS "uses"
+                   FROM command_usage_daily
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = []
         for (index, (guild_id, uses)) in enumerate(records):
             if guild_id is None:
@@ -469,14 +625,14 @@ class Stats(commands.Cog):
 
         e.add_field(name='Top Guilds', value='\n'.join(value), inline=False)
 
-        query = """SELECT author_id, COUNT(*) AS "uses"
-                   FROM commands
+        query = """SELECT author_id, SUM(total) AS "uses"
+                   FROM command_usage_daily
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = []
         for (index, (author_id, uses)) in enumerate(records):
             user = self.censor_object(self.bot.get_user(author_id) or f'<Unknown {author_id}>')
@@ -486,13 +642,56 @@ class Stats(commands.Cog):
         e.add_field(name='Top Users', value='\n'.join(value), inline=False)
         await ctx.send(embed=e)
 
+    @stats.command(name='backfill')
+    @commands.is_owner()
+    async def stats_backfill(self, ctx):
+        """Rebuilds the command usage rollups from the raw command history."""
+
+        # anything still queued would otherwise be counted twice
+        await self._batch_writer.flush()
+        self._pending_rollups = []
+
+        hourly = """INSERT INTO command_usage_hourly (bucket, guild_id, author_id, command, failed, total, first_used)
+                    SELECT date_trunc('hour', used), guild_id, author_id, command, failed, COUNT(*), MIN(used)
+                    FROM commands
+                    WHERE used >= date_trunc('hour', CURRENT_TIMESTAMP - INTERVAL '7 days')
+                    GROUP BY 1, 2, 3, 4, 5;
+                 """
+
+        daily = """INSERT INTO command_usage_daily (bucket, guild_id, author_id, command, failed, total, first_used)
+                   SELECT bucket, guild_id, author_id, command, failed, SUM(total), MIN(first_used)
+                   FROM (
+                       SELECT date_trunc('day', used) AS "bucket", guild_id, author_id, command, failed,
+                              COUNT(*) AS "total", MIN(used) AS "first_used"
+                       FROM commands
+                       GROUP BY 1, 2, 3, 4, 5
+                       UNION ALL
+                       SELECT month::timestamp, guild_id, author_id, command, failed, total, month::timestamp
+                       FROM commands_archive
+                   ) AS usage
+                   GROUP BY 1, 2, 3, 4, 5;
+                """
+
+        async with ctx.typing():
+            async with ctx.acquire():
+                async with ctx.db.transaction():
+                    # blocks the batch writer until the rollups are consistent again
+                    await ctx.db.execute('LOCK TABLE command_usage_hourly, command_usage_daily IN EXCLUSIVE MODE;')
+                    await ctx.db.execute('TRUNCATE command_usage_hourly, command_usage_daily;')
+                    hourly = await ctx.db.execute(hourly)
+                    daily = await ctx.db.execute(daily)
+
+        # the statuses are e.g. INSERT 0 1234
+        await ctx.send(f'Rebuilt the rollups with {hourly.split()[-1]} hourly and {daily.split()[-1]} daily rows.')
+
     @stats.command(name='today')
     @commands.is_owner()
+    @replica_safe()
     async def stats_today(self, ctx):
         """Global command statistics for the day."""
 
-        query = "SELECT failed, COUNT(*) FROM commands WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day') GROUP BY failed;"
-        total = await ctx.db.fetch(query)
+        query = "SELECT failed, SUM(total) FROM command_usage_hourly WHERE bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP GROUP BY failed;"
+        total = await ctx.read_db.fetch(query)
         failed = 0
         success = 0
         question = 0
@@ -505,6 +704,7 @@ class Stats(commands.Cog):
                 question += count
 
         e = discord.Embed(title='Last 24 Hour Command Stats', colour=discord.Colour.blurple())
+        e.set_footer(text='Counted in whole hours, the current one and the 23 before it.')
         e.description = f'{failed + success + question} commands used today. ' \
                         f'({success} succeeded, {failed} failed, {question} unknown)'
 
@@ -516,27 +716,27 @@ class Stats(commands.Cog):
             '\N{SPORTS MEDAL}'
         )
 
-        query = """SELECT command, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT command, SUM(total) AS "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY command
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = '\n'.join(f'{lookup[index]}: {command} ({uses} uses)' for (index, (command, uses)) in enumerate(records))
         e.add_field(name='Top Commands', value=value, inline=False)
 
-        query = """SELECT guild_id, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT guild_id, SUM(total) AS "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY guild_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = []
         for (index, (guild_id, uses)) in enumerate(records):
             if guild_id is None:
@@ -548,15 +748,15 @@ class Stats(commands.Cog):
 
         e.add_field(name='Top Guilds', value='\n'.join(value), inline=False)
 
-        query = """SELECT author_id, COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+        query = """SELECT author_id, SUM(total) AS "uses"
+                   FROM command_usage_hourly
+                   WHERE bucket > date_trunc('hour', CURRENT_TIMESTAMP) - INTERVAL '1 day' AND bucket <= CURRENT_TIMESTAMP
                    GROUP BY author_id
                    ORDER BY "uses" DESC
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query)
+        records = await ctx.read_db.fetch(query)
         value = []
         for (index, (author_id, uses)) in enumerate(records):
             user = self.censor_object(self.bot.get_user(author_id) or f'<Unknown {author_id}>')
@@ -662,12 +862,24 @@ class Stats(commands.Cog):
         total_waiting = len(pool._queue._getters)
         current_generation = pool._generation
 
+        recorder = querystats.recorder
         description = [
             f'Total `Pool.acquire` Waiters: {total_waiting}',
             f'Current Pool Generation: {current_generation}',
-            f'Connections In Use: {len(pool._holders) - pool._queue.qsize()}'
+            f'Connections In Use: {len(pool._holders) - pool._queue.qsize()}',
+            f'Acquire Wait: {recorder.average_acquire_time * 1000:.2f}ms avg, '
+            f'{recorder.acquire_histogram.percentile(99) * 1000:.2f}ms p99, '
+            f'{recorder.max_acquire_time * 1000:.2f}ms max',
         ]
 
+        manager = getattr(self.bot, 'pool_manager', None)
+        if manager is not None:
+            peak_waiters = max((s.waiters for s in manager.samples), default=0)
+            description.append(f'Pool Size: {manager.size} (bounds {manager.min_size}-{manager.max_size}, '
+                               f'grown {manager.grown}, shrunk {manager.shrunk})'
+                               f'{"" if manager.enabled else " (resizing disabled)"}')
+            description.append(f'Peak Waiters (last {len(manager.samples)} samples): {peak_waiters}')
+
         questionable_connections = 0
         connection_value = []
         for index, holder in enumerate(pool._holders, start=1):
@@ -720,9 +932,11 @@ class Stats(commands.Cog):
         embed.add_field(name='Inner Tasks', value=f'Total: {len(inner_tasks)}\nFailed: {bad_inner_tasks or "None"}')
         embed.add_field(name='Events Waiting', value=f'Total: {len(event_tasks)}', inline=False)
 
-        command_waiters = len(self._data_batch)
-        is_locked = self._batch_lock.locked()
-        description.append(f'Commands Waiting: {command_waiters}, Batch Locked: {is_locked}')
+        writer = self._batch_writer
+        command_waiters = writer.pending
+        description.append(f'Commands Waiting: {command_waiters}, Flushing: {writer.is_flushing}')
+        description.append(f'Command Batches: {writer.flushes} flushed, {writer.failures} failed, {writer.dropped} dropped '
+                           f'({writer.error_dropped} due to errors)')
 
         memory_usage = self.process.memory_full_info().uss / 1024**2
         cpu_usage = self.process.cpu_percent() / psutil.cpu_count()
@@ -742,6 +956,117 @@ class Stats(commands.Cog):
         embed.description = '\n'.join(description)
         await ctx.send(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cachememory(self, ctx):
+        """Shows how much memory every registered cache and state store holds."""
+
+        sizes = sorted(cache.guild_state.get_sizes(), key=lambda t: t[2], reverse=True)
+        table = formats.TabularData()
+        table.set_columns(['Store', 'Entries', 'KiB'])
+        table.add_rows((name, entries, f'{size / 1024:.1f}') for name, entries, size in sizes)
+        total = sum(t[2] for t in sizes) / 1024
+
+        fmt = f'```\n{table.render()}\n```\nTotal: {total:.1f} KiB (approximate)'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            await ctx.send('Too many results...', file=discord.File(fp, 'cachememory.txt'))
+        else:
+            await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        """Shows statistics for every cached function, sorted by total time spent loading."""
+
+        table = formats.TabularData()
+        table.set_columns(['Cache', 'Size', 'Hit %', 'Misses', 'Evictions', 'Avg Load', 'Total Load'])
+
+        caches = sorted(cache.all_caches.items(), key=lambda t: t[1].stats.load_time, reverse=True)
+        for name, wrapper in caches:
+            stats = wrapper.stats
+            size = f'{len(wrapper.cache)}/{wrapper.maxsize}' if wrapper.maxsize else str(len(wrapper.cache))
+            table.add_row([
+                name.replace('cogs.', '', 1),
+                size,
+                f'{stats.hit_ratio:.1%}',
+                stats.misses,
+                stats.evictions,
+                f'{stats.average_load_time * 1000:.2f}ms',
+                f'{stats.load_time:.2f}s',
+            ])
+
+        fmt = f'```\n{table.render()}\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            await ctx.send('Too many results...', file=discord.File(fp, 'cachestats.txt'))
+        else:
+            await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def querystats(self, ctx, sort='total', count: int = 15):
+        """Shows the slowest queries.
+
+        You can sort by total, avg, max, calls or rows.
+        Pass reset to clear the current statistics or
+        prepared to show how often prepared statements were reused.
+        """
+
+        recorder = querystats.recorder
+        if sort == 'reset':
+            recorder.reset()
+            return await ctx.send('Query statistics have been reset.')
+
+        if sort == 'prepared':
+            prepared = db.prepared
+            table = formats.TabularData()
+            table.set_columns(['Statement', 'Hits', 'Prepares', 'Hit %'])
+            for name in sorted(prepared.queries, key=lambda n: prepared.hits[n], reverse=True)[:count]:
+                hits, prepares = prepared.hits[name], prepared.prepares[name]
+                ratio = hits / (hits + prepares) if hits + prepares else 0.0
+                table.add_row([name, hits, prepares, f'{ratio:.1%}'])
+            return await ctx.send(f'```\n{table.render()}\n```')
+
+        keys = {
+            'total': 'total_time',
+            'avg': 'average_time',
+            'max': 'max_time',
+            'calls': 'calls',
+            'rows': 'rows',
+        }
+
+        try:
+            key = keys[sort]
+        except KeyError:
+            return await ctx.send(f'Unknown sort key, use one of {", ".join(keys)}.')
+
+        def ms(seconds):
+            return f'{seconds * 1000:.1f}ms'
+
+        table = formats.TabularData()
+        table.set_columns(['Query', 'Calls', 'Total', 'Avg', 'p50', 'p95', 'p99', 'Rows', 'Top Origin'])
+        for stats in recorder.top(count, key=key):
+            top_origin, _ = stats.origins.most_common(1)[0]
+            table.add_row([
+                textwrap.shorten(stats.query, width=60),
+                stats.calls,
+                f'{stats.total_time:.2f}s',
+                ms(stats.average_time),
+                ms(stats.histogram.percentile(50)),
+                ms(stats.histogram.percentile(95)),
+                ms(stats.histogram.percentile(99)),
+                stats.rows,
+                top_origin or 'unknown',
+            ])
+
+        fmt = f'```\n{table.render()}\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            await ctx.send('Too many results...', file=discord.File(fp, 'querystats.txt'))
+        else:
+            await ctx.send(fmt)
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def gateway(self, ctx):
@@ -839,7 +1164,7 @@ class Stats(commands.Cog):
             await ctx.send(page)
 
     async def tabulate_query(self, ctx, query, *args):
-        records = await ctx.db.fetch(query, *args)
+        records = await ctx.read_db.fetch(query, *args)
 
         if len(records) == 0:
             return await ctx.send('No results found.')
@@ -857,11 +1182,28 @@ class Stats(commands.Cog):
         else:
             await ctx.send(fmt)
 
+    async def paginate_history(self, ctx, query, *args, hidden=('id', 'used')):
+        # the query has to select id and used for the keyset
+        # pages are fetched after the command returns so this can't use ctx.db
+        pool = getattr(self.bot, 'read_pool', None) or ctx.pool
+        records = db.KeysetPaginator(pool, query, *args, key=('used', 'id'), descending=True, per_page=60)
+        source = TabularPageSource(records, hidden=hidden)
+        if await source.is_empty():
+            return await ctx.send('No results found.')
+
+        try:
+            await RoboPages(source).start(ctx)
+        except menus.MenuError as e:
+            await ctx.send(e)
+
     @commands.group(hidden=True, invoke_without_command=True)
     @commands.is_owner()
+    @replica_safe()
     async def command_history(self, ctx):
         """Command history."""
         query = """SELECT
+                        id,
+                        used,
                         CASE failed
                             WHEN TRUE THEN command || ' [!]'
                             ELSE command
@@ -870,13 +1212,12 @@ class Stats(commands.Cog):
                         author_id,
                         guild_id
                    FROM commands
-                   ORDER BY used DESC
-                   LIMIT 15;
                 """
-        await self.tabulate_query(ctx, query)
+        await self.paginate_history(ctx, query)
 
     @command_history.command(name='for')
     @commands.is_owner()
+    @replica_safe()
     async def command_history_for(self, ctx, days: typing.Optional[int] = 7, *, command: str):
         """Command history for a command."""
 
@@ -898,10 +1239,12 @@ class Stats(commands.Cog):
 
     @command_history.command(name='guild', aliases=['server'])
     @commands.is_owner()
+    @replica_safe()
     async def command_history_guild(self, ctx, guild_id: int):
         """Command history for a guild."""
 
         query = """SELECT
+                        id,
                         CASE failed
                             WHEN TRUE THEN command || ' [!]'
                             ELSE command
@@ -911,17 +1254,17 @@ class Stats(commands.Cog):
                         used
                    FROM commands
                    WHERE guild_id=$1
-                   ORDER BY used DESC
-                   LIMIT 15;
                 """
-        await self.tabulate_query(ctx, query, guild_id)
+        await self.paginate_history(ctx, query, guild_id, hidden=('id',))
 
     @command_history.command(name='user', aliases=['member'])
     @commands.is_owner()
+    @replica_safe()
     async def command_history_user(self, ctx, user_id: int):
         """Command history for a user."""
 
         query = """SELECT
+                        id,
                         CASE failed
                             WHEN TRUE THEN command || ' [!]'
                             ELSE command
@@ -930,13 +1273,12 @@ class Stats(commands.Cog):
                         used
                    FROM commands
                    WHERE author_id=$1
-                   ORDER BY used DESC
-                   LIMIT 20;
                 """
-        await self.tabulate_query(ctx, query, user_id)
+        await self.paginate_history(ctx, query, user_id, hidden=('id',))
 
     @command_history.command(name='log')
     @commands.is_owner()
+    @replica_safe()
     async def command_history_log(self, ctx, days=7):
         """Command history log for the last N days."""
 
@@ -952,7 +1294,7 @@ class Stats(commands.Cog):
             for c in self.bot.walk_commands()
         }
 
-        records = await ctx.db.fetch(query, datetime.timedelta(days=days))
+        records = await ctx.read_db.fetch(query, datetime.timedelta(days=days))
         for name, uses in records:
             if name in all_commands:
                 all_commands[name] = uses
@@ -981,6 +1323,7 @@ class Stats(commands.Cog):
 
     @command_history.command(name='cog')
     @commands.is_owner()
+    @replica_safe()
     async def command_history_cog(self, ctx, days: typing.Optional[int] = 7, *, cog: str = None):
         """Command history for a cog or grouped by a cog."""
 
@@ -1030,7 +1373,7 @@ class Stats(commands.Cog):
                 self.total += record['total']
 
         data = defaultdict(Count)
-        records = await ctx.db.fetch(query, interval)
+        records = await ctx.read_db.fetch(query, interval)
         for record in records:
             command = self.bot.get_command(record['command'])
             if command is None or command.cog is None:
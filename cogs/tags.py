@@ -1,7 +1,11 @@
 from .utils import db, checks, formats, cache
-from .utils.paginator import SimplePages
+from .utils.batch import BatchWriter, Overflow
+from .utils.sampler import RandomSampler
+from .utils.paginator import SimplePages, LazySimplePages
+from .utils.context import replica_safe
 
 from discord.ext import commands, menus
+from collections import Counter
 import json
 import re
 import io
@@ -48,6 +52,14 @@ class TagPages(SimplePages):
         converted = [TagPageEntry(entry) for entry in entries]
         super().__init__(converted, per_page=per_page)
 
+class LazyTagPages(LazySimplePages):
+    def __init__(self, iterator, *, per_page=12):
+        async def converted():
+            async for entry in iterator:
+                yield TagPageEntry(entry)
+
+        super().__init__(converted(), per_page=per_page)
+
 def can_use_box():
     def pred(ctx):
         if ctx.guild is None:
@@ -164,6 +176,51 @@ class Tags(commands.Cog):
 
         # guild_id: set(name)
         self._reserved_tags_being_made = {}
+        cache.guild_state.register('tags.reserved_tags', self._reserved_tags_being_made)
+
+        query = "SELECT name, content FROM tags WHERE id=$1;"
+        db.prepared.register('tags.get_tag', query)
+
+        # (name, location_id): uses
+        self._uses_writer = BatchWriter(self.bulk_update_uses, factory=Counter,
+                                        add=lambda batch, key: batch.update((key,)),
+                                        interval=30.0, max_pending=100000, overflow=Overflow.drop,
+                                        name='tags.uses', loop=bot.loop)
+        self._uses_writer.start()
+
+        # guild_id: IdArray of tag IDs, None is the tag box
+        self._random_tags = RandomSampler(self.load_tag_ids)
+        cache.guild_state.register('tags.random', self._random_tags.arrays, purge_guild=self._random_tags.invalidate)
+
+    def cog_unload(self):
+        self._uses_writer.stop()
+        cache.guild_state.unregister('tags.reserved_tags')
+        cache.guild_state.unregister('tags.random')
+        db.prepared.unregister('tags.get_tag')
+
+    async def bulk_update_uses(self, batch):
+        query = """UPDATE tags
+                   SET uses = tags.uses + x.uses
+                   FROM jsonb_to_recordset($1::jsonb) AS
+                   x(name TEXT, location_id BIGINT, uses INTEGER)
+                   WHERE tags.name = x.name
+                   AND tags.location_id IS NOT DISTINCT FROM x.location_id;
+                """
+
+        data = [
+            {'name': name, 'location_id': location_id, 'uses': uses}
+            for (name, location_id), uses in batch.items()
+        ]
+        await self.bot.pool.execute(query, data)
+
+    def pending_uses(self, location_id):
+        """Returns the uses of tags in a location that haven't been written yet."""
+        pending = Counter()
+        for batch in self._uses_writer.buffers():
+            for (name, location), uses in batch.items():
+                if location == location_id:
+                    pending[name] += uses
+        return pending
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, (UnavailableTagCommand, UnableToUseBox)):
@@ -201,26 +258,75 @@ class Tags(commands.Cog):
         query = """SELECT name, content FROM tags WHERE location_id=$1;"""
         return con.fetch(query, guild.id)
 
+    async def load_tag_ids(self, guild_id):
+        if guild_id is None:
+            query = "SELECT id FROM tags WHERE location_id IS NULL;"
+            records = await self.bot.pool.fetch(query)
+        else:
+            query = "SELECT id FROM tags WHERE location_id=$1;"
+            records = await self.bot.pool.fetch(query, guild_id)
+        return [record[0] for record in records]
+
     async def get_random_tag(self, guild, *, connection=None):
         """Returns a random tag."""
 
+        guild_id = guild and guild.id
+        async def fetch(tag_id):
+            row = await self.get_tag_content(guild_id, tag_id, connection=connection)
+            if row is None:
+                # deleted since the IDs were loaded, don't keep the miss cached
+                self.get_tag_content.invalidate(self, guild_id, tag_id)
+            return row
+
+        async def fallback():
+            con = connection or self.bot.pool
+            if guild_id is None:
+                query = "SELECT name, content FROM tags WHERE location_id IS NULL ORDER BY random() LIMIT 1;"
+                return await con.fetchrow(query)
+
+            query = "SELECT name, content FROM tags WHERE location_id=$1 ORDER BY random() LIMIT 1;"
+            return await con.fetchrow(query, guild_id)
+
+        return await self._random_tags.sample(guild_id, fetch, fallback)
+
+    @cache.cache(maxsize=256, name='tags.index')
+    async def get_tag_index(self, guild_id, *, connection=None):
+        """Returns a mapping of every lowercased tag name and alias in a guild to its tag ID."""
         con = connection or self.bot.pool
-        pred = 'location_id IS NULL' if guild is None else 'location_id=$1'
-        query = f"""SELECT name, content
-                    FROM tags
-                    WHERE {pred}
-                    OFFSET FLOOR(RANDOM() * (
-                        SELECT COUNT(*)
-                        FROM tags
-                        WHERE {pred}
-                    ))
-                    LIMIT 1;
-                 """
+        query = "SELECT LOWER(name), tag_id FROM tag_lookup WHERE location_id=$1;"
+        return dict(await con.fetch(query, guild_id))
 
-        if guild is None:
-            return await con.fetchrow(query)
-        else:
-            return await con.fetchrow(query, guild.id)
+    @cache.cache(maxsize=2048, name='tags.content')
+    async def get_tag_content(self, guild_id, tag_id, *, connection=None):
+        con = connection or self.bot.pool
+        return await db.prepared.fetchrow(con, 'tags.get_tag', tag_id)
+
+    def invalidate_tag(self, guild_id, tag_id=None):
+        """Evicts a guild's tag index and optionally a tag's content after they change."""
+        self.get_tag_index.invalidate(self, guild_id)
+        if tag_id is not None:
+            self.get_tag_content.invalidate(self, guild_id, tag_id)
+            self._random_tags.discard(guild_id, tag_id)
+
+    def tag_name_added(self, guild_id, name, tag_id):
+        """Adds a newly created tag or alias to the guild's cached tag index."""
+        key = self.get_tag_index.get_key(self, guild_id)
+        self.get_tag_index.update_key(key, lambda index: index.__setitem__(name.lower(), tag_id))
+
+    def tag_name_removed(self, guild_id, name):
+        """Removes a deleted alias from the guild's cached tag index."""
+        key = self.get_tag_index.get_key(self, guild_id)
+        self.get_tag_index.update_key(key, lambda index: index.pop(name.lower(), None))
+
+    def tag_removed(self, guild_id, tag_id):
+        """Removes a deleted tag and all of its aliases from the guild's cached tag index."""
+        def remove(index):
+            for name in [name for name, value in index.items() if value == tag_id]:
+                del index[name]
+
+        self.get_tag_index.update_key(self.get_tag_index.get_key(self, guild_id), remove)
+        self.get_tag_content.invalidate(self, guild_id, tag_id)
+        self._random_tags.discard(guild_id, tag_id)
 
     async def get_tag(self, guild_id, name, *, connection=None):
         def disambiguate(rows, query):
@@ -232,13 +338,15 @@ class Tags(commands.Cog):
 
         con = connection or self.bot.pool
 
-        query = """SELECT tags.name, tags.content
-                   FROM tag_lookup
-                   INNER JOIN tags ON tags.id = tag_lookup.tag_id
-                   WHERE tag_lookup.location_id=$1 AND LOWER(tag_lookup.name)=$2;
-                """
+        index = await self.get_tag_index(guild_id, connection=con)
+        tag_id = index.get(name.lower())
+        row = None
+        if tag_id is not None:
+            row = await self.get_tag_content(guild_id, tag_id, connection=con)
+            if row is None:
+                # deleted by something that didn't invalidate the index
+                self.invalidate_tag(guild_id, tag_id)
 
-        row = await con.fetchrow(query, guild_id, name)
         if row is None:
             query = """SELECT     tag_lookup.name
                        FROM       tag_lookup
@@ -261,7 +369,8 @@ class Tags(commands.Cog):
                         RETURNING id
                     )
                     INSERT INTO tag_lookup (name, owner_id, location_id, tag_id)
-                    VALUES ($1, $3, $4, (SELECT id FROM tag_insert));
+                    VALUES ($1, $3, $4, (SELECT id FROM tag_insert))
+                    RETURNING tag_id;
                 """
 
         # since I'm checking for the exception type and acting on it, I need
@@ -272,7 +381,7 @@ class Tags(commands.Cog):
             await tr.start()
 
             try:
-                await ctx.db.execute(query, name, content, ctx.author.id, ctx.guild.id)
+                tag_id = await ctx.db.fetchval(query, name, content, ctx.author.id, ctx.guild.id)
             except asyncpg.UniqueViolationError:
                 await tr.rollback()
                 await ctx.send('This tag already exists.')
@@ -281,6 +390,8 @@ class Tags(commands.Cog):
                 await ctx.send('Could not create tag.')
             else:
                 await tr.commit()
+                self.tag_name_added(ctx.guild.id, name, tag_id)
+                self._random_tags.add(ctx.guild.id, tag_id)
                 await ctx.send(f'Tag {name} successfully created.')
 
     def is_tag_being_made(self, guild_id, name):
@@ -322,8 +433,7 @@ class Tags(commands.Cog):
         await ctx.send(tag['content'], reference=ctx.replied_reference)
 
         # update the usage
-        query = "UPDATE tags SET uses = uses + 1 WHERE name = $1 AND (location_id=$2 OR location_id IS NULL);"
-        await ctx.db.execute(query, tag['name'], ctx.guild.id)
+        self._uses_writer.add((tag['name'], ctx.guild.id))
 
     @tag.command(aliases=['add'])
     @suggest_box()
@@ -357,18 +467,20 @@ class Tags(commands.Cog):
         query = """INSERT INTO tag_lookup (name, owner_id, location_id, tag_id)
                    SELECT $1, $4, tag_lookup.location_id, tag_lookup.tag_id
                    FROM tag_lookup
-                   WHERE tag_lookup.location_id=$3 AND LOWER(tag_lookup.name)=$2;
+                   WHERE tag_lookup.location_id=$3 AND LOWER(tag_lookup.name)=$2
+                   RETURNING tag_id;
                 """
 
         try:
-            status = await ctx.db.execute(query, new_name, old_name.lower(), ctx.guild.id, ctx.author.id)
+            tag_id = await ctx.db.fetchval(query, new_name, old_name.lower(), ctx.guild.id, ctx.author.id)
         except asyncpg.UniqueViolationError:
             await ctx.send('A tag with this name already exists.')
         else:
-            # The status returns INSERT N M, where M is the number of rows inserted.
-            if status[-1] == '0':
+            # nothing is returned if no rows were inserted
+            if tag_id is None:
                 await ctx.send(f'A tag with the name of "{old_name}" does not exist.')
             else:
+                self.tag_name_added(ctx.guild.id, new_name, tag_id)
                 await ctx.send(f'Tag alias "{new_name}" that points to "{old_name}" successfully created.')
 
     @tag.command(ignore_extra=False)
@@ -478,13 +590,15 @@ class Tags(commands.Cog):
                    LIMIT 3;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
+        pending = self.pending_uses(ctx.guild.id)
         if not records:
             e.description = 'No tag statistics here.'
         else:
             total = records[0]
-            e.description = f'{total["Count"]} tags, {total["Total Uses"]} tag uses'
+            e.description = f'{total["Count"]} tags, {total["Total Uses"] + sum(pending.values())} tag uses'
 
+        records = await self.merge_pending_top(ctx, records, pending)
         if len(records) < 3:
             # fill with data to ensure that we have a minimum of 3
             records.extend((None, None, None, None) for i in range(0, 3 - len(records)))
@@ -511,7 +625,7 @@ class Tags(commands.Cog):
                    LIMIT 3;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         if len(records) < 3:
             # fill with data to ensure that we have a minimum of 3
@@ -533,7 +647,7 @@ class Tags(commands.Cog):
                    LIMIT 3;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id)
 
         if len(records) < 3:
             # fill with data to ensure that we have a minimum of 3
@@ -545,6 +659,26 @@ class Tags(commands.Cog):
 
         await ctx.send(embed=e)
 
+    async def merge_pending_top(self, ctx, records, pending, *, owner_id=None):
+        """Adds the pending uses to a top 3 of (name, uses, ...) records."""
+        if not pending:
+            return records
+
+        rows = [(name, uses + pending[name], *rest) for (name, uses, *rest) in records]
+        known = {record[0] for record in records}
+        missing = [name for name in pending if name not in known]
+        if missing and len(records) == 3:
+            # these could have overtaken the ones that were fetched
+            query = """SELECT name, uses FROM tags
+                       WHERE location_id=$1 AND name = ANY($2::text[])
+                       AND ($3::bigint IS NULL OR owner_id=$3)
+                    """
+            extra = await ctx.read_db.fetch(query, ctx.guild.id, missing, owner_id)
+            rows.extend((name, uses + pending[name], None, None) for name, uses in extra)
+
+        rows.sort(key=lambda row: row[1], reverse=True)
+        return rows[:3]
+
     async def member_tag_stats(self, ctx, member):
         e = discord.Embed(colour=discord.Colour.blurple())
         e.set_author(name=str(member), icon_url=member.avatar_url)
@@ -555,7 +689,7 @@ class Tags(commands.Cog):
                    WHERE guild_id=$1 AND command='tag' AND author_id=$2
                 """
 
-        count = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
+        count = await ctx.read_db.fetchrow(query, ctx.guild.id, member.id)
 
         # top 3 commands and total tags/uses
         query = """SELECT
@@ -569,15 +703,23 @@ class Tags(commands.Cog):
                    LIMIT 3;
                 """
 
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
+        records = await ctx.read_db.fetch(query, ctx.guild.id, member.id)
+        pending = self.pending_uses(ctx.guild.id)
+        if pending and records:
+            # only the member's own tags count towards their uses
+            query = "SELECT name FROM tags WHERE location_id=$1 AND owner_id=$2 AND name = ANY($3::text[]);"
+            rows = await ctx.read_db.fetch(query, ctx.guild.id, member.id, list(pending))
+            pending = Counter({name: pending[name] for name, in rows})
 
         if len(records) > 1:
             owned = records[0]['Count']
-            uses = records[0]['Uses']
+            uses = records[0]['Uses'] + sum(pending.values())
         else:
             owned = 'None'
             uses = 0
 
+        records = await self.merge_pending_top(ctx, records, pending, owner_id=member.id)
+
         e.add_field(name='Owned Tags', value=owned)
         e.add_field(name='Owned Tag Uses', value=uses)
         e.add_field(name='Tag Command Uses', value=count[0])
@@ -600,6 +742,7 @@ class Tags(commands.Cog):
 
     @tag.command()
     @suggest_box()
+    @replica_safe()
     async def stats(self, ctx, *, member: TagMember = None):
         """Gives tag statistics for a member or the server."""
 
@@ -618,16 +761,14 @@ class Tags(commands.Cog):
         tag raw command.
         """
 
-        query = "UPDATE tags SET content=$1 WHERE LOWER(name)=$2 AND location_id=$3 AND owner_id=$4;"
-        status = await ctx.db.execute(query, content, name, ctx.guild.id, ctx.author.id)
+        query = "UPDATE tags SET content=$1 WHERE LOWER(name)=$2 AND location_id=$3 AND owner_id=$4 RETURNING id;"
+        tag_id = await ctx.db.fetchval(query, content, name, ctx.guild.id, ctx.author.id)
 
-        # the status returns UPDATE <count>
-        # if the <count> is 0, then nothing got updated
-        # probably due to the WHERE clause failing
-
-        if status[-1] == '0':
+        # nothing got updated, probably due to the WHERE clause failing
+        if tag_id is None:
             await ctx.send('Could not edit that tag. Are you sure it exists and you own it?')
         else:
+            self.get_tag_content.invalidate(self, ctx.guild.id, tag_id)
             await ctx.send('Successfully edited tag.')
 
     @tag.command(aliases=['delete'])
@@ -665,8 +806,10 @@ class Tags(commands.Cog):
         # the status returns DELETE <count>, similar to UPDATE above
         if status[-1] == '0':
             # this is based on the previous delete above
+            self.tag_name_removed(ctx.guild.id, name)
             await ctx.send('Tag alias successfully deleted.')
         else:
+            self.tag_removed(ctx.guild.id, deleted[0])
             await ctx.send('Tag and corresponding aliases successfully deleted.')
 
     @tag.command(aliases=['delete_id'])
@@ -690,7 +833,7 @@ class Tags(commands.Cog):
             args = [tag_id, ctx.guild.id, ctx.author.id]
             clause = f'{clause} AND owner_id=$3'
 
-        query = f'DELETE FROM tag_lookup WHERE {clause} RETURNING tag_id;'
+        query = f'DELETE FROM tag_lookup WHERE {clause} RETURNING tag_id, name;'
         deleted = await ctx.db.fetchrow(query, *args)
 
         if deleted is None:
@@ -711,8 +854,10 @@ class Tags(commands.Cog):
         # the status returns DELETE <count>, similar to UPDATE above
         if status[-1] == '0':
             # this is based on the previous delete above
+            self.tag_name_removed(ctx.guild.id, deleted['name'])
             await ctx.send('Tag alias successfully deleted.')
         else:
+            self.tag_removed(ctx.guild.id, deleted[0])
             await ctx.send('Tag and corresponding aliases successfully deleted.')
 
     async def _send_alias_info(self, ctx, record):
@@ -742,7 +887,7 @@ class Tags(commands.Cog):
         embed.set_author(name=str(user), icon_url=user.avatar_url)
 
         embed.add_field(name='Owner', value=f'<@{owner_id}>')
-        embed.add_field(name='Uses', value=record['uses'])
+        embed.add_field(name='Uses', value=record['uses'] + self.pending_uses(record['location_id'])[record['name']])
 
         query = """SELECT (
                        SELECT COUNT(*)
@@ -815,21 +960,19 @@ class Tags(commands.Cog):
         query = """SELECT name, id
                    FROM tag_lookup
                    WHERE location_id=$1 AND owner_id=$2
-                   ORDER BY name
                 """
 
-        rows = await ctx.db.fetch(query, ctx.guild.id, member.id)
         await ctx.release()
+        rows = db.KeysetPaginator(ctx.pool, query, ctx.guild.id, member.id, key=('name', 'id'))
+        p = LazyTagPages(rows)
+        if await p.source.is_empty():
+            return await ctx.send(f'{member} has no tags.')
 
-        if rows:
-            try:
-                p = TagPages(entries=rows)
-                p.embed.set_author(name=member.display_name, icon_url=member.avatar_url)
-                await p.start(ctx)
-            except menus.MenuError as e:
-                await ctx.send(e)
-        else:
-            await ctx.send(f'{member} has no tags.')
+        try:
+            p.embed.set_author(name=member.display_name, icon_url=member.avatar_url)
+            await p.start(ctx)
+        except menus.MenuError as e:
+            await ctx.send(e)
 
     @commands.command()
     @suggest_box()
@@ -891,21 +1034,19 @@ class Tags(commands.Cog):
         query = """SELECT name, id
                    FROM tag_lookup
                    WHERE location_id=$1
-                   ORDER BY name
                 """
 
-        rows = await ctx.db.fetch(query, ctx.guild.id)
         await ctx.release()
+        rows = db.KeysetPaginator(ctx.pool, query, ctx.guild.id, key=('name', 'id'))
+        p = LazyTagPages(rows, per_page=20)
+        if await p.source.is_empty():
+            return await ctx.send('This server has no server-specific tags.')
 
-        if rows:
-            # PSQL orders this oddly for some reason
-            try:
-                p = TagPages(entries=rows, per_page=20)
-                await p.start(ctx)
-            except menus.MenuError as e:
-                await ctx.send(e)
-        else:
-            await ctx.send('This server has no server-specific tags.')
+        # PSQL orders this oddly for some reason
+        try:
+            await p.start(ctx)
+        except menus.MenuError as e:
+            await ctx.send(e)
 
     @tag.command()
     @suggest_box()
@@ -931,6 +1072,9 @@ class Tags(commands.Cog):
 
         query = "DELETE FROM tags WHERE location_id=$1 AND owner_id=$2;"
         await ctx.db.execute(query, ctx.guild.id, member.id)
+        self.invalidate_tag(ctx.guild.id)
+        self.get_tag_content.invalidate_containing(ctx.guild.id)
+        self._random_tags.invalidate(ctx.guild.id)
 
         await ctx.send(f'Successfully removed all {count} tags that belong to {member}.')
 
@@ -945,25 +1089,22 @@ class Tags(commands.Cog):
         if len(query) < 3:
             return await ctx.send('The query length must be at least three characters.')
 
-        sql = """SELECT name, id
+        sql = """SELECT name, id, similarity(name, $2) AS "similarity"
                  FROM tag_lookup
                  WHERE location_id=$1 AND name % $2
-                 ORDER BY similarity(name, $2) DESC
-                 LIMIT 100;
               """
 
-        results = await ctx.db.fetch(sql, ctx.guild.id, query)
+        await ctx.release()
+        results = db.KeysetPaginator(ctx.pool, sql, ctx.guild.id, query, key=('similarity', 'id'),
+                                     descending=True, limit=100)
+        p = LazyTagPages(results, per_page=20)
+        if await p.source.is_empty():
+            return await ctx.send('No tags found.')
 
-        if results:
-            try:
-                p = TagPages(entries=results, per_page=20)
-            except menus.MenuError as e:
-                await ctx.send(e)
-            else:
-                await ctx.release()
-                await p.start(ctx)
-        else:
-            await ctx.send('No tags found.')
+        try:
+            await p.start(ctx)
+        except menus.MenuError as e:
+            await ctx.send(e)
 
     @tag.command()
     @suggest_box()
@@ -1048,13 +1189,14 @@ class Tags(commands.Cog):
         via the "tag box take" subcommand.
         """
 
-        query = "INSERT INTO tags (name, content, owner_id) VALUES ($1, $2, $3);"
+        query = "INSERT INTO tags (name, content, owner_id) VALUES ($1, $2, $3) RETURNING id;"
 
         try:
-            await ctx.db.execute(query, name, content, ctx.author.id)
+            tag_id = await ctx.db.fetchval(query, name, content, ctx.author.id)
         except asyncpg.UniqueViolationError:
             await ctx.send('A tag with this name exists in the box already.')
         else:
+            self._random_tags.add(None, tag_id)
             await ctx.send('Successfully put tag in the box.')
 
     @box.command(name='take')
@@ -1090,9 +1232,7 @@ class Tags(commands.Cog):
             return await ctx.send('A tag with this name cannot be found in the box.')
 
         await ctx.send(tag['content'])
-
-        query = "UPDATE tags SET uses = uses + 1 WHERE name=$1 AND location_id IS NULL;"
-        await ctx.db.execute(query, tag['name'])
+        self._uses_writer.add((tag['name'], None))
 
     @box.command(name='edit', aliases=['change'])
     async def box_edit(self, ctx, name: TagName(lower=True), *, content: commands.clean_content):
@@ -1104,12 +1244,13 @@ class Tags(commands.Cog):
         took it for their own personal use.
         """
 
-        query = "UPDATE tags SET content = $2 WHERE LOWER(name)=$1 AND owner_id=$3 AND location_id IS NULL;"
-        status = await ctx.db.execute(query, name, content, ctx.author.id)
+        query = "UPDATE tags SET content = $2 WHERE LOWER(name)=$1 AND owner_id=$3 AND location_id IS NULL RETURNING id;"
+        tag_id = await ctx.db.fetchval(query, name, content, ctx.author.id)
 
-        if status[-1] == '0':
+        if tag_id is None:
             await ctx.send('This tag is either not in the box or you do not own it.')
         else:
+            self.get_tag_content.invalidate(self, None, tag_id)
             await ctx.send('Successfully edited tag.')
 
     @box.command(name='delete', aliases=['remove'])
@@ -1122,12 +1263,14 @@ class Tags(commands.Cog):
         took it for their own personal use.
         """
 
-        query = "DELETE FROM tags WHERE LOWER(name)=$1 AND owner_id=$2 AND location_id IS NULL;"
-        status = await ctx.db.execute(query, name, ctx.author.id)
+        query = "DELETE FROM tags WHERE LOWER(name)=$1 AND owner_id=$2 AND location_id IS NULL RETURNING id;"
+        tag_id = await ctx.db.fetchval(query, name, ctx.author.id)
 
-        if status[-1] == '0':
+        if tag_id is None:
             await ctx.send('This tag is either not in the box or you do not own it.')
         else:
+            self.get_tag_content.invalidate(self, None, tag_id)
+            self._random_tags.discard(None, tag_id)
             await ctx.send('Successfully deleted tag.')
 
     @box.command(name='info')
@@ -1160,7 +1303,7 @@ class Tags(commands.Cog):
         embed.set_author(name=str(user), icon_url=user.avatar_url)
 
         embed.add_field(name='Owner', value=f'<@{owner_id}>')
-        embed.add_field(name='Uses', value=data['uses'])
+        embed.add_field(name='Uses', value=data['uses'] + self.pending_uses(None)[data['name']])
         embed.add_field(name='Rank', value=data['rank'])
 
         await ctx.send(embed=embed)
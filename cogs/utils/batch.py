@@ -0,0 +1,205 @@
+import asyncio
+import enum
+import logging
+import time
+
+import asyncpg
+
+from . import querystats
+
+log = logging.getLogger(__name__)
+
+class Overflow(enum.Enum):
+    # wait for a flush to make room, only applies to BatchWriter.put
+    block = 1
+    # discard the item
+    drop = 2
+
+class BatchWriter:
+    """Buffers items in memory and writes them out in bulk.
+
+    Producers add to the current buffer without ever waiting on I/O.
+    When a flush happens the buffer is swapped for a fresh one and the
+    old one is handed to ``flush``, so producers keep adding to the new
+    buffer while the write is in flight.
+
+    A flush happens every ``interval`` seconds or as soon as ``max_batch``
+    items have been added, whichever comes first.
+
+    Parameters
+    -----------
+    flush
+        The coroutine called with a full buffer to write it out.
+    factory
+        Creates an empty buffer. Defaults to ``list``.
+    add
+        Called as ``add(buffer, item)`` to put an item into the buffer.
+        Defaults to ``buffer.append(item)``.
+    interval: float
+        The maximum number of seconds between flushes.
+    max_batch: int
+        The number of items that triggers an early flush.
+    max_pending: Optional[int]
+        The maximum number of items to hold before applying ``overflow``.
+        This bounds the memory used while the database is unreachable.
+        ``None`` removes the limit.
+    overflow: Overflow
+        What to do with new items once ``max_pending`` is reached.
+    retries: int
+        How many times to retry a flush that failed due to a connection error.
+    name: Optional[str]
+        The name used for logging.
+    """
+
+    RETRY_EXCEPTIONS = (asyncpg.PostgresConnectionError, OSError)
+
+    def __init__(self, flush, *, factory=list, add=None, interval=10.0, max_batch=1000,
+                 max_pending=100000, overflow=Overflow.block, retries=3, name=None, loop=None):
+        self._flush = flush
+        self._factory = factory
+        self._add = add or (lambda buffer, item: buffer.append(item))
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.retries = retries
+        self.name = name or getattr(flush, '__qualname__', repr(flush))
+        self.loop = loop or asyncio.get_event_loop()
+
+        self._buffer = factory()
+        self._count = 0
+        self._in_flight = None
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flush_lock = asyncio.Lock()
+        self._closed = False
+        self._task = None
+
+        # metrics
+        self.added = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failures = 0
+        # batches and items dropped due to an error that isn't retried
+        self.errors = 0
+        self.error_dropped = 0
+        self.retried = 0
+        self.largest_batch = 0
+        self.last_flush_time = 0.0
+        self.total_flush_time = 0.0
+
+    def __repr__(self):
+        return f'<BatchWriter name={self.name!r} pending={self._count} flushes={self.flushes}>'
+
+    @property
+    def pending(self):
+        """The number of items waiting for the next flush."""
+        return self._count
+
+    @property
+    def is_flushing(self):
+        return self._flush_lock.locked()
+
+    def buffers(self):
+        """Returns the buffers that have yet to be written.
+
+        This includes the one being flushed, if any, so that readers can
+        account for writes that haven't landed yet.
+        """
+        if self._in_flight is None:
+            return [self._buffer]
+        return [self._in_flight, self._buffer]
+
+    def is_full(self):
+        return self.max_pending is not None and self._count >= self.max_pending
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closed = False
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        """Stops the writer after flushing anything that is left."""
+        self._closed = True
+        self._wakeup.set()
+
+    def add(self, item):
+        """Adds an item without waiting.
+
+        Returns ``False`` if the item was dropped because the writer is full.
+        """
+        if self.is_full():
+            self.dropped += 1
+            return False
+
+        self._add(self._buffer, item)
+        self._count += 1
+        self.added += 1
+        if self._count >= self.max_batch:
+            self._wakeup.set()
+        return True
+
+    async def put(self, item):
+        """Adds an item, waiting for room if the writer is full and the
+        overflow policy is :attr:`Overflow.block`.
+        """
+        while self.overflow is Overflow.block and self.is_full():
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+        return self.add(item)
+
+    async def _run(self):
+        querystats.origin.set(f'BatchWriter:{self.name}')
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+        await self.flush()
+
+    async def flush(self):
+        """Writes out everything that is currently buffered."""
+        async with self._flush_lock:
+            if self._count == 0:
+                return
+
+            batch, count = self._buffer, self._count
+            self._buffer, self._count = self._factory(), 0
+            self._in_flight = batch
+            self._space.set()
+            self.largest_batch = max(self.largest_batch, count)
+
+            start = time.perf_counter()
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        await self._flush(batch)
+                    except self.RETRY_EXCEPTIONS:
+                        if attempt == self.retries:
+                            self.failures += 1
+                            self.dropped += count
+                            log.exception('[%s] Dropping %s items after %s failed attempts.', self.name, count, attempt + 1)
+                            break
+
+                        self.retried += 1
+                        await asyncio.sleep(2 ** attempt)
+                    except Exception:
+                        self.failures += 1
+                        self.dropped += count
+                        self.errors += 1
+                        self.error_dropped += count
+                        log.exception('[%s] Dropping %s items after an unexpected error.', self.name, count)
+                        break
+                    else:
+                        self.flushes += 1
+                        break
+            finally:
+                self._in_flight = None
+
+            self.last_flush_time = time.perf_counter() - start
+            self.total_flush_time += self.last_flush_time
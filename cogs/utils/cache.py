@@ -2,17 +2,135 @@ import inspect
 import asyncio
 import enum
 import time
+import heapq
+import logging
+import sys
 
 from functools import wraps
 
 from lru import LRU
 
-def _wrap_and_store_coroutine(cache, key, coro):
-    async def func():
-        value = await coro
-        cache[key] = value
-        return value
-    return func()
+log = logging.getLogger(__name__)
+
+class CacheStats:
+    __slots__ = ('hits', 'misses', 'coalesced', 'bypassed', 'refreshes', 'evictions', 'loads', 'load_time', 'max_load_time')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # calls made inside a transaction, which skip the cache
+        self.bypassed = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.loads = 0
+        # in seconds
+        self.load_time = 0.0
+        self.max_load_time = 0.0
+
+    def __repr__(self):
+        attrs = ' '.join(f'{attr}={getattr(self, attr)}' for attr in self.__slots__)
+        return f'<CacheStats {attrs}>'
+
+    def record_load(self, elapsed):
+        self.loads += 1
+        self.load_time += elapsed
+        if elapsed > self.max_load_time:
+            self.max_load_time = elapsed
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    @property
+    def average_load_time(self):
+        return self.load_time / self.loads if self.loads else 0.0
+
+class _LoadTracker:
+    """Keeps an invalidation generation for every key that is being loaded.
+
+    A load takes the generation of its key before it starts and only
+    stores its result if the generation is unchanged once it finishes,
+    since otherwise the key was invalidated while the query was running.
+    """
+
+    __slots__ = ('_loads',)
+
+    def __init__(self):
+        # key: [generation, loads in-flight]
+        self._loads = {}
+
+    def begin(self, key):
+        try:
+            entry = self._loads[key]
+        except KeyError:
+            entry = self._loads[key] = [0, 0]
+        entry[1] += 1
+        return entry[0]
+
+    def end(self, key, generation):
+        """Returns ``True`` if the key wasn't invalidated since :meth:`begin`."""
+        entry = self._loads[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._loads[key]
+        return entry[0] == generation
+
+    def invalidate(self, key):
+        entry = self._loads.get(key)
+        if entry is not None:
+            entry[0] += 1
+
+    def invalidate_containing(self, arg):
+        for key, entry in self._loads.items():
+            if arg in key:
+                entry[0] += 1
+
+    def invalidate_all(self):
+        for entry in self._loads.values():
+            entry[0] += 1
+
+def _schedule_and_store(store, pending, key, coro, stats, loads):
+    # Run the coroutine as a task so every concurrent miss for this key
+    # can wait on the same result instead of firing their own query.
+    task = asyncio.ensure_future(coro)
+    start = time.perf_counter()
+    generation = loads.begin(key)
+
+    def done(fut):
+        stats.record_load(time.perf_counter() - start)
+
+        # if we were invalidated while in-flight then the result is already stale
+        fresh = loads.end(key, generation)
+        if pending.get(key) is not fut:
+            return
+
+        del pending[key]
+        if fresh and not fut.cancelled() and fut.exception() is None:
+            store(key, fut.result())
+
+    task.add_done_callback(done)
+    pending[key] = task
+    return task
+
+def _wrap_and_store_coroutine(store, pending, key, coro, stats, loads):
+    return _wait_for_pending(_schedule_and_store(store, pending, key, coro, stats, loads))
+
+def _in_transaction(connection):
+    # pools and connections outside of a transaction only see committed rows
+    try:
+        return connection.is_in_transaction()
+    except AttributeError:
+        return False
+
+def _log_refresh_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.warning('Background cache refresh failed', exc_info=task.exception())
+
+async def _wait_for_pending(task):
+    # shield so that a single cancelled waiter doesn't cancel it for everyone else
+    return await asyncio.shield(task)
 
 def _wrap_new_coroutine(value):
     async def new_coroutine():
@@ -20,56 +138,257 @@ def _wrap_new_coroutine(value):
     return new_coroutine()
 
 class ExpiringCache(dict):
-    def __init__(self, seconds):
+    """A dict whose entries expire after ``seconds``.
+
+    ``callback`` is called with ``(key, value)`` whenever an entry
+    is evicted, similar to the one in ``lru.LRU``.
+
+    Expiry is tracked in a heap ordered by expiration time so that
+    evicting stale entries doesn't need to look at every key. Entries
+    are evicted lazily, a few at a time on access, and a key that has
+    expired is never returned even if it hasn't been evicted yet.
+    """
+
+    # the maximum number of expired entries to evict per access
+    EVICTION_BUDGET = 32
+
+    def __init__(self, seconds, *, maxsize=None, callback=None):
         self.__ttl = seconds
+        self.__maxsize = maxsize
+        self.__callback = callback
+        # (expires, sequence, key)
+        self.__heap = []
+        self.__sequence = 0
         super().__init__()
 
-    def __verify_cache_integrity(self):
-        # Have to do this in two steps...
+    def __verify_cache_integrity(self, current_time, budget=None):
+        heap = self.__heap
+        if budget is None:
+            budget = self.EVICTION_BUDGET
+        while heap and budget and heap[0][0] <= current_time:
+            expires, sequence, key = heapq.heappop(heap)
+            budget -= 1
+            entry = super().get(key)
+            # the key could have been overwritten or removed since
+            if entry is not None and entry[2] == sequence:
+                self.__expire(key, entry[0])
+
+        # overwrites leave dead entries in the heap, rebuild if it gets too bloated
+        if len(heap) > 2 * super().__len__() + 64:
+            self.__rebuild()
+
+    def __expire(self, key, value):
+        super().__delitem__(key)
+        if self.__callback is not None:
+            self.__callback(key, value)
+
+    def __rebuild(self):
+        self.__heap = [(expires, sequence, key) for key, (_, expires, sequence) in super().items()]
+        heapq.heapify(self.__heap)
+
+    def __evict_one(self):
+        heap = self.__heap
+        while heap:
+            expires, sequence, key = heapq.heappop(heap)
+            entry = super().get(key)
+            if entry is not None and entry[2] == sequence:
+                self.__expire(key, entry[0])
+                return
+
+    def __lookup(self, key):
         current_time = time.monotonic()
-        to_remove = [k for (k, (v, t)) in self.items() if current_time > (t + self.__ttl)]
-        for k in to_remove:
-            del self[k]
+        self.__verify_cache_integrity(current_time)
+        value, expires, _ = super().__getitem__(key)
+        if current_time >= expires:
+            self.__expire(key, value)
+            raise KeyError(key)
+        return value
 
     def __contains__(self, key):
-        self.__verify_cache_integrity()
-        return super().__contains__(key)
+        try:
+            self.__lookup(key)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        # evict everything that expired so only live entries are counted
+        self.__verify_cache_integrity(time.monotonic(), budget=len(self.__heap))
+        return super().__len__()
+
+    def __getitem__(self, key):
+        return self.__lookup(key)
+
+    def get(self, key, default=None):
+        try:
+            return self.__lookup(key)
+        except KeyError:
+            return default
+
+    def set(self, key, value, *, ttl=None):
+        """Sets a key with an optional TTL that overrides the default one."""
+        current_time = time.monotonic()
+        self.__verify_cache_integrity(current_time)
+
+        if self.__maxsize is not None and not super().__contains__(key):
+            while self.__heap and super().__len__() >= self.__maxsize:
+                self.__evict_one()
+
+        expires = current_time + (self.__ttl if ttl is None else ttl)
+        self.__sequence += 1
+        super().__setitem__(key, (value, expires, self.__sequence))
+        heapq.heappush(self.__heap, (expires, self.__sequence, key))
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def clear(self):
+        self.__heap.clear()
+        super().clear()
+
+class StaleCache:
+    """An LRU cache whose entries go stale after ``soft_ttl`` seconds
+    and expire completely after ``hard_ttl`` seconds.
+
+    Stale entries are still returned, it's up to the caller to check
+    :meth:`is_stale` and refresh them.
+    """
+
+    def __init__(self, maxsize, *, soft_ttl, hard_ttl, callback=None):
+        if soft_ttl > hard_ttl:
+            raise ValueError('soft_ttl cannot be greater than hard_ttl')
+
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.__callback = callback
+        # key: (value, stored_at)
+        self.__lru = LRU(maxsize, callback=self.__evicted)
+
+    def __evicted(self, key, entry):
+        if self.__callback is not None:
+            self.__callback(key, entry[0])
 
     def __getitem__(self, key):
-        self.__verify_cache_integrity()
-        return super().__getitem__(key)
+        value, stored_at = self.__lru[key]
+        if time.monotonic() - stored_at >= self.hard_ttl:
+            del self.__lru[key]
+            self.__evicted(key, (value, stored_at))
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, (value, time.monotonic()))
+        self.__lru[key] = (value, time.monotonic())
+
+    def __delitem__(self, key):
+        del self.__lru[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.__lru)
+
+    def is_stale(self, key):
+        entry = self.__lru.get(key)
+        return entry is not None and time.monotonic() - entry[1] >= self.soft_ttl
+
+    def keys(self):
+        return self.__lru.keys()
+
+    def clear(self):
+        self.__lru.clear()
+
+    def items(self):
+        return [(k, v) for k, (v, _) in self.__lru.items()]
+
+    def get_size(self):
+        return self.__lru.get_size()
+
+    def get_stats(self):
+        return self.__lru.get_stats()
 
 class Strategy(enum.Enum):
     lru = 1
     raw = 2
     timed = 3
+    stale = 4
+
+# arguments of these types are used as-is in cache keys, everything else is repr'd
+_KEY_PRIMITIVES = frozenset((int, str, type(None)))
+
+# qualified name: wrapper, for every function decorated with cache()
+all_caches = {}
 
-def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
+# name: wrapper, for caches that have been given a name
+# these are the caches that take part in cross-process invalidation
+named_caches = {}
+
+# called as publisher(name, method, key) whenever a named cache is invalidated locally
+# this is set by cogs.utils.invalidation.InvalidationBus
+_invalidation_publisher = None
+
+def set_invalidation_publisher(publisher):
+    global _invalidation_publisher
+    _invalidation_publisher = publisher
+
+def _true_repr(o):
+    # we do care what 'self' parameter is when we __repr__ it
+    if o.__class__.__repr__ is object.__repr__:
+        return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
+    return repr(o)
+
+def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False, *, soft_ttl=60.0, hard_ttl=3600.0, name=None):
+    """Caches the result of a function or coroutine.
+
+    If a ``name`` is given then invalidations of this cache are broadcast
+    to other processes through the invalidation bus and invalidations
+    from other processes are applied to it.
+
+    With :attr:`Strategy.stale` an entry older than ``soft_ttl`` seconds
+    is returned immediately while a fresh value is loaded in the background,
+    and an entry older than ``hard_ttl`` seconds is treated as a miss.
+    ``maxsize`` is the capacity of the cache.
+    """
     def decorator(func):
+        # positional argument: set of keys that contain it
+        # this allows invalidate_containing to not scan the entire cache
+        _index = {}
+
+        def _forget(key, value=None):
+            for arg in key:
+                keys = _index.get(arg)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del _index[arg]
+
+        _counters = CacheStats()
+
+        def _evicted(key, value):
+            _counters.evictions += 1
+            _forget(key)
+
         if strategy is Strategy.lru:
-            _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
+            _internal_cache = LRU(maxsize, callback=_evicted)
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            _stats = lambda: (0, 0)
         elif strategy is Strategy.timed:
-            _internal_cache = ExpiringCache(maxsize)
-            _stats = lambda: (0, 0)
+            _internal_cache = ExpiringCache(maxsize, callback=_evicted)
+        elif strategy is Strategy.stale:
+            _internal_cache = StaleCache(maxsize, soft_ttl=soft_ttl, hard_ttl=hard_ttl, callback=_evicted)
+
+        # key: asyncio.Task for lookups that are currently in-flight
+        _pending = {}
+        _loads = _LoadTracker()
+        _is_coroutine = asyncio.iscoroutinefunction(func)
 
         def _make_key(args, kwargs):
-            # this is a bit of a cluster fuck
-            # we do care what 'self' parameter is when we __repr__ it
-            def _true_repr(o):
-                if o.__class__.__repr__ is object.__repr__:
-                    return f'<{o.__class__.__module__}.{o.__class__.__name__}>'
-                return repr(o)
-
-            key = [ f'{func.__module__}.{func.__name__}' ]
-            key.extend(_true_repr(o) for o in args)
-            if not ignore_kwargs:
+            key = [o if o.__class__ in _KEY_PRIMITIVES else _true_repr(o) for o in args]
+            if kwargs and not ignore_kwargs:
                 for k, v in kwargs.items():
                     # note: this only really works for this use case in particular
                     # I want to pass asyncpg.Connection objects to the parameters
@@ -78,52 +397,273 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
                     if k == 'connection':
                         continue
 
-                    key.append(_true_repr(k))
-                    key.append(_true_repr(v))
+                    key.append(k)
+                    key.append(v if v.__class__ in _KEY_PRIMITIVES else _true_repr(v))
+
+            return tuple(key)
+
+        def _store(key, value):
+            _internal_cache[key] = value
+            for arg in key:
+                try:
+                    _index[arg].add(key)
+                except KeyError:
+                    _index[arg] = {key}
+
+        _can_refresh = strategy is Strategy.stale and _is_coroutine
 
-            return ':'.join(key)
+        def _refresh(key, args, kwargs):
+            # the caller's connection could be released before we're done, so don't use it
+            # this is fine since it isn't in a transaction, see wrapper
+            kwargs.pop('connection', None)
+            _counters.refreshes += 1
+            task = _schedule_and_store(_store, _pending, key, func(*args, **kwargs), _counters, _loads)
+            task.add_done_callback(_log_refresh_failure)
 
         @wraps(func)
         def wrapper(*args, **kwargs):
+            if _is_coroutine and _in_transaction(kwargs.get('connection')):
+                # it could see its own uncommitted writes or read rows it's about to
+                # change, so it neither uses the cached value nor shares its own
+                _counters.bypassed += 1
+                return func(*args, **kwargs)
+
             key = _make_key(args, kwargs)
             try:
                 value = _internal_cache[key]
             except KeyError:
+                try:
+                    task = _pending[key]
+                except KeyError:
+                    pass
+                else:
+                    _counters.coalesced += 1
+                    return _wait_for_pending(task)
+
+                _counters.misses += 1
+                if _is_coroutine:
+                    # other misses for this key wait on the same load and the caller's
+                    # connection could be released before they're done, so don't use it
+                    # the pool sees the same rows since it isn't in a transaction
+                    kwargs.pop('connection', None)
+
+                start = time.perf_counter()
                 value = func(*args, **kwargs)
 
                 if inspect.isawaitable(value):
-                    return _wrap_and_store_coroutine(_internal_cache, key, value)
+                    return _wrap_and_store_coroutine(_store, _pending, key, value, _counters, _loads)
 
-                _internal_cache[key] = value
+                _counters.record_load(time.perf_counter() - start)
+                _store(key, value)
                 return value
             else:
-                if asyncio.iscoroutinefunction(func):
+                _counters.hits += 1
+                if _can_refresh and key not in _pending and _internal_cache.is_stale(key):
+                    _refresh(key, args, kwargs)
+                if _is_coroutine:
                     return _wrap_new_coroutine(value)
                 return value
 
+        def _publish(method, key):
+            if name is not None and _invalidation_publisher is not None:
+                _invalidation_publisher(name, method, key)
+
+        def _invalidate_key(key, *, publish=True):
+            if publish:
+                _publish('key', key)
+
+            _pending.pop(key, None)
+            _loads.invalidate(key)
+            try:
+                del _internal_cache[key]
+            except KeyError:
+                return False
+            else:
+                _forget(key)
+                return True
+
         def _invalidate(*args, **kwargs):
+            return _invalidate_key(_make_key(args, kwargs))
+
+        def _update_key(key, update):
+            """Calls ``update`` with the cached value of ``key`` to change it in place.
+
+            Other processes can't apply the same change so their copy is
+            invalidated instead. Returns ``False`` if the key wasn't cached.
+            """
+            _publish('key', key)
+
+            # a load that started before the change could store the old value
+            _pending.pop(key, None)
+            _loads.invalidate(key)
             try:
-                del _internal_cache[_make_key(args, kwargs)]
+                value = _internal_cache[key]
             except KeyError:
                 return False
             else:
+                update(value)
                 return True
 
-        def _invalidate_containing(key):
-            to_remove = []
-            for k in _internal_cache.keys():
-                if key in k:
-                    to_remove.append(k)
-            for k in to_remove:
+        def _invalidate_containing(arg, *, publish=True):
+            """Invalidates every key that was called with ``arg`` as an argument."""
+            if publish:
+                _publish('containing', arg)
+
+            for k in [k for k in _pending if arg in k]:
+                del _pending[k]
+            _loads.invalidate_containing(arg)
+
+            for k in _index.pop(arg, ()):
                 try:
                     del _internal_cache[k]
+                except KeyError:
+                    pass
+                _forget(k)
+
+        def _clear():
+            _pending.clear()
+            _loads.invalidate_all()
+            _index.clear()
+            _internal_cache.clear()
+
+        _bulk_loader_func = None
+
+        def _bulk_loader(loader):
+            """Registers a coroutine that loads many keys at once.
+
+            The coroutine is called as ``loader(self, keys)`` and must
+            return a mapping of key to value for every key given.
+            """
+            nonlocal _bulk_loader_func
+            _bulk_loader_func = loader
+            return loader
+
+        async def _prime(instance, keys):
+            """Loads every uncached key in ``keys`` with a single bulk load.
+
+            Returns the number of keys that were stored.
+            """
+            if _bulk_loader_func is None:
+                raise RuntimeError(f'{func.__qualname__} has no bulk loader.')
+
+            to_load = {}
+            for arg in keys:
+                key = _make_key((instance, arg), {})
+                if key not in _pending and key not in _internal_cache:
+                    to_load[arg] = key
+
+            if not to_load:
+                return 0
+
+            generations = {key: _loads.begin(key) for key in to_load.values()}
+            try:
+                values = await _bulk_loader_func(instance, list(to_load))
+            finally:
+                for key, generation in generations.items():
+                    generations[key] = _loads.end(key, generation)
+
+            stored = 0
+            for arg, key in to_load.items():
+                # someone could have loaded or invalidated it in the meantime
+                if not generations[key] or key in _pending or key in _internal_cache:
+                    continue
+                try:
+                    value = values[arg]
                 except KeyError:
                     continue
+                _store(key, value)
+                stored += 1
+            return stored
 
         wrapper.cache = _internal_cache
+        wrapper.clear = _clear
+        wrapper.bulk_loader = _bulk_loader
+        wrapper.prime = _prime
+        wrapper.has_bulk_loader = lambda: _bulk_loader_func is not None
         wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)
         wrapper.invalidate = _invalidate
-        wrapper.get_stats = _stats
+        wrapper.get_stats = lambda: (_counters.hits, _counters.misses)
+        wrapper.maxsize = maxsize if strategy in (Strategy.lru, Strategy.stale) else None
+        wrapper.strategy = strategy
+        wrapper.stats = _counters
         wrapper.invalidate_containing = _invalidate_containing
+        wrapper.invalidate_key = _invalidate_key
+        wrapper.update_key = _update_key
+        all_caches[f'{func.__module__}.{func.__qualname__}'] = wrapper
+        if name is not None:
+            named_caches[name] = wrapper
         return wrapper
     return decorator
+
+def approximate_size(obj):
+    """Approximates the memory used by a container in bytes.
+
+    This only goes one level deep, so the contents of nested
+    objects aren't taken into account.
+    """
+    size = sys.getsizeof(obj)
+    try:
+        items = obj.items()
+    except AttributeError:
+        try:
+            return size + sum(sys.getsizeof(o) for o in obj)
+        except TypeError:
+            return size
+    else:
+        return size + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in items)
+
+class GuildStateRegistry:
+    """Keeps track of every store that holds per-guild or per-channel state.
+
+    This allows evicting everything related to a guild or channel in one
+    call when the bot leaves a guild or a channel gets deleted.
+
+    Every function decorated with :func:`cache` is included automatically.
+    """
+
+    def __init__(self):
+        # name: (store, purge_guild, purge_channel)
+        self._stores = {}
+
+    def register(self, name, store, *, purge_guild=None, purge_channel=None):
+        """Registers a store.
+
+        By default ``store`` is assumed to be a mapping keyed by guild ID.
+        ``purge_guild`` and ``purge_channel`` are called with the relevant
+        ID and override the default eviction.
+        """
+        if purge_guild is None:
+            purge_guild = lambda guild_id: store.pop(guild_id, None)
+        self._stores[name] = (store, purge_guild, purge_channel)
+
+    def unregister(self, name):
+        self._stores.pop(name, None)
+
+    def purge_guild(self, guild_id):
+        for store, purge, _ in self._stores.values():
+            purge(guild_id)
+
+        for wrapper in all_caches.values():
+            wrapper.invalidate_containing(guild_id, publish=False)
+
+    def purge_channel(self, channel_id):
+        for store, _, purge in self._stores.values():
+            if purge is not None:
+                purge(channel_id)
+
+        for wrapper in all_caches.values():
+            wrapper.invalidate_containing(channel_id, publish=False)
+
+    def get_sizes(self):
+        """Returns a list of (name, entries, approximate bytes) for every store."""
+        result = [
+            (name, len(store), approximate_size(store))
+            for name, (store, _, _) in self._stores.items()
+        ]
+        result.extend(
+            (name, len(wrapper.cache), approximate_size(wrapper.cache))
+            for name, wrapper in all_caches.items()
+        )
+        return result
+
+guild_state = GuildStateRegistry()
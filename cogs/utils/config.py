@@ -12,7 +12,13 @@ def _create_encoder(cls):
     return type('_Encoder', (json.JSONEncoder,), { 'default': _default })
 
 class Config:
-    """The "database" object. Internally based on ``json``."""
+    """The "database" object. Internally based on ``json``.
+
+    If ``journal`` is passed then mutations are appended to a
+    ``<name>.journal`` file instead of rewriting the entire file.
+    Once the journal grows past ``journal_threshold`` bytes it gets
+    folded back into the main file in the background.
+    """
 
     def __init__(self, name, **options):
         self.name = name
@@ -27,6 +33,12 @@ class Config:
             self.object_hook = hook.from_json
             self.encoder = _create_encoder(hook)
 
+        self.journal = options.pop('journal', False)
+        self.journal_name = f'{name}.journal'
+        self.journal_threshold = options.pop('journal_threshold', 1024 * 1024) # 1 MiB
+        self._journal_size = 0
+        self._compacting = None
+
         self.loop = options.pop('loop', asyncio.get_event_loop())
         self.lock = asyncio.Lock()
         if options.pop('load_later', False):
@@ -41,6 +53,41 @@ class Config:
         except FileNotFoundError:
             self._db = {}
 
+        if self.journal:
+            self._replay_journal()
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_name, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            self._journal_size = 0
+            return
+
+        torn = False
+        for line in lines:
+            # a torn write from a crash, everything after it is garbage
+            if not line.endswith('\n'):
+                torn = True
+                break
+
+            try:
+                record = json.loads(line, object_hook=self.object_hook)
+            except ValueError:
+                torn = True
+                break
+
+            if record[0] == 'p':
+                self._db[record[1]] = record[2]
+            else:
+                self._db.pop(record[1], None)
+
+        if torn:
+            # new records would be appended after the garbage and lost on the next replay
+            self._compact()
+        else:
+            self._journal_size = os.path.getsize(self.journal_name)
+
     async def load(self):
         async with self.lock:
             await self.loop.run_in_executor(None, self.load_from_file)
@@ -53,9 +100,43 @@ class Config:
         # atomically move the file
         os.replace(temp, self.name)
 
+    def _compact(self):
+        # the snapshot now has everything in the journal so it's safe to truncate
+        self._dump()
+        with open(self.journal_name, 'w', encoding='utf-8'):
+            pass
+        self._journal_size = 0
+
+    def _append(self, record):
+        data = json.dumps(record, ensure_ascii=True, cls=self.encoder, separators=(',', ':')) + '\n'
+        with open(self.journal_name, 'a', encoding='utf-8') as fp:
+            fp.write(data)
+        self._journal_size += len(data)
+
+    async def _run_compaction(self):
+        try:
+            async with self.lock:
+                if self._journal_size >= self.journal_threshold:
+                    await self.loop.run_in_executor(None, self._compact)
+        finally:
+            self._compacting = None
+
     async def save(self):
         async with self.lock:
-            await self.loop.run_in_executor(None, self._dump)
+            if self.journal:
+                await self.loop.run_in_executor(None, self._compact)
+            else:
+                await self.loop.run_in_executor(None, self._dump)
+
+    async def _write(self, record):
+        if not self.journal:
+            return await self.save()
+
+        async with self.lock:
+            await self.loop.run_in_executor(None, self._append, record)
+
+        if self._journal_size >= self.journal_threshold and self._compacting is None:
+            self._compacting = self.loop.create_task(self._run_compaction())
 
     def get(self, key, *args):
         """Retrieves a config entry."""
@@ -63,13 +144,15 @@ class Config:
 
     async def put(self, key, value, *args):
         """Edits a config entry."""
-        self._db[str(key)] = value
-        await self.save()
+        key = str(key)
+        self._db[key] = value
+        await self._write(('p', key, value))
 
     async def remove(self, key):
         """Removes a config entry."""
-        del self._db[str(key)]
-        await self.save()
+        key = str(key)
+        del self._db[key]
+        await self._write(('d', key))
 
     def __contains__(self, item):
         return str(item) in self._db
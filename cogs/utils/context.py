@@ -1,4 +1,5 @@
 from discord.ext import commands
+from .querystats import timed_acquire
 import asyncio
 import discord
 import io
@@ -20,6 +21,19 @@ class _ContextDBAcquire:
     async def __aexit__(self, *args):
         await self.ctx.release()
 
+def replica_safe():
+    """Marks a command whose reads can go to the read replica through
+    :attr:`Context.read_db`.
+
+    This should only be used for commands that can tolerate a few
+    seconds of replication lag, e.g. statistics.
+    """
+    def decorator(func):
+        callback = func.callback if isinstance(func, commands.Command) else func
+        callback.__replica_safe__ = True
+        return func
+    return decorator
+
 class Context(commands.Context):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -178,9 +192,22 @@ class Context(commands.Context):
     def db(self):
         return self._db if self._db else self.pool
 
+    @property
+    def read_db(self):
+        """The read replica pool if the command is marked :func:`replica_safe`,
+        otherwise the same as :attr:`db`.
+        """
+        read_pool = getattr(self.bot, 'read_pool', None)
+        if read_pool is None or self.command is None:
+            return self.db
+
+        if getattr(self.command.callback, '__replica_safe__', False):
+            return read_pool
+        return self.db
+
     async def _acquire(self, timeout):
         if self._db is None:
-            self._db = await self.pool.acquire(timeout=timeout)
+            self._db = await timed_acquire(self.pool, timeout=timeout)
         return self._db
 
     def acquire(self, *, timeout=300.0):
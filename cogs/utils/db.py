@@ -10,24 +10,69 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 # This isn't exactly good. It's just good enough for my uses.
 # Also shoddy migration support.
 
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from pathlib import Path
 import json
 import os
 import pydoc
 import uuid
 import datetime
+import dataclasses
+import enum
 import inspect
 import decimal
 import asyncpg
 import logging
 import asyncio
+import weakref
+import time
+import re
+
+from .querystats import InstrumentedConnection, recorder, timed_acquire
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 log = logging.getLogger(__name__)
 
 class SchemaError(Exception):
     pass
 
+# (path, loader): (mtime_ns, size, result)
+_json_file_cache = {}
+
+def _load_json_file(path, loader=None):
+    """Loads a migration data file, reusing the result if the file hasn't changed.
+
+    The result is shared so it must not be mutated, see :func:`_load_json_file_mut`.
+    """
+    stat = path.stat()
+    key = (str(path), loader)
+    try:
+        mtime, size, result = _json_file_cache[key]
+    except KeyError:
+        pass
+    else:
+        if mtime == stat.st_mtime_ns and size == stat.st_size:
+            return result
+
+    with path.open('r', encoding='utf-8') as fp:
+        result = json.load(fp)
+
+    if loader is not None:
+        result = loader(result)
+
+    _json_file_cache[key] = (stat.st_mtime_ns, stat.st_size, result)
+    return result
+
+def _load_json_file_mut(path):
+    # the caller is going to modify and rewrite it
+    data = _load_json_file(path)
+    _json_file_cache.pop((str(path), None), None)
+    return data
+
 class SQLType:
     python = None
 
@@ -356,6 +401,55 @@ class PrimaryKeyColumn(Column):
     def __init__(self):
         super().__init__(Integer(auto_increment=True), primary_key=True)
 
+class RangePartition:
+    """Declares a table as range partitioned by month on a timestamp column. ::
+
+        class Events(db.Table, partition=db.RangePartition('created')):
+            ...
+
+    The partition column becomes part of the primary key since PostgreSQL
+    requires it. Partitions are named ``<table>_pYYYYMM`` and are created
+    ahead of time by :meth:`Table.create_partitions`.
+
+    Parameters
+    -----------
+    column: str
+        The timestamp column to partition by.
+    premake: int
+        How many months ahead of the current one to create partitions for.
+    retention: Optional[int]
+        How many months of partitions to keep. Older ones are removed by
+        :meth:`Table.apply_retention`. ``None`` keeps everything.
+    archive: Optional[str]
+        The SQL to run on a partition before it is dropped, e.g. to summarise
+        it into another table. ``{partition}`` is replaced with its name.
+    """
+
+    def __init__(self, column, *, premake=2, retention=None, archive=None):
+        self.column = column
+        self.premake = premake
+        self.retention = retention
+        self.archive = archive
+
+    @staticmethod
+    def month_start(dt, offset=0):
+        month = dt.year * 12 + dt.month - 1 + offset
+        return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+    def partition_name(self, table_name, start):
+        return f'{table_name}_p{start:%Y%m}'
+
+    def create_statements(self, table_name, *, now=None):
+        now = now or datetime.datetime.utcnow()
+        statements = []
+        for offset in range(0, self.premake + 1):
+            start = self.month_start(now, offset)
+            end = self.month_start(now, offset + 1)
+            name = self.partition_name(table_name, start)
+            statements.append(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} "
+                              f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}');")
+        return statements
+
 class SchemaDiff:
     __slots__ = ('table', 'upgrade', 'downgrade')
 
@@ -438,7 +532,7 @@ class MaybeAcquire:
     async def __aenter__(self):
         if self.connection is None:
             self._cleanup = True
-            self._connection = c = await self.pool.acquire()
+            self._connection = c = await timed_acquire(self.pool)
             return c
         return self.connection
 
@@ -446,6 +540,321 @@ class MaybeAcquire:
         if self._cleanup:
             await self.pool.release(self._connection)
 
+def _json_default(obj):
+    # both serializers go through this for anything that isn't plain JSON
+    # so that a value is stored the same way whichever one is installed
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
+
+class JSONCodec:
+    """Encodes and decodes ``jsonb`` values using the binary wire format.
+
+    The binary format of ``jsonb`` is a version byte followed by the JSON
+    text, which saves the server from having to convert it for us.
+
+    Both built-in codecs serialize datetimes, UUIDs, enums and dataclasses
+    the same way and raise :exc:`TypeError` for any other non-JSON type.
+
+    Parameters
+    -----------
+    dumps
+        Serializes a value to a UTF-8 encoded :class:`bytes` of JSON.
+    loads
+        Deserializes :class:`bytes` of JSON.
+    name: str
+        The name of the serializer, for display.
+    """
+
+    VERSION = b'\x01'
+
+    def __init__(self, dumps, loads, *, name):
+        self.dumps = dumps
+        self.loads = loads
+        self.name = name
+
+    def __repr__(self):
+        return f'<JSONCodec name={self.name!r}>'
+
+    def encode(self, value):
+        return self.VERSION + self.dumps(value)
+
+    def decode(self, data):
+        if data[:1] != self.VERSION:
+            raise ValueError(f'unsupported jsonb version {data[:1]!r}')
+        return self.loads(data[1:])
+
+    @classmethod
+    def stdlib(cls):
+        def dumps(value):
+            return json.dumps(value, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+        return cls(dumps, json.loads, name='json')
+
+    @classmethod
+    def orjson(cls):
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+
+        # Timer kwargs and other payloads use integer keys
+        # datetimes and dataclasses are passed through to match the stdlib codec
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+        def dumps(value):
+            return orjson.dumps(value, default=_json_default, option=options)
+
+        return cls(dumps, orjson.loads, name='orjson')
+
+    @classmethod
+    def default(cls):
+        """Returns the fastest codec that is installed."""
+        if orjson is not None:
+            return cls.orjson()
+        return cls.stdlib()
+
+class KeysetPaginator:
+    """An async iterator over the rows of a query that fetches them a page
+    at a time using keyset pagination. ::
+
+        query = "SELECT name, id FROM tag_lookup WHERE location_id=$1"
+        async for row in db.KeysetPaginator(pool, query, guild_id, key=('name', 'id')):
+            ...
+
+    Unlike a server-side cursor no connection or transaction is held between
+    pages, which matters when pages are requested by someone clicking through
+    a menu. Each page is a separate ``WHERE (key) > (last key)`` query so it
+    is cheap as long as the key columns are indexed.
+
+    Parameters
+    -----------
+    pool
+        The pool or connection to run the queries on.
+    query: str
+        The query to paginate. It must not have an ``ORDER BY`` or ``LIMIT``
+        and must select the ``key`` columns.
+    \*args
+        The arguments to the query.
+    key: Tuple[str, ...]
+        The columns that uniquely order the rows. They cannot be ``NULL``.
+    descending: bool
+        Whether to iterate in descending order of ``key``.
+    per_page: int
+        The number of rows fetched per query.
+    limit: Optional[int]
+        The maximum number of rows to return in total.
+    """
+
+    def __init__(self, pool, query, *args, key, descending=False, per_page=100, limit=None):
+        self.pool = pool
+        self.args = args
+        self.key = key
+        self.per_page = per_page
+        self.limit = limit
+
+        query = query.strip().rstrip(';')
+        direction = 'DESC' if descending else 'ASC'
+        order = ', '.join(f'q."{column}" {direction}' for column in key)
+        columns = ', '.join(f'q."{column}"' for column in key)
+        start = len(args) + 2
+        placeholders = ', '.join(f'${i}' for i in range(start, start + len(key)))
+        operator = '<' if descending else '>'
+
+        limit_arg = len(args) + 1
+        self._first = f'SELECT * FROM ({query}) AS q ORDER BY {order} LIMIT ${limit_arg};'
+        self._after = f'SELECT * FROM ({query}) AS q WHERE ({columns}) {operator} ({placeholders}) ' \
+                      f'ORDER BY {order} LIMIT ${limit_arg};'
+
+        self._buffer = []
+        self._last = None
+        self._returned = 0
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def fetch_page(self):
+        """Fetches and returns the next page of rows."""
+        if self._exhausted:
+            return []
+
+        count = self.per_page
+        if self.limit is not None:
+            count = min(count, self.limit - self._returned)
+            if count <= 0:
+                self._exhausted = True
+                return []
+
+        if self._last is None:
+            rows = await self.pool.fetch(self._first, *self.args, count)
+        else:
+            rows = await self.pool.fetch(self._after, *self.args, count, *self._last)
+
+        if len(rows) < count:
+            self._exhausted = True
+
+        if rows:
+            last = rows[-1]
+            self._last = tuple(last[column] for column in self.key)
+            self._returned += len(rows)
+        return rows
+
+    async def __anext__(self):
+        if not self._buffer:
+            self._buffer = list(reversed(await self.fetch_page()))
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.pop()
+
+class PreparedStatements:
+    """A registry of named queries that are prepared once per connection.
+
+    Queries are registered by name when a cog is loaded. Registering a
+    query prepares it in the background on every connection that is idle
+    in the pool at the time, and connections opened afterwards prepare it
+    when they're set up (see :meth:`Table.create_pool`). Any connection
+    that was busy during the registration prepares it on first use. ::
+
+        db.prepared.register('tags.get_tag', 'SELECT ... WHERE location_id=$1;')
+        row = await db.prepared.fetchrow(con, 'tags.get_tag', guild_id)
+    """
+
+    def __init__(self):
+        # name: query
+        self.queries = {}
+        # connection: { name: (query, PreparedStatement) }
+        self._statements = weakref.WeakKeyDictionary()
+        # name: count
+        self.hits = Counter()
+        self.prepares = Counter()
+        # names waiting to be prepared on the idle connections
+        self._to_prepare = set()
+        self._preparing = None
+
+    def register(self, name, query):
+        """Registers a query and prepares it on the idle pooled connections in the background."""
+        self.queries[name] = query
+        pool = getattr(Table, '_pool', None)
+        if pool is not None:
+            self._to_prepare.add(name)
+            if self._preparing is None:
+                self._preparing = asyncio.get_event_loop().create_task(self._prepare_idle(pool))
+
+    def unregister(self, name):
+        self.queries.pop(name, None)
+        self._to_prepare.discard(name)
+
+    async def _prepare_idle(self, pool):
+        try:
+            # every cog being loaded gets to register its queries first
+            await asyncio.sleep(0)
+            names, self._to_prepare = self._to_prepare, set()
+
+            # they're all held at once so that each acquire hands out a different one
+            connections = []
+            try:
+                for _ in range(pool.get_idle_size()):
+                    try:
+                        connections.append(await pool.acquire(timeout=1.0))
+                    except asyncio.TimeoutError:
+                        # someone else got to it, it'll be prepared on first use
+                        break
+
+                for connection in connections:
+                    for name in names:
+                        if name not in self.queries:
+                            continue
+                        try:
+                            await self._prepare(connection, name)
+                        except asyncpg.PostgresError:
+                            log.exception('Could not prepare statement %r', name)
+            finally:
+                for connection in connections:
+                    await pool.release(connection)
+        finally:
+            self._preparing = None
+            if self._to_prepare:
+                self._preparing = asyncio.get_event_loop().create_task(self._prepare_idle(pool))
+
+    async def prepare_all(self, connection):
+        for name in list(self.queries):
+            try:
+                await self._prepare(connection, name)
+            except asyncpg.PostgresError:
+                # don't take the connection down with it, it'll be retried on first use
+                log.exception('Could not prepare statement %r', name)
+
+    def _storage(self, connection):
+        # pooled connections are proxies to the actual connection
+        raw = getattr(connection, '_con', None) or connection
+        try:
+            return self._statements[raw]
+        except KeyError:
+            storage = self._statements[raw] = {}
+            return storage
+
+    async def _prepare(self, connection, name):
+        query = self.queries[name]
+        statement = await connection.prepare(query)
+        self._storage(connection)[name] = (query, statement)
+        self.prepares[name] += 1
+        return statement
+
+    async def get(self, connection, name):
+        """Returns the prepared statement for ``name`` on this connection."""
+        try:
+            query, statement = self._storage(connection)[name]
+        except KeyError:
+            return await self._prepare(connection, name)
+
+        # the query changed due to a reload
+        if query != self.queries[name]:
+            return await self._prepare(connection, name)
+
+        self.hits[name] += 1
+        return statement
+
+    async def _run(self, connection, name, method, args, timeout):
+        async with MaybeAcquire(connection, pool=Table._pool) as con:
+            if isinstance(con, asyncpg.pool.Pool):
+                async with con.acquire() as acquired:
+                    return await self._run(acquired, name, method, args, timeout)
+
+            statement = await self.get(con, name)
+            start = time.perf_counter()
+            try:
+                try:
+                    result = await getattr(statement, method)(*args, timeout=timeout)
+                except (asyncpg.InvalidCachedStatementError, asyncpg.FeatureNotSupportedError):
+                    # the schema changed from under us so the plan is no longer valid
+                    if con.is_in_transaction():
+                        raise
+                    statement = await self._prepare(con, name)
+                    result = await getattr(statement, method)(*args, timeout=timeout)
+            except Exception:
+                recorder.record(self.queries[name], time.perf_counter() - start, failed=True)
+                raise
+
+            rows = len(result) if method == 'fetch' else result is not None
+            recorder.record(self.queries[name], time.perf_counter() - start, rows)
+            return result
+
+    def fetch(self, connection, name, *args, timeout=None):
+        return self._run(connection, name, 'fetch', args, timeout)
+
+    def fetchrow(self, connection, name, *args, timeout=None):
+        return self._run(connection, name, 'fetchrow', args, timeout)
+
+    def fetchval(self, connection, name, *args, timeout=None):
+        return self._run(connection, name, 'fetchval', args, timeout)
+
+prepared = PreparedStatements()
+
 class TableMeta(type):
     @classmethod
     def __prepare__(cls, name, bases, **kwargs):
@@ -460,6 +869,7 @@ class TableMeta(type):
             table_name = name.lower()
 
         dct['__tablename__'] = table_name
+        dct['__partition__'] = kwargs.get('partition')
 
         for elem, value in dct.items():
             if isinstance(value, Column):
@@ -478,8 +888,10 @@ class TableMeta(type):
         super().__init__(name, parents, dct)
 
 class Table(metaclass=TableMeta):
+    _read_pool = None
+
     @classmethod
-    async def create_pool(cls, uri, **kwargs):
+    async def create_pool(cls, uri, *, replica=None, replica_options=None, json_codec=None, **kwargs):
         """Sets up and returns the PostgreSQL connection pool that is used.
 
         .. note::
@@ -491,26 +903,51 @@ class Table(metaclass=TableMeta):
         -----------
         uri: str
             The PostgreSQL URI to connect to.
+        replica: Optional[str]
+            The PostgreSQL URI of a read replica. If given, a second read-only
+            pool is created for it and is available through :meth:`read_pool`.
+            If the replica can't be reached then reads go to the primary.
+        replica_options: Optional[dict]
+            The arguments to forward to asyncpg.create_pool for the replica,
+            overriding the ones given in ``kwargs``.
+        json_codec: Optional[:class:`JSONCodec`]
+            The codec to use for ``jsonb`` columns. Defaults to :meth:`JSONCodec.default`.
         \*\*kwargs
             The arguments to forward to asyncpg.create_pool.
         """
 
-        def _encode_jsonb(value):
-            return json.dumps(value)
-
-        def _decode_jsonb(value):
-            return json.loads(value)
+        codec = json_codec or JSONCodec.default()
+        log.info('Using %s for jsonb.', codec.name)
 
         old_init = kwargs.pop('init', None)
+        kwargs.setdefault('connection_class', InstrumentedConnection)
 
         async def init(con):
-            await con.set_type_codec('jsonb', schema='pg_catalog', encoder=_encode_jsonb, decoder=_decode_jsonb, format='text')
+            await con.set_type_codec('jsonb', schema='pg_catalog', encoder=codec.encode, decoder=codec.decode, format='binary')
+            await prepared.prepare_all(con)
             if old_init is not None:
                 await old_init(con)
 
         cls._pool = pool = await asyncpg.create_pool(uri, init=init, **kwargs)
+
+        if replica is not None:
+            options = {**kwargs, **(replica_options or {})}
+            # guard against accidentally writing to the replica
+            settings = options.setdefault('server_settings', {})
+            settings.setdefault('default_transaction_read_only', 'on')
+            try:
+                cls._read_pool = await asyncpg.create_pool(replica, init=init, **options)
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError):
+                log.exception('Could not connect to the read replica, reads will use the primary.')
+                cls._read_pool = None
+
         return pool
 
+    @classmethod
+    def read_pool(cls):
+        """Returns the pool to use for reads that can tolerate replication lag."""
+        return cls._read_pool or cls._pool
+
     @classmethod
     def acquire_connection(cls, connection):
         return MaybeAcquire(connection, pool=cls._pool)
@@ -546,8 +983,7 @@ class Table(metaclass=TableMeta):
         if not current.exists():
             raise RuntimeError('Could not find current data file.')
 
-        with current.open() as fp:
-            current_table = cls.from_dict(json.load(fp))
+        current_table = _load_json_file(current, cls.from_dict)
 
         diff = cls().diff(current_table)
 
@@ -556,9 +992,8 @@ class Table(metaclass=TableMeta):
             return None
 
         # load the migration data
-        with p.open('r', encoding='utf-8') as fp:
-            data = json.load(fp)
-            migrations = data['migrations']
+        data = _load_json_file_mut(p)
+        migrations = data['migrations']
 
         # check if we should add it
         our_migrations = diff.to_dict()
@@ -597,9 +1032,7 @@ class Table(metaclass=TableMeta):
         if not p.exists():
             raise RuntimeError('Could not find migration file.')
 
-        with p.open('r', encoding='utf-8') as fp:
-            data = json.load(fp)
-            migrations = data['migrations']
+        migrations = _load_json_file(p)['migrations']
 
         try:
             migration = migrations[index]
@@ -660,6 +1093,8 @@ class Table(metaclass=TableMeta):
                 if verbose:
                     print(sql)
                 await con.execute(sql)
+                if cls.__partition__ is not None:
+                    await cls.create_partitions(connection=con, verbose=verbose)
 
             # since that step passed, let's go ahead and make the migration
             with p.open('w', encoding='utf-8') as fp:
@@ -674,8 +1109,7 @@ class Table(metaclass=TableMeta):
         if not run_migrations:
             return None
 
-        with current.open() as fp:
-            current_table = cls.from_dict(json.load(fp))
+        current_table = _load_json_file(current, cls.from_dict)
 
         diff = cls().diff(current_table)
 
@@ -691,9 +1125,8 @@ class Table(metaclass=TableMeta):
             await con.execute(sql)
 
         # load the migration data
-        with p.open('r', encoding='utf-8') as fp:
-            data = json.load(fp)
-            migrations = data['migrations']
+        data = _load_json_file_mut(p)
+        migrations = data['migrations']
 
         # check if we should add it
         our_migrations = diff.to_dict()
@@ -712,6 +1145,221 @@ class Table(metaclass=TableMeta):
 
         return False
 
+    @classmethod
+    def plan(cls, *, directory='migrations', run_migrations=True):
+        """Returns the SQL that :meth:`create` would run without running it.
+
+        Returns
+        --------
+        Optional[str]
+            The SQL to run or ``None`` if there's nothing to do.
+        """
+        directory = Path(directory) / cls.__tablename__
+        p = directory.with_suffix('.json')
+        current = directory.with_name('current-' + p.name)
+
+        if not p.exists():
+            sql = cls.create_table(exists_ok=True)
+            if cls.__partition__ is not None:
+                sql = '\n'.join([sql, *cls.__partition__.create_statements(cls.__tablename__)])
+            return sql
+
+        if not run_migrations:
+            return None
+
+        diff = cls().diff(_load_json_file(current, cls.from_dict))
+        if diff.is_empty():
+            return None
+        return diff.to_sql()
+
+    @classmethod
+    async def create_partitions(cls, *, connection=None, now=None, verbose=False):
+        """Creates the partitions for the current month and the next few, if
+        they don't already exist.
+
+        This should be called regularly, e.g. daily, so that there is always
+        a partition to insert into.
+        """
+        partition = cls.__partition__
+        if partition is None:
+            raise SchemaError(f'{cls.__tablename__} is not partitioned')
+
+        sql = '\n'.join(partition.create_statements(cls.__tablename__, now=now))
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            if verbose:
+                print(sql)
+            await con.execute(sql)
+
+    _PARTITION_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+    @classmethod
+    async def partitions(cls, *, connection=None):
+        """Returns a list of ``(name, upper_bound)`` for every partition of the table.
+
+        ``upper_bound`` is ``None`` for the default partition or a ``MAXVALUE`` bound.
+        """
+        query = """SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                   FROM pg_inherits i
+                   INNER JOIN pg_class c ON c.oid = i.inhrelid
+                   WHERE i.inhparent = $1::regclass
+                   ORDER BY c.relname;
+                """
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            records = await con.fetch(query, cls.__tablename__)
+
+        result = []
+        for name, bound in records:
+            match = cls._PARTITION_UPPER_BOUND.search(bound or '')
+            upper = match and datetime.datetime.fromisoformat(match.group(1))
+            result.append((name, upper))
+        return result
+
+    @classmethod
+    async def apply_retention(cls, *, months=None, connection=None, now=None):
+        """Archives and drops partitions that are entirely older than ``months`` months.
+
+        Each partition is detached, passed through the ``archive`` SQL of the
+        :class:`RangePartition` if there is one and then dropped, all in a
+        single transaction.
+
+        Returns
+        --------
+        List[str]
+            The names of the partitions that were removed.
+        """
+        partition = cls.__partition__
+        if partition is None:
+            raise SchemaError(f'{cls.__tablename__} is not partitioned')
+
+        months = months if months is not None else partition.retention
+        if months is None:
+            return []
+
+        cutoff = partition.month_start(now or datetime.datetime.utcnow(), -months)
+        removed = []
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            for name, upper in await cls.partitions(connection=con):
+                if upper is None or upper > cutoff:
+                    continue
+
+                async with con.transaction():
+                    await con.execute(f'ALTER TABLE {cls.__tablename__} DETACH PARTITION {name};')
+                    if partition.archive is not None:
+                        await con.execute(partition.archive.format(partition=name))
+                    await con.execute(f'DROP TABLE {name};')
+
+                log.info('Archived partition %s of %s.', name, cls.__tablename__)
+                removed.append(name)
+
+        return removed
+
+    @classmethod
+    async def convert_to_partitioned(cls, *, connection=None, verbose=False):
+        """Converts an existing regular table into its partitioned definition.
+
+        The old table is kept as a partition holding everything up to the end
+        of the current month so no data has to be copied. It is archived by
+        :meth:`apply_retention` like any other partition once it's old enough.
+
+        Returns
+        --------
+        bool
+            ``True`` if the table was converted, ``False`` if it already was partitioned.
+        """
+        partition = cls.__partition__
+        if partition is None:
+            raise SchemaError(f'{cls.__tablename__} is not partitioned')
+
+        table = cls.__tablename__
+        legacy = f'{table}_legacy'
+        # the current month may already have rows in the old table
+        start = partition.month_start(datetime.datetime.utcnow(), 1)
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            query = "SELECT 1 FROM pg_partitioned_table WHERE partrelid = $1::regclass;"
+            if await con.fetchval(query, table):
+                return False
+
+            statements = [
+                f'ALTER TABLE {table} RENAME TO {legacy};',
+                f'ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey;',
+            ]
+
+            # free up the index names for the new table
+            for column in cls.columns:
+                if column.index:
+                    statements.append(f'ALTER INDEX IF EXISTS {column.index_name} RENAME TO {legacy}_{column.name}_idx;')
+
+            statements.append(cls.create_table(exists_ok=False))
+            statements.extend(partition.create_statements(table, now=start))
+
+            # keep handing out ids after the old ones
+            for column in cls.columns:
+                if isinstance(column.column_type, Integer) and column.column_type.auto_increment:
+                    statements.append(f"SELECT setval(pg_get_serial_sequence('{table}', '{column.name}'), "
+                                      f"(SELECT COALESCE(MAX({column.name}), 0) + 1 FROM {legacy}), false);")
+
+            statements.append(f'ALTER TABLE {legacy} ALTER COLUMN {partition.column} SET NOT NULL;')
+            statements.append(f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+                              f"FOR VALUES FROM (MINVALUE) TO ('{start:%Y-%m-%d}');")
+
+            sql = '\n'.join(statements)
+            if verbose:
+                print(sql)
+
+            async with con.transaction():
+                await con.execute(sql)
+
+        return True
+
+    @classmethod
+    def dependencies(cls):
+        """Returns the names of the tables this table has foreign keys to."""
+        return {
+            column.column_type.table
+            for column in cls.columns
+            if isinstance(column.column_type, ForeignKey) and column.column_type.table != cls.__tablename__
+        }
+
+    @classmethod
+    def dependency_order(cls, tables):
+        """Groups tables so that every table comes after the tables it references.
+
+        Tables in the same group don't depend on each other, so they can be
+        created concurrently. References to tables that aren't in ``tables``
+        are assumed to already exist.
+
+        Returns
+        --------
+        List[List[Type[:class:`Table`]]]
+            The groups, in the order they must be created in.
+
+        Raises
+        -------
+        SchemaError
+            The foreign keys form a cycle.
+        """
+        by_name = {table.__tablename__: table for table in tables}
+        remaining = {
+            name: table.dependencies() & by_name.keys()
+            for name, table in by_name.items()
+        }
+
+        groups = []
+        while remaining:
+            ready = [name for name, needs in remaining.items() if not needs]
+            if not ready:
+                raise SchemaError('Circular foreign keys between %s' % ', '.join(sorted(remaining)))
+
+            groups.append([by_name[name] for name in ready])
+            for name in ready:
+                del remaining[name]
+            for needs in remaining.values():
+                needs.difference_update(ready)
+
+        return groups
+
     @classmethod
     async def drop(cls, *, directory='migrations', verbose=False, connection=None):
         """Drops the database and migrations, if any.
@@ -767,8 +1415,15 @@ class Table(metaclass=TableMeta):
             if col.primary_key:
                 primary_keys.append(col.name)
 
+        partition = cls.__partition__
+        if partition is not None and partition.column not in primary_keys:
+            # unique constraints on a partitioned table must include the partition key
+            primary_keys.append(partition.column)
+
         column_creations.append('PRIMARY KEY (%s)' % ', '.join(primary_keys))
         builder.append('(%s)' % ', '.join(column_creations))
+        if partition is not None:
+            builder.append('PARTITION BY RANGE (%s)' % partition.column)
         statements.append(' '.join(builder) + ';')
 
         # handle the index creations
@@ -806,6 +1461,83 @@ class Table(metaclass=TableMeta):
         async with MaybeAcquire(connection, pool=cls._pool) as con:
             await con.execute(sql, *verified.values())
 
+    @classmethod
+    async def insert_many(cls, records, *, connection=None, chunk_size=10000, conflict=None, update=None):
+        """Inserts many elements to the table using a binary ``COPY``.
+
+        Unlike :meth:`insert` the values are not type checked, only the
+        column names of the first record are verified and every other
+        record must have the same keys.
+
+        Parameters
+        -----------
+        records: List[dict]
+            The rows to insert, mapping column name to value.
+        connection: Optional[asyncpg.Connection]
+            The connection to use, if not provided will acquire one from
+            the internal pool.
+        chunk_size: int
+            The maximum number of rows to send in a single ``COPY``.
+        conflict: Optional[Tuple[str]]
+            The conflict target columns. If given, the rows are upserted with
+            ``ON CONFLICT (conflict) DO UPDATE``. The rows must not conflict
+            with each other.
+        update: Union[Dict[str, str], Iterable[str]]
+            The columns to update on conflict. A dict maps a column to the SQL
+            expression to set it to, e.g. ``{'total': 'emoji_stats.total + excluded.total'}``
+            otherwise the columns are set to ``excluded.<column>``.
+
+        Returns
+        --------
+        int
+            The number of rows sent.
+        """
+
+        if not records:
+            return 0
+
+        columns = tuple(records[0])
+        valid = {column.name for column in cls.columns}
+        invalid = [name for name in columns if name not in valid]
+        if invalid:
+            raise TypeError('invalid columns for %s: %s' % (cls.__tablename__, ', '.join(invalid)))
+
+        try:
+            rows = [tuple(record[name] for name in columns) for record in records]
+        except KeyError as e:
+            raise TypeError('every record must have the same columns, missing %s' % e) from None
+
+        if conflict is None:
+            target = cls.__tablename__
+            finalize = None
+        else:
+            if isinstance(update, dict):
+                assignments = ', '.join('%s = %s' % pair for pair in update.items())
+            else:
+                assignments = ', '.join('{0} = excluded.{0}'.format(name) for name in update or ())
+
+            target = '_%s_staging' % cls.__tablename__
+            action = 'DO UPDATE SET ' + assignments if assignments else 'DO NOTHING'
+            finalize = 'INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT ({3}) {4};'.format(
+                cls.__tablename__, ', '.join(columns), target, ', '.join(conflict), action
+            )
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            async with con.transaction():
+                if finalize is not None:
+                    await con.execute('CREATE TEMPORARY TABLE {0} (LIKE {1} INCLUDING DEFAULTS) ON COMMIT DROP;'.format(target, cls.__tablename__))
+
+                for index in range(0, len(rows), chunk_size):
+                    await con.copy_records_to_table(target, records=rows[index:index + chunk_size], columns=columns)
+
+                if finalize is not None:
+                    await con.execute(finalize)
+                    # ON COMMIT DROP only fires when the outermost transaction commits, so a
+                    # second call on the same connection in that transaction would collide
+                    await con.execute('DROP TABLE {0};'.format(target))
+
+        return len(rows)
+
     @classmethod
     def to_dict(cls):
         x = {}
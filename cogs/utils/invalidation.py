@@ -0,0 +1,110 @@
+import asyncio
+import json
+import logging
+import uuid
+
+from . import cache
+
+log = logging.getLogger(__name__)
+
+class InvalidationBus:
+    """Broadcasts cache invalidations to every process using the same database.
+
+    Invalidating a cache created with ``cache.cache(name=...)`` sends a
+    ``NOTIFY`` with the cache name and key. Every other process listening
+    on the channel then applies the same invalidation to its own copy
+    of that cache.
+
+    A dedicated connection is held from the pool for ``LISTEN``.
+
+    The ``NOTIFY`` is sent on a pool connection of its own as soon as a
+    cache is invalidated, so caches must only be invalidated after the
+    write that made them stale has been committed. Otherwise another
+    process could reload the old row before the write is visible to it.
+    """
+
+    CHANNEL = 'rbp_cache_invalidation'
+
+    def __init__(self, pool, *, channel=CHANNEL, loop=None):
+        self.pool = pool
+        self.channel = channel
+        self.loop = loop or asyncio.get_event_loop()
+        # used to ignore our own notifications
+        self.origin = uuid.uuid4().hex
+        self._connection = None
+        self._closed = False
+
+    async def start(self):
+        """Starts listening for invalidations and publishing our own."""
+        self._closed = False
+        self._connection = con = await self.pool.acquire()
+        await con.add_listener(self.channel, self._on_notification)
+        con.add_termination_listener(self._on_termination)
+        cache.set_invalidation_publisher(self._publish)
+
+    async def close(self):
+        self._closed = True
+        cache.set_invalidation_publisher(None)
+        con, self._connection = self._connection, None
+        if con is not None and not con.is_closed():
+            await con.remove_listener(self.channel, self._on_notification)
+            await self.pool.release(con)
+
+    def _on_termination(self, con):
+        if self._closed:
+            return
+
+        log.warning('Lost the cache invalidation connection, reconnecting.')
+        self._connection = None
+        self.loop.create_task(self._reconnect(con))
+
+    async def _reconnect(self, lost):
+        # give the dead connection back so the pool can replace it
+        try:
+            await self.pool.release(lost)
+        except Exception:
+            lost.terminate()
+
+        delay = 1.0
+        while not self._closed:
+            try:
+                await self.start()
+            except Exception:
+                log.exception('Could not reconnect the cache invalidation bus, retrying in %.0fs.', delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+            else:
+                # anything could have changed while we weren't listening
+                for wrapper in cache.named_caches.values():
+                    wrapper.clear()
+                return
+
+    def _publish(self, name, method, key):
+        payload = json.dumps({'o': self.origin, 'c': name, 'm': method, 'k': key}, separators=(',', ':'))
+        self.loop.create_task(self.publish(payload))
+
+    async def publish(self, payload):
+        try:
+            await self.pool.execute('SELECT pg_notify($1, $2);', self.channel, payload)
+        except Exception:
+            log.exception('Failed to publish cache invalidation %s', payload)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            log.warning('Received malformed cache invalidation %r', payload)
+            return
+
+        if data.get('o') == self.origin:
+            return
+
+        wrapper = cache.named_caches.get(data.get('c'))
+        if wrapper is None:
+            return
+
+        key = data.get('k')
+        if data.get('m') == 'key':
+            wrapper.invalidate_key(tuple(key), publish=False)
+        else:
+            wrapper.invalidate_containing(key, publish=False)
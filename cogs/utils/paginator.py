@@ -124,6 +124,84 @@ class SimplePageSource(menus.ListPageSource):
         menu.embed.description = '\n'.join(pages)
         return menu.embed
 
+class LazyPageSource(menus.PageSource):
+    """A page source that pulls entries from an async iterator as the
+    pages are requested and knows its page count once it runs out.
+    """
+
+    def __init__(self, iterator, *, per_page):
+        self.iterator = iterator
+        self.per_page = per_page
+        # every entry fetched so far
+        self.entries = []
+        self.exhausted = False
+
+    async def _fetch_until(self, count):
+        while not self.exhausted and len(self.entries) < count:
+            try:
+                self.entries.append(await self.iterator.__anext__())
+            except StopAsyncIteration:
+                self.exhausted = True
+
+    async def prepare(self):
+        # one more than a page to know whether there's more than one
+        await self._fetch_until(self.per_page + 1)
+
+    async def is_empty(self):
+        await self.prepare()
+        return not self.entries
+
+    def is_paginating(self):
+        return len(self.entries) > self.per_page
+
+    def get_max_pages(self):
+        if not self.exhausted:
+            return None
+        pages, left_over = divmod(len(self.entries), self.per_page)
+        return pages + bool(left_over)
+
+    async def get_page(self, page_number):
+        if page_number < 0:
+            raise IndexError('Negative page number.')
+
+        base = page_number * self.per_page
+        await self._fetch_until(base + self.per_page + 1)
+        if base >= len(self.entries) and page_number != 0:
+            raise IndexError('Page number out of range.')
+
+        if self.per_page == 1:
+            return self.entries[base]
+        return self.entries[base:base + self.per_page]
+
+class LazySimplePageSource(LazyPageSource):
+    """Like :class:`SimplePageSource` except entries are pulled from an
+    async iterator as the pages are requested.
+    """
+
+    def __init__(self, iterator, *, per_page=12):
+        super().__init__(iterator, per_page=per_page)
+        self.initial_page = True
+
+    async def format_page(self, menu, entries):
+        pages = []
+        for index, entry in enumerate(entries, start=menu.current_page * self.per_page):
+            pages.append(f'{index + 1}. {entry}')
+
+        maximum = self.get_max_pages()
+        if maximum is None:
+            menu.embed.set_footer(text=f'Page {menu.current_page + 1}')
+        elif maximum > 1:
+            footer = f'Page {menu.current_page + 1}/{maximum} ({len(self.entries)} entries)'
+            menu.embed.set_footer(text=footer)
+
+        if self.initial_page and self.is_paginating():
+            pages.append('')
+            pages.append('Confused? React with \N{INFORMATION SOURCE} for more info.')
+            self.initial_page = False
+
+        menu.embed.description = '\n'.join(pages)
+        return menu.embed
+
 class SimplePages(RoboPages):
     """A simple pagination session reminiscent of the old Pages interface.
 
@@ -133,3 +211,12 @@ class SimplePages(RoboPages):
     def __init__(self, entries, *, per_page=12):
         super().__init__(SimplePageSource(entries, per_page=per_page))
         self.embed = discord.Embed(colour=discord.Colour.blurple())
+
+class LazySimplePages(RoboPages):
+    """A :class:`SimplePages` that takes an async iterator of entries,
+    e.g. a :class:`db.KeysetPaginator`, and only fetches what is viewed.
+    """
+
+    def __init__(self, iterator, *, per_page=12):
+        super().__init__(LazySimplePageSource(iterator, per_page=per_page))
+        self.embed = discord.Embed(colour=discord.Colour.blurple())
@@ -0,0 +1,233 @@
+import asyncio
+import inspect
+import logging
+import time
+
+from collections import deque
+
+try:
+    from asyncpg.pool import PoolConnectionHolder
+except ImportError:
+    PoolConnectionHolder = None
+
+from . import querystats
+
+log = logging.getLogger(__name__)
+
+class PoolSample:
+    __slots__ = ('when', 'size', 'in_use', 'waiters', 'acquire_wait')
+
+    def __init__(self, when, size, in_use, waiters, acquire_wait):
+        self.when = when
+        self.size = size
+        self.in_use = in_use
+        self.waiters = waiters
+        self.acquire_wait = acquire_wait
+
+    @property
+    def utilisation(self):
+        return self.in_use / self.size if self.size else 1.0
+
+def _supports_resizing(pool):
+    """Checks that the asyncpg internals the manager relies on are all there."""
+    if PoolConnectionHolder is None:
+        return False
+
+    try:
+        queue = pool._queue
+        pool._holders, pool._maxsize, pool._minsize
+        pool._max_queries, pool._setup, pool._max_inactive_connection_lifetime
+        queue._maxsize, queue._getters
+    except AttributeError:
+        return False
+
+    try:
+        parameters = inspect.signature(PoolConnectionHolder).parameters
+    except (TypeError, ValueError):
+        return False
+    return {'max_queries', 'setup', 'max_inactive_time'} <= parameters.keys()
+
+class PoolManager:
+    """Resizes an asyncpg pool based on how busy it is.
+
+    Every ``interval`` seconds the number of connections in use, the number
+    of tasks waiting in ``Pool.acquire`` and the average acquire wait since
+    the last sample are recorded. The pool grows by ``step`` connections
+    once it has been saturated for ``grow_after`` samples in a row and
+    shrinks by ``step`` once it has been mostly idle for ``shrink_after``
+    samples in a row, always staying within ``min_size`` and ``max_size``.
+
+    asyncpg has no public API for this so it touches the pool's internals,
+    the same ones ``bothealth`` reads. These are unchanged from asyncpg 0.21
+    through 0.32, which is why requirements.txt pins it to that range. They're
+    checked when the manager is created and if any is missing it's disabled,
+    leaving the pool at whatever size it was created with.
+
+    Parameters
+    -----------
+    pool: asyncpg.pool.Pool
+        The pool to manage.
+    min_size: int
+        The smallest the pool may shrink to.
+    max_size: int
+        The largest the pool may grow to.
+    step: int
+        How many connections to add or remove at once.
+    interval: float
+        The number of seconds between samples.
+    high_water: float
+        The fraction of connections in use that counts as saturated.
+    low_water: float
+        The fraction of connections in use that counts as idle.
+    warn_waiters: int
+        The number of waiters that triggers a warning. These are logged
+        as warnings which the stats cog forwards to the gateway webhook.
+    """
+
+    WARNING_COOLDOWN = 300.0
+
+    def __init__(self, pool, *, min_size=20, max_size=40, step=2, interval=5.0, high_water=0.9,
+                 low_water=0.3, grow_after=2, shrink_after=12, warn_waiters=5, loop=None):
+        if min_size > max_size:
+            raise ValueError('min_size cannot be greater than max_size')
+
+        self.pool = pool
+        self.min_size = min_size
+        self.max_size = max_size
+        self.step = step
+        self.interval = interval
+        self.high_water = high_water
+        self.low_water = low_water
+        self.grow_after = grow_after
+        self.shrink_after = shrink_after
+        self.warn_waiters = warn_waiters
+        self.loop = loop or asyncio.get_event_loop()
+
+        self.samples = deque(maxlen=120)
+        self.grown = 0
+        self.shrunk = 0
+        self._busy = 0
+        self._idle = 0
+        self._last_warning = 0.0
+        self._last_acquires = 0
+        self._last_acquire_time = 0.0
+        self._task = None
+
+        self.enabled = _supports_resizing(pool)
+        if not self.enabled:
+            log.warning('This version of asyncpg is not supported by the pool manager, the pool will not be resized.')
+
+    def __repr__(self):
+        return f'<PoolManager size={self.size} min_size={self.min_size} max_size={self.max_size}>'
+
+    @property
+    def size(self):
+        if not self.enabled:
+            return self.pool.get_size()
+        return len(self.pool._holders)
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        if self._task is None or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:
+                log.exception('Unexpected error while resizing the connection pool.')
+
+    def sample(self):
+        pool = self.pool
+        recorder = querystats.recorder
+        acquires = recorder.acquires - self._last_acquires
+        acquire_time = recorder.acquire_time - self._last_acquire_time
+        self._last_acquires = recorder.acquires
+        self._last_acquire_time = recorder.acquire_time
+
+        size = len(pool._holders)
+        sample = PoolSample(
+            when=time.monotonic(),
+            size=size,
+            in_use=size - pool._queue.qsize(),
+            waiters=len(pool._queue._getters),
+            acquire_wait=acquire_time / acquires if acquires else 0.0,
+        )
+        self.samples.append(sample)
+        return sample
+
+    async def tick(self):
+        sample = self.sample()
+
+        if sample.waiters or sample.utilisation >= self.high_water:
+            self._busy += 1
+            self._idle = 0
+        elif sample.utilisation <= self.low_water:
+            self._idle += 1
+            self._busy = 0
+        else:
+            self._busy = self._idle = 0
+
+        if sample.waiters >= self.warn_waiters:
+            self.warn(sample)
+
+        if self._busy >= self.grow_after and sample.size < self.max_size:
+            self._busy = 0
+            self.grow(min(self.step, self.max_size - sample.size))
+        elif self._idle >= self.shrink_after and sample.size > self.min_size:
+            self._idle = 0
+            await self.shrink(min(self.step, sample.size - self.min_size))
+
+    def warn(self, sample):
+        now = time.monotonic()
+        if now - self._last_warning < self.WARNING_COOLDOWN:
+            return
+
+        self._last_warning = now
+        log.warning('Connection pool is saturated: %s waiters, %s/%s connections in use (max %s), '
+                    '%.2fms average acquire wait.', sample.waiters, sample.in_use, sample.size,
+                    self.max_size, sample.acquire_wait * 1000)
+
+    def _set_size(self, size):
+        pool = self.pool
+        pool._maxsize = size
+        pool._minsize = min(pool._minsize, size)
+        # the idle queue is bounded by the original max_size
+        pool._queue._maxsize = size
+
+    def grow(self, count):
+        pool = self.pool
+        self._set_size(len(pool._holders) + count)
+        for _ in range(count):
+            # holders connect lazily when they're first acquired
+            holder = PoolConnectionHolder(pool, max_queries=pool._max_queries, setup=pool._setup,
+                                          max_inactive_time=pool._max_inactive_connection_lifetime)
+            pool._holders.append(holder)
+            pool._queue.put_nowait(holder)
+
+        self.grown += count
+        log.info('Grew the connection pool by %s to %s connections.', count, len(pool._holders))
+
+    async def shrink(self, count):
+        pool = self.pool
+        removed = 0
+        while removed < count and not pool._queue.empty():
+            # everything in the queue is idle so it's safe to close
+            holder = pool._queue.get_nowait()
+            pool._holders.remove(holder)
+            await holder.close()
+            removed += 1
+
+        self._set_size(len(pool._holders))
+        self.shrunk += removed
+        if removed:
+            log.info('Shrank the connection pool by %s to %s connections.', removed, len(pool._holders))
@@ -0,0 +1,204 @@
+import bisect
+import contextvars
+import logging
+import re
+import time
+
+from collections import Counter
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# Set to something like 'Tags:tag info' by whatever is currently running
+# so queries can be attributed to the cog or command that issued them.
+origin = contextvars.ContextVar('query_origin', default=None)
+
+# string and number literals, but not $1 style parameters or identifiers like table2
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w$])\d+(?:\.\d+)?\b")
+
+class Histogram:
+    """A fixed log-scale latency histogram.
+
+    Buckets double in width from 0.1ms up to ~104s which is plenty of
+    precision for percentiles without keeping every sample around.
+    """
+
+    BOUNDS = tuple(0.0001 * 2 ** i for i in range(21))
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.total += 1
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the ``p``-th percentile."""
+        if self.total == 0:
+            return 0.0
+
+        wanted = self.total * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                break
+
+        try:
+            return self.BOUNDS[index]
+        except IndexError:
+            return float('inf')
+
+class QueryStats:
+    __slots__ = ('query', 'calls', 'errors', 'rows', 'total_time', 'max_time', 'histogram', 'origins')
+
+    def __init__(self, query):
+        self.query = query
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = Histogram()
+        self.origins = Counter()
+
+    @property
+    def average_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+class QueryRecorder:
+    """Aggregates query timings by normalized query text.
+
+    Parameters
+    -----------
+    slow_threshold: Optional[float]
+        Queries taking longer than this many seconds are logged.
+        ``None`` disables the slow query log.
+    """
+
+    MAX_NORMALIZED = 4096
+    MAX_QUERIES = 1024
+
+    def __init__(self, *, slow_threshold=0.5):
+        self.slow_threshold = slow_threshold
+        # normalized query: QueryStats
+        self.queries = {}
+        self._normalized = {}
+
+        self.acquires = 0
+        self.acquire_time = 0.0
+        self.max_acquire_time = 0.0
+        self.acquire_histogram = Histogram()
+
+    def normalize(self, query):
+        # queries are mostly the same string constants so this is cheap
+        try:
+            return self._normalized[query]
+        except KeyError:
+            if len(self._normalized) >= self.MAX_NORMALIZED:
+                self._normalized.clear()
+            # literals are folded so queries built with f-strings don't each get an entry
+            normalized = _LITERALS.sub('?', ' '.join(query.split()))
+            self._normalized[query] = normalized
+            return normalized
+
+    def record(self, query, elapsed, rows=0, *, failed=False):
+        normalized = self.normalize(query)
+        try:
+            stats = self.queries[normalized]
+        except KeyError:
+            if len(self.queries) >= self.MAX_QUERIES:
+                # make room by forgetting the least used query
+                del self.queries[min(self.queries.values(), key=lambda s: s.calls).query]
+            stats = self.queries[normalized] = QueryStats(normalized)
+
+        source = origin.get()
+        stats.calls += 1
+        stats.errors += failed
+        stats.rows += rows
+        stats.total_time += elapsed
+        stats.max_time = max(stats.max_time, elapsed)
+        stats.histogram.add(elapsed)
+        stats.origins[source] += 1
+
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            log.warning('Slow query (%.2fms, %s rows) from %s: %s', elapsed * 1000, rows, source or 'unknown', normalized)
+
+    def record_acquire(self, elapsed):
+        self.acquires += 1
+        self.acquire_time += elapsed
+        self.max_acquire_time = max(self.max_acquire_time, elapsed)
+        self.acquire_histogram.add(elapsed)
+
+    @property
+    def average_acquire_time(self):
+        return self.acquire_time / self.acquires if self.acquires else 0.0
+
+    def top(self, count=10, *, key='total_time'):
+        return sorted(self.queries.values(), key=lambda s: getattr(s, key), reverse=True)[:count]
+
+    def reset(self):
+        self.queries.clear()
+        self.acquires = 0
+        self.acquire_time = 0.0
+        self.max_acquire_time = 0.0
+        self.acquire_histogram = Histogram()
+
+recorder = QueryRecorder()
+
+def _status_rows(status):
+    # e.g. INSERT 0 5, UPDATE 3, COPY 100
+    try:
+        return int(status.rpartition(' ')[2])
+    except (AttributeError, ValueError):
+        return 0
+
+class InstrumentedConnection(asyncpg.Connection):
+    """A connection that records every query it runs in :data:`recorder`.
+
+    Passed as the ``connection_class`` of the pool, so ``bot.pool``,
+    ``ctx.db`` and anything using :class:`db.MaybeAcquire` are all covered.
+    """
+
+    async def _timed(self, query, rows, coro):
+        start = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            recorder.record(query, time.perf_counter() - start, failed=True)
+            raise
+
+        recorder.record(query, time.perf_counter() - start, rows(result))
+        return result
+
+    def execute(self, query, *args, timeout=None):
+        return self._timed(query, _status_rows, super().execute(query, *args, timeout=timeout))
+
+    def executemany(self, command, args, *, timeout=None):
+        args = list(args)
+        return self._timed(command, lambda r: len(args), super().executemany(command, args, timeout=timeout))
+
+    def fetch(self, query, *args, timeout=None, **kwargs):
+        return self._timed(query, len, super().fetch(query, *args, timeout=timeout, **kwargs))
+
+    def fetchrow(self, query, *args, timeout=None, **kwargs):
+        return self._timed(query, lambda r: r is not None, super().fetchrow(query, *args, timeout=timeout, **kwargs))
+
+    def fetchval(self, query, *args, column=0, timeout=None):
+        return self._timed(query, lambda r: r is not None, super().fetchval(query, *args, column=column, timeout=timeout))
+
+    def copy_records_to_table(self, table_name, *, records, **kwargs):
+        query = f'COPY {table_name} FROM STDIN'
+        coro = super().copy_records_to_table(table_name, records=records, **kwargs)
+        return self._timed(query, _status_rows, coro)
+
+async def timed_acquire(pool, *, timeout=None):
+    """Acquires a connection from ``pool`` recording how long it took."""
+    start = time.perf_counter()
+    connection = await pool.acquire(timeout=timeout)
+    recorder.record_acquire(time.perf_counter() - start)
+    return connection
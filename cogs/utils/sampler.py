@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import random
+
+from .cache import ExpiringCache
+
+log = logging.getLogger(__name__)
+
+class IdArray:
+    """A set of IDs that supports picking a uniformly random one in O(1).
+
+    The IDs are kept in a list along with their position in it so that
+    removing one can swap it with the last element instead of shifting
+    everything after it.
+    """
+
+    __slots__ = ('_ids', '_positions')
+
+    def __init__(self, ids=()):
+        self._ids = []
+        self._positions = {}
+        for id in ids:
+            self.add(id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, id):
+        return id in self._positions
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, id):
+        if id not in self._positions:
+            self._positions[id] = len(self._ids)
+            self._ids.append(id)
+
+    def discard(self, id):
+        try:
+            index = self._positions.pop(id)
+        except KeyError:
+            return
+
+        last = self._ids.pop()
+        if index != len(self._ids):
+            self._ids[index] = last
+            self._positions[last] = index
+
+    def choice(self, rng=random):
+        return self._ids[int(rng.random() * len(self._ids))] if self._ids else None
+
+class RandomSampler:
+    """Picks uniformly random rows per key, usually a guild ID, without ``OFFSET`` scans.
+
+    The IDs of every candidate row are loaded once per key and kept for
+    ``ttl`` seconds. New rows are added with :meth:`add` and deleted rows
+    are either removed with :meth:`discard` or found out when ``fetch``
+    returns ``None`` for them. Rejecting those and trying again keeps the
+    choice uniform over the rows that still exist.
+
+    Parameters
+    -----------
+    load
+        A coroutine called with a key that returns every candidate ID.
+    ttl: float
+        How long to keep the IDs of a key before loading them again.
+    maxsize: int
+        The maximum number of keys to keep.
+    attempts: int
+        How many deleted rows to tolerate before reloading the IDs.
+    """
+
+    def __init__(self, load, *, ttl=600.0, maxsize=256, attempts=5):
+        self._load = load
+        self.attempts = attempts
+        # key: IdArray
+        self.arrays = ExpiringCache(ttl, maxsize=maxsize)
+        # key: asyncio.Task for loads that are in-flight
+        self._pending = {}
+        # key: IDs added while their load was in-flight
+        self._added = {}
+
+    async def ids(self, key):
+        """Returns the :class:`IdArray` for a key, loading it if needed."""
+        try:
+            return self.arrays[key]
+        except KeyError:
+            pass
+
+        try:
+            task = self._pending[key]
+        except KeyError:
+            task = self._pending[key] = asyncio.ensure_future(self._load(key))
+
+            def done(fut):
+                # invalidated while loading, so the result could be stale
+                if self._pending.get(key) is not fut:
+                    return
+                del self._pending[key]
+                added = self._added.pop(key, ())
+                if not fut.cancelled() and fut.exception() is None:
+                    array = IdArray(fut.result())
+                    for id in added:
+                        array.add(id)
+                    self.arrays[key] = array
+
+            task.add_done_callback(done)
+
+        ids = await asyncio.shield(task)
+        # the callback has stored it unless it was invalidated meanwhile
+        array = self.arrays.get(key)
+        return array if array is not None else IdArray(ids)
+
+    def add(self, key, id):
+        array = self.arrays.get(key)
+        if array is not None:
+            array.add(id)
+        elif key in self._pending:
+            # the load might not see it
+            self._added.setdefault(key, set()).add(id)
+
+    def discard(self, key, id):
+        array = self.arrays.get(key)
+        if array is not None:
+            array.discard(id)
+
+    def invalidate(self, key):
+        self._pending.pop(key, None)
+        self._added.pop(key, None)
+        self.arrays.pop(key, None)
+
+    async def sample(self, key, fetch, fallback=None):
+        """Returns ``await fetch(id)`` for a uniformly random ID of the key.
+
+        ``fetch`` must return ``None`` if the row no longer exists.
+        If every ID was rejected even after reloading them then the result
+        of ``await fallback()`` is returned instead, usually a single
+        ``ORDER BY random() LIMIT 1`` query. Returns ``None`` if there are
+        no rows at all.
+        """
+        for reload in (False, True):
+            if reload:
+                log.debug('Reloading the random sample IDs for %s after %s misses.', key, self.attempts)
+                self.invalidate(key)
+
+            array = await self.ids(key)
+            for _ in range(self.attempts):
+                id = array.choice()
+                if id is None:
+                    return None
+
+                row = await fetch(id)
+                if row is not None:
+                    return row
+                array.discard(id)
+
+        if fallback is None:
+            return None
+
+        log.debug('Falling back after %s random sample misses for %s.', 2 * self.attempts, key)
+        return await fallback()
@@ -6,9 +6,12 @@ import asyncpg
 import discord
 import importlib
 import contextlib
+import time
 
 from bot import RoBoPug, initial_extensions
-from cogs.utils.db import Table
+from cogs.utils.db import Table, SchemaError
+from cogs.utils.invalidation import InvalidationBus
+from cogs.utils.pool import PoolManager
 
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
@@ -60,13 +63,22 @@ def setup_logging():
 def run_bot():
     loop = asyncio.get_event_loop()
     log = logging.getLogger()
+    min_size, max_size = getattr(config, 'pool_size', (20, 40))
     kwargs = {
         'command_timeout': 60,
-        'max_size': 20,
-        'min_size': 20,
+        'max_size': min_size,
+        'min_size': min_size,
+        # close connections that were grown for a burst and left idle
+        'max_inactive_connection_lifetime': 300.0,
+    }
+    replica = getattr(config, 'postgresql_replica', None)
+    replica_options = {
+        'max_size': 10,
+        'min_size': 2,
     }
     try:
-        pool = loop.run_until_complete(Table.create_pool(config.postgresql, **kwargs))
+        pool = loop.run_until_complete(Table.create_pool(config.postgresql, replica=replica,
+                                                         replica_options=replica_options, **kwargs))
     except Exception as e:
         click.echo('Could not set up PostgreSQL. Exiting.', file=sys.stderr)
         log.exception('Could not set up PostgreSQL. Exiting.')
@@ -74,6 +86,15 @@ def run_bot():
 
     bot = RoBoPug()
     bot.pool = pool
+    bot.read_pool = Table._read_pool
+    bot.pool_manager = PoolManager(pool, min_size=min_size, max_size=max_size, loop=loop)
+    bot.pool_manager.start()
+    bot.invalidation = InvalidationBus(pool, loop=loop)
+    try:
+        loop.run_until_complete(bot.invalidation.start())
+    except Exception:
+        log.exception('Could not start the cache invalidation bus.')
+
     bot.run()
 
 @click.group(invoke_without_command=True, options_metavar='[options]')
@@ -89,19 +110,79 @@ def main(ctx):
 def db():
     pass
 
+async def create_tables(pool, *, quiet, jobs):
+    """Creates every table, running tables that don't reference each other concurrently."""
+
+    try:
+        groups = Table.dependency_order(Table.all_tables())
+    except SchemaError as e:
+        click.echo(str(e), err=True)
+        return
+
+    semaphore = asyncio.Semaphore(jobs)
+    failed = set()
+
+    async def create(table):
+        if table.dependencies() & failed:
+            click.echo(f'[{table.__module__}] Skipping {table.__tablename__} since a table it references failed.', err=True)
+            failed.add(table.__tablename__)
+            return
+
+        async with semaphore, pool.acquire() as con:
+            start = time.perf_counter()
+            try:
+                created = await table.create(verbose=not quiet, run_migrations=False, connection=con)
+            except Exception:
+                failed.add(table.__tablename__)
+                click.echo(f'Could not create {table.__tablename__}.\n{traceback.format_exc()}', err=True)
+                return
+
+        elapsed = (time.perf_counter() - start) * 1000
+        if created:
+            click.echo(f'[{table.__module__}] Created {table.__tablename__} in {elapsed:.2f}ms.')
+        else:
+            click.echo(f'[{table.__module__}] No work needed for {table.__tablename__}.')
+
+    start = time.perf_counter()
+    for group in groups:
+        await asyncio.gather(*map(create, group))
+
+    click.echo(f'Finished in {time.perf_counter() - start:.2f}s.')
+
+def plan_tables(*, run_migrations):
+    """Prints what creating every table would do without touching the database."""
+
+    try:
+        groups = Table.dependency_order(Table.all_tables())
+    except SchemaError as e:
+        click.echo(str(e), err=True)
+        return
+
+    for index, group in enumerate(groups, start=1):
+        names = ', '.join(t.__tablename__ for t in group)
+        click.echo(f'-- Stage {index}: {names}')
+        for table in group:
+            start = time.perf_counter()
+            try:
+                sql = table.plan(run_migrations=run_migrations)
+            except Exception:
+                click.echo(f'Could not plan {table.__tablename__}.\n{traceback.format_exc()}', err=True)
+                continue
+
+            elapsed = (time.perf_counter() - start) * 1000
+            if sql is None:
+                click.echo(f'-- [{table.__module__}] No work needed for {table.__tablename__} (planned in {elapsed:.2f}ms).')
+            else:
+                click.echo(f'-- [{table.__module__}] {table.__tablename__} (planned in {elapsed:.2f}ms)\n{sql}')
+
 @db.command(short_help='initialises the databases for the bot', options_metavar='[options]')
 @click.argument('cogs', nargs=-1, metavar='[cogs]')
 @click.option('-q', '--quiet', help='less verbose output', is_flag=True)
-def init(cogs, quiet):
+@click.option('-j', '--jobs', help='how many tables to create at once', default=4, type=click.IntRange(1, None))
+@click.option('--dry-run', help='only show the statements that would run', is_flag=True)
+def init(cogs, quiet, jobs, dry_run):
     """This manages the migrations and database creation system for you."""
 
-    run = asyncio.get_event_loop().run_until_complete
-    try:
-        run(Table.create_pool(config.postgresql))
-    except Exception:
-        click.echo(f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
-        return
-
     if not cogs:
         cogs = initial_extensions
     else:
@@ -114,22 +195,24 @@ def init(cogs, quiet):
             click.echo(f'Could not load {ext}.\n{traceback.format_exc()}', err=True)
             return
 
-    for table in Table.all_tables():
-        try:
-            created = run(table.create(verbose=not quiet, run_migrations=False))
-        except Exception:
-            click.echo(f'Could not create {table.__tablename__}.\n{traceback.format_exc()}', err=True)
-        else:
-            if created:
-                click.echo(f'[{table.__module__}] Created {table.__tablename__}.')
-            else:
-                click.echo(f'[{table.__module__}] No work needed for {table.__tablename__}.')
+    if dry_run:
+        return plan_tables(run_migrations=False)
+
+    run = asyncio.get_event_loop().run_until_complete
+    try:
+        pool = run(Table.create_pool(config.postgresql, min_size=1, max_size=jobs))
+    except Exception:
+        click.echo(f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return
+
+    run(create_tables(pool, quiet=quiet, jobs=jobs))
 
 @db.command(short_help='migrates the databases')
 @click.argument('cog', nargs=1, metavar='[cog]')
 @click.option('-q', '--quiet', help='less verbose output', is_flag=True)
+@click.option('--dry-run', help='only show the changes that would be written', is_flag=True)
 @click.pass_context
-def migrate(ctx, cog, quiet):
+def migrate(ctx, cog, quiet, dry_run):
     """Update the migration file with the newest schema."""
 
     if not cog.startswith('cogs.'):
@@ -138,9 +221,12 @@ def migrate(ctx, cog, quiet):
     try:
         importlib.import_module(cog)
     except Exception:
-        click.echo(f'Could not load {ext}.\n{traceback.format_exc()}', err=True)
+        click.echo(f'Could not load {cog}.\n{traceback.format_exc()}', err=True)
         return
 
+    if dry_run:
+        return plan_tables(run_migrations=True)
+
     def work(table, *, invoked=False):
         try:
             actually_migrated = table.write_migration()
@@ -178,10 +264,23 @@ async def apply_migration(cog, quiet, index, *, downgrade=False):
         click.echo(f'Could not load {cog}.\n{traceback.format_exc()}', err=True)
         return
 
+    try:
+        groups = Table.dependency_order(Table.all_tables())
+    except SchemaError as e:
+        click.echo(str(e), err=True)
+        return
+
+    # downgrades have to undo things in the opposite order
+    if downgrade:
+        groups.reverse()
+
+    tables = [table for group in groups for table in group]
+
+    # migrations are applied in a single transaction so they can't run concurrently
     async with pool.acquire() as con:
         tr = con.transaction()
         await tr.start()
-        for table in Table.all_tables():
+        for table in tables:
             try:
                 await table.migrate(index=index, downgrade=downgrade, verbose=not quiet, connection=con)
             except RuntimeError as e:
@@ -209,6 +308,49 @@ def downgrade(cog, quiet, index):
     run = asyncio.get_event_loop().run_until_complete
     run(apply_migration(cog, quiet, index, downgrade=True))
 
+async def partition_tables(pool, quiet):
+    async with pool.acquire() as con:
+        for table in Table.all_tables():
+            if table.__partition__ is None:
+                continue
+
+            try:
+                converted = await table.convert_to_partitioned(connection=con, verbose=not quiet)
+            except Exception:
+                click.echo(f'Could not partition {table.__tablename__}.\n{traceback.format_exc()}', err=True)
+                continue
+
+            if converted:
+                click.echo(f'[{table.__module__}] Converted {table.__tablename__} to a partitioned table.')
+            else:
+                click.echo(f'[{table.__module__}] {table.__tablename__} is already partitioned.')
+
+@db.command(short_help='converts tables to their partitioned definitions')
+@click.argument('cog', nargs=1, metavar='[cog]')
+@click.option('-q', '--quiet', help='less verbose output', is_flag=True)
+def partition(cog, quiet):
+    """Converts existing tables of a cog that are declared as partitioned.
+
+    The existing rows are kept in place as the oldest partition.
+    """
+    run = asyncio.get_event_loop().run_until_complete
+    try:
+        pool = run(Table.create_pool(config.postgresql))
+    except Exception:
+        click.echo(f'Could not create PostgreSQL connection pool.\n{traceback.format_exc()}', err=True)
+        return
+
+    if not cog.startswith('cogs.'):
+        cog = f'cogs.{cog}'
+
+    try:
+        importlib.import_module(cog)
+    except Exception:
+        click.echo(f'Could not load {cog}.\n{traceback.format_exc()}', err=True)
+        return
+
+    run(partition_tables(pool, quiet))
+
 async def remove_databases(pool, cog, quiet):
     async with pool.acquire() as con:
         tr = con.transaction()